@@ -151,7 +151,13 @@ class ActivityUpdater(SectionView):
             else:
                 message = _('Looking for updates...')
         elif state == updater.STATE_DOWNLOADING:
-            message = _('Downloading %s...') % bundle_name
+            rate = self._model.get_download_rate()
+            if rate:
+                # TRANS: e.g. 'Downloading Paint (250 KiB/s)...'
+                message = _('Downloading %(name)s (%(rate)s/s)...') % \
+                    {'name': bundle_name, 'rate': _format_size(rate)}
+            else:
+                message = _('Downloading %s...') % bundle_name
         elif state == updater.STATE_UPDATING:
             message = _('Updating %s...') % bundle_name
 
@@ -44,13 +44,16 @@ class IconModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
     }
 
     _PAGE_SIZE = 100
+    # Entries carry their preview, keep the cache small
+    _MAX_PAGES_TO_CACHE = 5
 
     def __init__(self, query):
         GObject.GObject.__init__(self)
 
         self._last_requested_index = None
         self._cached_row = None
-        self._result_set = model.find(query, IconModel._PAGE_SIZE)
+        self._result_set = model.find(query, IconModel._PAGE_SIZE,
+                                      IconModel._MAX_PAGES_TO_CACHE)
         self._temp_drag_file_path = None
 
         # HACK: The view will tell us that it is resizing so the model can
@@ -15,6 +15,7 @@
 
 import logging
 import time
+from collections import OrderedDict
 
 import json
 from gi.repository import GObject
@@ -34,12 +35,132 @@ DS_DBUS_INTERFACE = 'org.laptop.sugar.DataStore'
 DS_DBUS_PATH = '/org/laptop/sugar/DataStore'
 
 
+def _get_uid(metadata):
+    return metadata['uid']
+
+
+def _get_favorite(metadata):
+    return metadata.get('keep', '0') == '1'
+
+
+def _get_icon_color(metadata):
+    if misc.is_activity_bundle(metadata):
+        return XoColor('%s,%s' % (style.COLOR_BUTTON_GREY.get_svg(),
+                                  style.COLOR_TRANSPARENT.get_svg()))
+    else:
+        return misc.get_icon_color(metadata)
+
+
+def _get_title(metadata):
+    title = GObject.markup_escape_text(metadata.get('title', _('Untitled')))
+    return '<b>%s</b>' % (title, )
+
+
+def _get_timestamp(metadata):
+    try:
+        timestamp = float(metadata.get('timestamp', 0))
+    except (TypeError, ValueError):
+        return _('Unknown')
+    else:
+        return util.timestamp_to_elapsed_string(timestamp)
+
+
+def _get_creation_time(metadata):
+    try:
+        creation_time = float(metadata.get('creation_time'))
+    except (TypeError, ValueError):
+        return _('Unknown')
+    else:
+        return util.timestamp_to_elapsed_string(creation_time)
+
+
+def _get_filesize(metadata):
+    try:
+        size = int(metadata.get('filesize'))
+    except (TypeError, ValueError):
+        size = None
+    return util.format_size(size)
+
+
+def _get_progress(metadata):
+    try:
+        return int(float(metadata.get('progress', 100)))
+    except (TypeError, ValueError):
+        return 100
+
+
+def _get_buddies(metadata):
+    buddies = []
+    if metadata.get('buddies'):
+        try:
+            buddies = json.loads(metadata['buddies']).values()
+        except json.decoder.JSONDecodeError as exception:
+            logging.warning('Cannot decode buddies for %r: %s',
+                            metadata['uid'], exception)
+
+    if not isinstance(buddies, list):
+        logging.warning('Content of buddies for %r is not a list: %r',
+                        metadata['uid'], buddies)
+        buddies = []
+
+    values = []
+    for n_ in xrange(0, 3):
+        if buddies:
+            try:
+                nick, color = buddies.pop(0)
+            except (AttributeError, ValueError) as exception:
+                logging.warning('Malformed buddies for %r: %s',
+                                metadata['uid'], exception)
+            else:
+                values.append([nick, XoColor(color)])
+                continue
+
+        values.append(None)
+    return values
+
+
+class _Row(object):
+    """Journal entry whose columns are only computed when requested"""
+
+    def __init__(self, metadata):
+        self._metadata = metadata
+        self._values = {}
+
+    def is_valid_for(self, metadata):
+        return self._metadata.get('mtime') == metadata.get('mtime') and \
+            self._metadata.get('timestamp') == metadata.get('timestamp')
+
+    def forget(self, columns):
+        for column in columns:
+            self._values.pop(column, None)
+
+    def get(self, column):
+        if column in self._values:
+            return self._values[column]
+
+        if column in _BUDDY_COLUMNS:
+            # The three buddy columns come from a single decode
+            for buddy_column, value in zip(_BUDDY_COLUMNS,
+                                           _get_buddies(self._metadata)):
+                self._values[buddy_column] = value
+            return self._values[column]
+
+        getter = _COLUMN_GETTERS.get(column)
+        if getter is None:
+            return None
+        value = self._values[column] = getter(self._metadata)
+        return value
+
+
 class ListModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
     __gtype_name__ = 'JournalListModel'
 
     __gsignals__ = {
         'ready': (GObject.SignalFlags.RUN_FIRST, None, ([])),
         'progress': (GObject.SignalFlags.RUN_FIRST, None, ([])),
+        # Emitted once, when the first rows are available while the
+        # result set is still being set up
+        'partial-ready': (GObject.SignalFlags.RUN_FIRST, None, ([])),
     }
 
     COLUMN_UID = 0
@@ -73,13 +194,16 @@ class ListModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
     }
 
     _PAGE_SIZE = 10
+    _ROW_CACHE_SIZE = 200
 
     def __init__(self, query):
         GObject.GObject.__init__(self)
 
         self._last_requested_index = None
         self._temp_drag_file_uid = None
-        self._cached_row = None
+        self._last_row = None
+        # Recently drawn rows, by uid
+        self._rows = OrderedDict()
         self._query = query
         self._all_ids = []
         t = time.time()
@@ -96,21 +220,125 @@ class ListModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
         # to regenerate the model and stuff up the scroll position
         self._updated_entries = {}
 
+        self._partial_ready = False
+        self._ready = False
         self._result_set.ready.connect(self.__result_set_ready_cb)
         self._result_set.progress.connect(self.__result_set_progress_cb)
+        self._result_set.entries_added.connect(
+            self.__result_set_entries_added_cb)
+        self._result_set.page_loaded.connect(
+            self.__result_set_page_loaded_cb)
+        model.updated.connect(self.__model_updated_cb)
 
     def get_all_ids(self):
         return self._all_ids
 
+    def update_entry(self, uid, callback, *args):
+        """Reflect a created or updated entry in place, moving its row if
+        its sort position changed. The position is looked up without
+        blocking, callback is then called with whether the model could
+        tell where the entry goes, followed by args. The model has to be
+        rebuilt if it could not.
+        """
+        if not self._ready:
+            callback(False, *args)
+            return
+
+        try:
+            metadata = model.get(uid)
+        except Exception:
+            logging.exception('Could not fetch the properties of %r', uid)
+            callback(False, *args)
+            return
+
+        old_position = self._get_position(uid)
+
+        def reply_handler(position):
+            # Another change moved the entry while the position was
+            # looked up
+            if position is None or \
+                    self._get_position(uid) != old_position:
+                callback(False, *args)
+                return
+            self._move_entry(uid, old_position, position, metadata)
+            callback(True, *args)
+
+        def error_handler(error):
+            logging.error('Could not find the position of %r: %s', uid,
+                          error)
+            callback(False, *args)
+
+        self._result_set.get_entry_position(metadata, old_position,
+                                            reply_handler, error_handler)
+
+    def _get_position(self, uid):
+        if uid in self._all_ids:
+            return self._all_ids.index(uid)
+        return -1
+
+    def remove_entry(self, uid):
+        """Remove the row of a deleted entry. Returns False if the model
+        has to be rebuilt instead.
+        """
+        if not self._ready:
+            return False
+
+        if uid in self._all_ids:
+            self._move_entry(uid, self._all_ids.index(uid), -1, None)
+        return True
+
+    def _move_entry(self, uid, old_position, position, metadata):
+        position = self._result_set.move_entry(old_position, position,
+                                               metadata)
+        self._invalidate_row(uid)
+        self._updated_entries.pop(uid, None)
+
+        if old_position != -1 and old_position != position:
+            del self._all_ids[old_position]
+            self.row_deleted(Gtk.TreePath((old_position,)))
+            if uid in self._selected:
+                self._selected.remove(uid)
+
+        if position == -1:
+            return
+
+        path = Gtk.TreePath((position,))
+        if old_position == position:
+            self.row_changed(path, self.get_iter(path))
+        else:
+            self._all_ids.insert(position, uid)
+            self.row_inserted(path, self.get_iter(path))
+
     def __result_set_ready_cb(self, **kwargs):
         t = time.time()
         self._all_ids = self._result_set.find_ids(self._query)
         logging.debug('get all ids: %r', time.time() - t)
+        self._ready = True
         self.emit('ready')
 
     def __result_set_progress_cb(self, **kwargs):
         self.emit('progress')
 
+    def __result_set_entries_added_cb(self, **kwargs):
+        # Rows after the insertion points have moved
+        self._last_requested_index = None
+
+        for position in kwargs['positions']:
+            iterator = self.get_iter(Gtk.TreePath((position,)))
+            self.row_inserted(Gtk.TreePath((position,)), iterator)
+
+        if not self._partial_ready:
+            self._partial_ready = True
+            self.emit('partial-ready')
+
+    def __result_set_page_loaded_cb(self, **kwargs):
+        # Replace the placeholders shown while the page was loading
+        end = min(kwargs['offset'] + kwargs['count'],
+                  self._result_set.length)
+        for index in xrange(kwargs['offset'], end):
+            path = Gtk.TreePath((index,))
+            self.row_changed(path, self.get_iter(path))
+
     def setup(self, updated_callback=None):
         self._result_set.setup()
         self._updated_callback = updated_callback
@@ -142,6 +370,7 @@ class ListModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
         if column == ListModel.COLUMN_TITLE:
             metadata['title'] = value
         self._updated_entries[metadata['uid']] = metadata
+        self._invalidate_row(metadata['uid'])
         if self._updated_callback is not None:
             model.updated.disconnect(self._updated_callback)
         model.write(metadata, update_mtime=False,
@@ -157,87 +386,48 @@ class ListModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
 
         index = iterator.user_data
         if index == self._last_requested_index:
-            return self._cached_row[column]
+            return self._last_row.get(column)
 
         if index >= self._result_set.length:
             return None
 
+        # Do not block drawing on the datastore, an empty row is shown
+        # until the page arrives and row-changed is emitted
         self._result_set.seek(index)
-        metadata = self._result_set.read()
+        metadata = self._result_set.read(block=False)
+        if metadata is None:
+            return None
+
         metadata.update(self._updated_entries.get(metadata['uid'], {}))
 
         self._last_requested_index = index
-        self._cached_row = []
-        self._cached_row.append(metadata['uid'])
-        self._cached_row.append(metadata.get('keep', '0') == '1')
-        self._cached_row.append(misc.get_icon_name(metadata))
-
-        if misc.is_activity_bundle(metadata):
-            xo_color = XoColor('%s,%s' % (style.COLOR_BUTTON_GREY.get_svg(),
-                                          style.COLOR_TRANSPARENT.get_svg()))
-        else:
-            xo_color = misc.get_icon_color(metadata)
-        self._cached_row.append(xo_color)
-
-        title = GObject.markup_escape_text(metadata.get('title',
-                                                        _('Untitled')))
-        self._cached_row.append('<b>%s</b>' % (title, ))
-
-        try:
-            timestamp = float(metadata.get('timestamp', 0))
-        except (TypeError, ValueError):
-            timestamp_content = _('Unknown')
-        else:
-            timestamp_content = util.timestamp_to_elapsed_string(timestamp)
-        self._cached_row.append(timestamp_content)
-
-        try:
-            creation_time = float(metadata.get('creation_time'))
-        except (TypeError, ValueError):
-            self._cached_row.append(_('Unknown'))
-        else:
-            self._cached_row.append(
-                util.timestamp_to_elapsed_string(float(creation_time)))
-
-        try:
-            size = int(metadata.get('filesize'))
-        except (TypeError, ValueError):
-            size = None
-        self._cached_row.append(util.format_size(size))
-
-        try:
-            progress = int(float(metadata.get('progress', 100)))
-        except (TypeError, ValueError):
-            progress = 100
-        self._cached_row.append(progress)
-
-        buddies = []
-        if metadata.get('buddies'):
-            try:
-                buddies = json.loads(metadata['buddies']).values()
-            except json.decoder.JSONDecodeError as exception:
-                logging.warning('Cannot decode buddies for %r: %s',
-                                metadata['uid'], exception)
-
-        if not isinstance(buddies, list):
-            logging.warning('Content of buddies for %r is not a list: %r',
-                            metadata['uid'], buddies)
-            buddies = []
-
-        for n_ in xrange(0, 3):
-            if buddies:
-                try:
-                    nick, color = buddies.pop(0)
-                except (AttributeError, ValueError) as exception:
-                    logging.warning('Malformed buddies for %r: %s',
-                                    metadata['uid'], exception)
-                else:
-                    self._cached_row.append([nick, XoColor(color)])
-                    continue
+        self._last_row = self._get_row(metadata)
+        return self._last_row.get(column)
+
+    def _get_row(self, metadata):
+        uid = metadata['uid']
+        row = self._rows.pop(uid, None)
+        if row is None or not row.is_valid_for(metadata):
+            row = _Row(metadata)
+
+        self._rows[uid] = row
+        if len(self._rows) > ListModel._ROW_CACHE_SIZE:
+            self._rows.popitem(last=False)
+        return row
+
+    def _invalidate_row(self, uid):
+        self._rows.pop(uid, None)
+        self._last_requested_index = None
 
-            self._cached_row.append(None)
+    def __model_updated_cb(self, sender, signal, object_id):
+        self._invalidate_row(object_id)
 
-        return self._cached_row[column]
+    def update_dates(self):
+        """Forget the elapsed time strings, so they are computed again
+        when the rows are next drawn.
+        """
+        for row in self._rows.itervalues():
+            row.forget(_DATE_COLUMNS)
 
     def do_iter_nth_child(self, parent_iter, n):
         return (False, None)
@@ -315,3 +505,21 @@ class ListModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource):
 
     def select_none(self):
         self._selected = []
+
+
+_COLUMN_GETTERS = {
+    ListModel.COLUMN_UID: _get_uid,
+    ListModel.COLUMN_FAVORITE: _get_favorite,
+    ListModel.COLUMN_ICON: misc.get_icon_name,
+    ListModel.COLUMN_ICON_COLOR: _get_icon_color,
+    ListModel.COLUMN_TITLE: _get_title,
+    ListModel.COLUMN_TIMESTAMP: _get_timestamp,
+    ListModel.COLUMN_CREATION_TIME: _get_creation_time,
+    ListModel.COLUMN_FILESIZE: _get_filesize,
+    ListModel.COLUMN_PROGRESS: _get_progress,
+}
+
+_BUDDY_COLUMNS = (ListModel.COLUMN_BUDDY_1, ListModel.COLUMN_BUDDY_2,
+                  ListModel.COLUMN_BUDDY_3)
+
+_DATE_COLUMNS = (ListModel.COLUMN_TIMESTAMP, ListModel.COLUMN_CREATION_TIME)
@@ -223,14 +223,39 @@ class BaseListView(Gtk.Bin):
 
     def __model_created_cb(self, sender, signal, object_id):
         if self._is_new_item_visible(object_id):
-            self._set_dirty()
+            self._update_entry(object_id)
 
     def __model_updated_cb(self, sender, signal, object_id):
         if self._is_new_item_visible(object_id):
-            self._set_dirty()
+            self._update_entry(object_id)
 
     def __model_deleted_cb(self, sender, signal, object_id):
         if self._is_new_item_visible(object_id):
+            self._update_entry(object_id, deleted=True)
+
+    def _update_entry(self, object_id, deleted=False):
+        """Update the row of a single entry instead of rebuilding the
+        model, when the model is shown and can tell where it goes.
+        """
+        if self._updates_disabled or self._dirty or self._model is None or \
+                self.tree_view.get_model() is not self._model:
+            self._set_dirty()
+            return
+
+        was_empty = len(self._model) == 0
+        if deleted:
+            self._entry_updated(self._model.remove_entry(object_id),
+                                self._model, was_empty)
+        else:
+            self._model.update_entry(object_id, self._entry_updated,
+                                     self._model, was_empty)
+
+    def _entry_updated(self, handled, list_model, was_empty):
+        # The model may have been replaced while the entry was looked up
+        if list_model is not self._model:
+            return
+        # The empty message is only updated by a refresh
+        if not handled or was_empty or len(self._model) == 0:
             self._set_dirty()
 
     def _is_new_item_visible(self, object_id):
@@ -468,15 +493,30 @@ class BaseListView(Gtk.Bin):
 
         self._model = ListModel(self._query)
         self._model.connect('ready', self.__model_ready_cb)
+        self._model.connect('partial-ready', self.__model_partial_ready_cb)
         self._model.connect('progress', self.__model_progress_cb)
         self._model.setup(self.__model_updated_cb)
         window = self.get_toplevel().get_window()
         if window is not None:
             window.set_cursor(None)
 
+    def __model_partial_ready_cb(self, tree_model):
+        # Show the rows found so far, the rest will be inserted as
+        # the result set finds them
+        self._stop_progress_bar()
+        self._clear_message()
+        self.tree_view.set_model(self._model)
+
     def __model_ready_cb(self, tree_model):
         self._stop_progress_bar()
 
+        if self.tree_view.get_model() is self._model:
+            # Rows were streamed in already, keep the scroll position
+            if self._backup_selected is not None:
+                tree_model.restore_selection(self._backup_selected)
+                self.emit('selection-changed', len(self._backup_selected))
+            return
+
         self._scroll_position = self.tree_view.props.vadjustment.props.value
         logging.debug('ListView.__model_ready_cb %r', self._scroll_position)
 
@@ -547,6 +587,9 @@ class BaseListView(Gtk.Bin):
                     self._query.get('activity'))
 
     def __model_progress_cb(self, tree_model):
+        if self.tree_view.get_model() is self._model:
+            return
+
         if self._progress_bar is None:
             self._start_progress_bar()
 
@@ -637,6 +680,7 @@ class BaseListView(Gtk.Bin):
 
         path, end_path = visible_range
         tree_model = self.tree_view.get_model()
+        tree_model.update_dates()
 
         while True:
             cel_rect = self.tree_view.get_cell_area(path,
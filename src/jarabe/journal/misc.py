@@ -18,6 +18,8 @@ import logging
 import time
 import os
 import hashlib
+import shutil
+from collections import OrderedDict
 from gettext import gettext as _
 
 from gi.repository import Gio
@@ -37,6 +39,7 @@ from sugar3.bundle.bundle import AlreadyInstalledException
 from sugar3.bundle.contentbundle import ContentBundle
 from sugar3 import util
 from sugar3 import profile
+from sugar3 import env
 
 from jarabe.view import launcher
 from jarabe.view import alerts
@@ -47,6 +50,109 @@ from jarabe.journal import journalwindow
 
 PROJECT_BUNDLE_ID = 'org.sugarlabs.Project'
 
+_ICON_CACHE_SIZE = 200
+# Icons of the activity bundles stored in the Journal, under the profile
+_BUNDLE_ICONS_DIR = 'journal-bundle-icons'
+# Bundle icons kept in the profile, the least recently used are removed.
+# More than the memoized icons, so those are not removed under them
+_MAX_BUNDLE_ICONS = 2 * _ICON_CACHE_SIZE
+
+_icon_cache = OrderedDict()
+_icon_cache_connected = False
+
+
+def _get_cached_icon(key, get_icon, *args):
+    """Memoize the icon file names of bundles and mime types, keeping the
+    most recently used ones. Bundle icons are dropped when the bundle
+    registry changes.
+    """
+    global _icon_cache_connected
+    if not _icon_cache_connected:
+        registry = bundleregistry.get_registry()
+        registry.connect('bundle-added', _bundle_registry_changed_cb)
+        registry.connect('bundle-removed', _bundle_registry_changed_cb)
+        _icon_cache_connected = True
+
+    if key in _icon_cache:
+        file_name = _icon_cache.pop(key)
+    else:
+        file_name = get_icon(*args)
+
+    _icon_cache[key] = file_name
+    if len(_icon_cache) > _ICON_CACHE_SIZE:
+        _icon_cache.popitem(last=False)
+    return file_name
+
+
+def _bundle_registry_changed_cb(registry, bundle):
+    _icon_cache.pop(('bundle', bundle.get_bundle_id()), None)
+
+
+def _get_icon_for_bundle(bundle_id):
+    activity_info = bundleregistry.get_registry().get_bundle(bundle_id)
+    if activity_info:
+        return activity_info.get_icon()
+    return None
+
+
+def _get_icon_for_bundle_entry(metadata):
+    """Return the icon of an activity bundle stored in the Journal
+
+    The icon is extracted the first time the entry is seen and kept in
+    the profile, so drawing the entry again does not unpack the bundle.
+    """
+    key = '%s %s' % (metadata['uid'], metadata.get('timestamp', ''))
+    icons_dir = env.get_profile_path(_BUNDLE_ICONS_DIR)
+    icon_path = os.path.join(icons_dir, hashlib.sha1(key).hexdigest() +
+                             '.svg')
+    if os.path.exists(icon_path):
+        try:
+            # Mark it as recently used
+            os.utime(icon_path, None)
+        except OSError:
+            pass
+        return icon_path
+
+    file_path = model.get_file(metadata['uid'])
+    if file_path is None or not os.path.exists(file_path):
+        return None
+
+    try:
+        bundle = get_bundle_instance(file_path)
+        file_name = bundle.get_icon()
+    except Exception:
+        logging.exception('Could not read bundle')
+        return None
+
+    if file_name is None:
+        return None
+
+    try:
+        if not os.path.exists(icons_dir):
+            os.makedirs(icons_dir)
+        shutil.copyfile(file_name, icon_path)
+    except EnvironmentError:
+        logging.exception('Could not store the icon of bundle %r',
+                          metadata['uid'])
+        return file_name
+
+    _prune_bundle_icons(icons_dir)
+    return icon_path
+
+
+def _prune_bundle_icons(icons_dir):
+    # Icons of modified or deleted entries are never used again
+    try:
+        paths = [os.path.join(icons_dir, name)
+                 for name in os.listdir(icons_dir)]
+        if len(paths) <= _MAX_BUNDLE_ICONS:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - _MAX_BUNDLE_ICONS]:
+            os.unlink(path)
+    except EnvironmentError:
+        logging.exception('Could not prune the bundle icons')
+
 
 def _get_icon_for_mime(mime_type):
     generic_types = mime.get_all_generic_types()
@@ -96,21 +202,19 @@ def get_icon_name(metadata):
                 'scalable/mimetypes/project-box.svg'
             return file_name
 
-        activity_info = bundleregistry.get_registry().get_bundle(bundle_id)
-        if activity_info:
-            file_name = activity_info.get_icon()
+        file_name = _get_cached_icon(('bundle', bundle_id),
+                                     _get_icon_for_bundle, bundle_id)
 
     if file_name is None and is_activity_bundle(metadata):
-        file_path = model.get_file(metadata['uid'])
-        if file_path is not None and os.path.exists(file_path):
-            try:
-                bundle = get_bundle_instance(file_path)
-                file_name = bundle.get_icon()
-            except Exception:
-                logging.exception('Could not read bundle')
+        # Bundles that could not be read are not read again on redraw
+        key = ('bundle-entry', metadata['uid'], metadata.get('timestamp'))
+        file_name = _get_cached_icon(key, _get_icon_for_bundle_entry,
+                                     metadata)
 
     if file_name is None:
-        file_name = _get_icon_for_mime(metadata.get('mime_type', ''))
+        mime_type = metadata.get('mime_type', '')
+        file_name = _get_cached_icon(('mime', mime_type),
+                                     _get_icon_for_mime, mime_type)
 
     if file_name is None:
         file_name = get_icon_file_name('application-octet-stream')
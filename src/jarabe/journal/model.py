@@ -15,14 +15,19 @@
 
 import logging
 import os
+import sys
 import errno
 import subprocess
 from datetime import datetime
 import time
+import math
 import tempfile
+import Queue
+from threading import Thread, Event
 from stat import S_IFLNK, S_IFMT, S_IFDIR, S_IFREG
 import re
-from operator import itemgetter
+from collections import deque, OrderedDict
+import bisect
 import json
 from gettext import gettext as _
 
@@ -36,6 +41,7 @@ from sugar3 import dispatch
 from sugar3 import mime
 from sugar3 import util
 
+from jarabe.journal.volumeindex import VolumeIndex
 
 DS_DBUS_SERVICE = 'org.laptop.sugar.DataStore'
 DS_DBUS_INTERFACE = 'org.laptop.sugar.DataStore'
@@ -47,166 +53,360 @@ PROPERTIES = ['activity', 'activity_id', 'buddies', 'bundle_id',
               'mountpoint', 'mtime', 'progress', 'timestamp', 'title', 'uid',
               'preview']
 
+# Pages fetched when the result set is first read
 MIN_PAGES_TO_CACHE = 3
-MAX_PAGES_TO_CACHE = 5
+# Pages kept in the cache of a result set
+MAX_PAGES_TO_CACHE = 10
+# Pages are read ahead for the distance the reader covers in this time
+_READ_AHEAD_TIME = 0.5
 
 JOURNAL_METADATA_DIR = '.Sugar-Metadata'
 
+# Number of threads applying the query to the files of a mount point
+_SCAN_WORKERS = 4
+# Files waiting for a scan worker, bounds the memory used by the walker
+_SCAN_QUEUE_SIZE = 1000
+# Interval at which scan workers hand their matches to the main loop
+_SCAN_BATCH_INTERVAL = 0.1
+# Minimum time between two progress notifications of a scan, in seconds
+_SCAN_PROGRESS_INTERVAL = 0.1
+# Seconds the metadata index of a mount point is written after it changed
+_INDEX_SAVE_DELAY = 5
+# Entries requested from the datastore in one query by get_many()
+GET_MANY_CHUNK_SIZE = 50
+
 _datastore = None
 created = dispatch.Signal()
 updated = dispatch.Signal()
 deleted = dispatch.Signal()
 
 
-class _Cache(object):
+class _PageCache(object):
+    """Least recently used set of result set pages"""
 
-    __gtype_name__ = 'model_Cache'
+    def __init__(self, max_pages):
+        self._pages = OrderedDict()
+        self._max_pages = max_pages
 
-    def __init__(self, entries=None):
-        self._array = []
+    def get(self, page):
+        entries = self._pages.pop(page, None)
         if entries is not None:
-            self.append_all(entries)
+            self._pages[page] = entries
+        return entries
 
-    def prepend_all(self, entries):
-        self._array[0:0] = entries
+    def put(self, page, entries):
+        self._pages.pop(page, None)
+        self._pages[page] = entries
+        while len(self._pages) > self._max_pages:
+            self._pages.popitem(last=False)
 
-    def append_all(self, entries):
-        self._array += entries
+    def clear(self):
+        self._pages.clear()
 
-    def __len__(self):
-        return len(self._array)
+    def discard_from(self, first_page):
+        """Drop first_page and the pages after it"""
+        for page in [page for page in self._pages if page >= first_page]:
+            del self._pages[page]
 
-    def __getitem__(self, key):
-        return self._array[key]
+    def __contains__(self, page):
+        return page in self._pages
 
-    def __delitem__(self, key):
-        del self._array[key]
+    def __len__(self):
+        return len(self._pages)
 
 
 class BaseResultSet(object):
     """Encapsulates the result of a query
+
+    Entries are cached in pages of page_size entries, keeping the
+    max_pages_to_cache most recently used ones. While the reader
+    moves through the result set, pages ahead of it are prefetched
+    without blocking; the number of pages read ahead follows the
+    speed at which the reader crosses pages.
+
+    read(block=False) never waits for the backend: on a cache miss it
+    requests the page and returns None, page_loaded is sent once the
+    entries are available.
     """
 
-    def __init__(self, query, page_size):
+    def __init__(self, query, page_size,
+                 max_pages_to_cache=MAX_PAGES_TO_CACHE):
         self._total_count = -1
         self._position = -1
         self._query = query
         self._page_size = page_size
 
-        self._offset = 0
-        self._cache = _Cache()
+        self._cache = _PageCache(max_pages_to_cache)
+        self._max_read_ahead = max(1, (max_pages_to_cache - 1) / 2)
+        self._read_ahead = 1
+        self._direction = 1
+        self._speed = 0.
+        self._last_page = None
+        self._last_page_time = 0
+        self._prefetch_sid = None
+        self._pending_pages = set()
+        # Bumped when the cached pages become invalid, so replies to
+        # queries issued before that are ignored
+        self._generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'queries': 0,
+                       'prefetched_pages': 0, 'query_time': 0.}
 
         self.ready = dispatch.Signal()
         self.progress = dispatch.Signal()
+        # Sent with the positions of the entries that got inserted
+        # while the result set was still being set up
+        self.entries_added = dispatch.Signal()
+        # Sent with the offset and count of entries fetched asynchronously
+        self.page_loaded = dispatch.Signal()
 
     def setup(self):
         self.ready.send(self)
 
     def stop(self):
-        pass
+        self._invalidate_cache()
+        if self._prefetch_sid is not None:
+            GLib.source_remove(self._prefetch_sid)
+            self._prefetch_sid = None
+        logging.debug('%s cache stats: %r', type(self).__name__,
+                      self.get_cache_stats())
+
+    def get_cache_stats(self):
+        """Return the hit, miss and query counters of the page cache.
+        query_time is the total time spent in find(), in seconds.
+        """
+        stats = self._stats.copy()
+        if stats['queries']:
+            stats['mean_query_time'] = stats['query_time'] / stats['queries']
+        else:
+            stats['mean_query_time'] = 0.
+        stats['read_ahead'] = self._read_ahead
+        return stats
 
     def get_length(self):
         if self._total_count == -1:
-            query = self._query.copy()
-            query['limit'] = self._page_size * MIN_PAGES_TO_CACHE
-            entries, self._total_count = self.find(query)
-            self._cache.append_all(entries)
-            self._offset = 0
+            self._fetch_pages(0, MIN_PAGES_TO_CACHE)
         return self._total_count
 
     length = property(get_length)
 
+    def _invalidate_cache(self, first_position=0):
+        """Drop the cached pages from the one holding first_position on"""
+        if first_position == 0:
+            self._cache.clear()
+        else:
+            self._cache.discard_from(first_position / self._page_size)
+        self._generation += 1
+        # Pages requested before are requested again when read
+        self._pending_pages.clear()
+
+    def get_entry_position(self, metadata, old_position, reply_handler,
+                           error_handler):
+        """Find the position a created or updated entry takes
+
+        old_position is the position the entry had before the change,
+        or -1 if it was not part of the result set. reply_handler is
+        called from the main loop with the position, -1 if the entry
+        does not match the query or None if the position cannot be known
+        without running the whole query again. error_handler is called
+        with the exception if the lookup failed.
+        """
+        GLib.idle_add(reply_handler, None)
+
+    def move_entry(self, old_position, new_position, metadata):
+        """Account for an entry that was created (old_position is -1),
+        deleted (new_position is -1), updated or moved.
+
+        Returns the position the entry ends up at, or -1 if it is no
+        longer part of the result set.
+        """
+        if old_position != -1:
+            self._total_count -= 1
+        if new_position != -1:
+            self._total_count += 1
+
+        page = new_position / self._page_size
+        entries = self._cache.get(page)
+        if old_position == new_position and entries is not None:
+            entries[new_position - page * self._page_size] = metadata
+        else:
+            self._invalidate_cache()
+        return new_position
+
     def find(self, query):
         raise NotImplementedError()
 
-    def seek(self, position):
-        self._position = position
+    def find_async(self, query, reply_handler, error_handler):
+        """Asynchronous version of find()
 
-    def read(self):
-        if self._position == -1:
-            self.seek(0)
+        reply_handler is called with the entries and the total count,
+        error_handler with the exception. Result sets that can query
+        without blocking override this.
 
-        if self._position < self._offset:
-            remaining_forward_entries = 0
-        else:
-            remaining_forward_entries = self._offset + len(self._cache) - \
-                self._position
+        The handlers are called from the main loop, never before this
+        returns, so readers get their placeholders first.
+        """
+        GLib.idle_add(self.__find_idle_cb, query, reply_handler,
+                      error_handler)
 
-        if self._position > self._offset + len(self._cache):
-            remaining_backwards_entries = 0
+    def __find_idle_cb(self, query, reply_handler, error_handler):
+        try:
+            entries, total_count = self.find(query)
+        except ValueError as e:
+            error_handler(e)
         else:
-            remaining_backwards_entries = self._position - self._offset
+            reply_handler(entries, total_count)
+        return False
 
-        last_cached_entry = self._offset + len(self._cache)
+    def seek(self, position):
+        self._position = position
 
-        if remaining_forward_entries <= 0 and remaining_backwards_entries <= 0:
+    def read(self, block=True):
+        if self._position == -1:
+            self.seek(0)
 
-            # Total cache miss: remake it
-            limit = self._page_size * MIN_PAGES_TO_CACHE
-            offset = max(0, self._position - limit / 2)
-            logging.debug('remaking cache, offset: %r limit: %r', offset,
-                          limit)
-            query = self._query.copy()
-            query['limit'] = limit
-            query['offset'] = offset
-            entries, self._total_count = self.find(query)
+        page = self._position / self._page_size
+        entries = self._cache.get(page)
+        if entries is None:
+            self._stats['misses'] += 1
+            # Fetch the pages the reader is heading to in the same query
+            if self._direction > 0:
+                first_page = page
+                count = self._read_ahead
+            else:
+                first_page = max(0, page - self._read_ahead + 1)
+                count = page - first_page + 1
+
+            if block:
+                self._fetch_pages(first_page, count)
+            else:
+                self._fetch_pages_async(first_page, count)
+            entries = self._cache.get(page)
+        else:
+            self._stats['hits'] += 1
 
-            del self._cache[:]
-            self._cache.append_all(entries)
-            self._offset = offset
+        self._track_page(page)
 
-        elif (remaining_forward_entries <= 0 and
-              remaining_backwards_entries > 0):
+        if entries is None:
+            return None
+        return entries[self._position - page * self._page_size]
 
-            # Add one page to the end of cache
-            logging.debug('appending one more page, offset: %r',
-                          last_cached_entry)
-            query = self._query.copy()
-            query['limit'] = self._page_size
-            query['offset'] = last_cached_entry
-            entries, self._total_count = self.find(query)
+    def _get_pages_query(self, first_page, count):
+        query = self._query.copy()
+        query['offset'] = first_page * self._page_size
+        query['limit'] = count * self._page_size
+        logging.debug('fetching pages, offset: %r limit: %r',
+                      query['offset'], query['limit'])
+        return query
 
-            # update cache
-            self._cache.append_all(entries)
+    def _fetch_pages(self, first_page, count):
+        query = self._get_pages_query(first_page, count)
 
-            # apply the cache limit
-            cache_limit = self._page_size * MAX_PAGES_TO_CACHE
-            objects_excess = len(self._cache) - cache_limit
-            if objects_excess > 0:
-                self._offset += objects_excess
-                del self._cache[:objects_excess]
+        t = time.time()
+        entries, self._total_count = self.find(query)
+        self._stats['query_time'] += time.time() - t
+        self._stats['queries'] += 1
 
-        elif remaining_forward_entries > 0 and \
-                remaining_backwards_entries <= 0 and self._offset > 0:
+        self._store_pages(first_page, count, entries)
 
-            # Add one page to the beginning of cache
-            limit = min(self._offset, self._page_size)
-            self._offset = max(0, self._offset - limit)
+    def _fetch_pages_async(self, first_page, count, prefetch=False):
+        pages = set(range(first_page, first_page + count))
+        if pages <= self._pending_pages:
+            return
+        self._pending_pages.update(pages)
 
-            logging.debug('prepending one more page, offset: %r limit: %r',
-                          self._offset, limit)
-            query = self._query.copy()
-            query['limit'] = limit
-            query['offset'] = self._offset
-            entries, self._total_count = self.find(query)
+        generation = self._generation
+        t = time.time()
 
-            # update cache
-            self._cache.prepend_all(entries)
+        def reply_handler(entries, total_count):
+            if generation != self._generation:
+                return
+            self._pending_pages.difference_update(pages)
+
+            self._stats['query_time'] += time.time() - t
+            self._stats['queries'] += 1
+            if prefetch:
+                self._stats['prefetched_pages'] += count
+
+            self._total_count = total_count
+            self._store_pages(first_page, count, entries)
+            self.page_loaded.send(self, offset=first_page * self._page_size,
+                                  count=len(entries))
+
+        def error_handler(error):
+            if generation == self._generation:
+                self._pending_pages.difference_update(pages)
+            logging.error('Could not fetch result set pages: %s', error)
+
+        self.find_async(self._get_pages_query(first_page, count),
+                        reply_handler, error_handler)
+
+    def _store_pages(self, first_page, count, entries):
+        for i in range(count):
+            page_entries = entries[i * self._page_size:
+                                   (i + 1) * self._page_size]
+            if not page_entries:
+                break
+            self._cache.put(first_page + i, page_entries)
 
-            # apply the cache limit
-            cache_limit = self._page_size * MAX_PAGES_TO_CACHE
-            objects_excess = len(self._cache) - cache_limit
-            if objects_excess > 0:
-                del self._cache[-objects_excess:]
+    def _track_page(self, page):
+        if page == self._last_page:
+            return
 
-        return self._cache[self._position - self._offset]
+        now = time.time()
+        if self._last_page is not None:
+            delta = page - self._last_page
+            direction = 1 if delta > 0 else -1
+            speed = abs(delta) / max(now - self._last_page_time, 0.001)
+            if direction == self._direction:
+                self._speed = (self._speed + speed) / 2
+            else:
+                self._speed = speed
+            self._direction = direction
+
+            read_ahead = int(math.ceil(self._speed * _READ_AHEAD_TIME))
+            self._read_ahead = max(1, min(self._max_read_ahead, read_ahead))
+
+        self._last_page = page
+        self._last_page_time = now
+
+        # Wait until half of the read ahead window is missing, so
+        # prefetching takes few, larger queries
+        missing = len(self._get_pages_to_prefetch())
+        if self._prefetch_sid is None and missing and \
+                missing * 2 >= self._read_ahead:
+            self._prefetch_sid = GLib.idle_add(self.__prefetch_cb)
+
+    def _get_pages_to_prefetch(self):
+        if self._total_count <= 0:
+            return []
+
+        last_page = (self._total_count - 1) / self._page_size
+        pages = []
+        for i in range(1, self._read_ahead + 1):
+            page = self._last_page + i * self._direction
+            if page < 0 or page > last_page:
+                break
+            if page not in self._cache and page not in self._pending_pages:
+                pages.append(page)
+        return pages
+
+    def __prefetch_cb(self):
+        self._prefetch_sid = None
+
+        pages = self._get_pages_to_prefetch()
+        if pages:
+            first_page = min(pages)
+            count = max(pages) - first_page + 1
+            self._fetch_pages_async(first_page, count, prefetch=True)
+        return False
 
 
 class DatastoreResultSet(BaseResultSet):
     """Encapsulates the result of a query on the datastore
     """
 
-    def __init__(self, query, page_size):
+    def __init__(self, query, page_size,
+                 max_pages_to_cache=MAX_PAGES_TO_CACHE):
 
         if query.get('query', '') and not query['query'].startswith('"'):
             query_text = ''
@@ -219,7 +419,7 @@ class DatastoreResultSet(BaseResultSet):
 
             query['query'] = query_text
 
-        BaseResultSet.__init__(self, query, page_size)
+        BaseResultSet.__init__(self, query, page_size, max_pages_to_cache)
 
     def find(self, query):
         entries, total_count = _get_datastore().find(query, PROPERTIES,
@@ -230,24 +430,94 @@ class DatastoreResultSet(BaseResultSet):
 
         return entries, total_count
 
+    def find_async(self, query, reply_handler, error_handler):
+        def find_reply_handler(entries, total_count):
+            for entry in entries:
+                entry['mountpoint'] = '/'
+            reply_handler(entries, total_count)
+
+        _get_datastore().find(query, PROPERTIES, byte_arrays=True,
+                              reply_handler=find_reply_handler,
+                              error_handler=error_handler)
+
     def find_ids(self, query):
         copy = query.copy()
         copy.pop('mountpoints', '/')
         return _get_datastore().find_ids(copy)
 
+    def get_entry_position(self, metadata, old_position, reply_handler,
+                           error_handler):
+        # Only the timestamp order can be resolved with a range query
+        order_by = self._query.get('order_by', ['+timestamp'])[0]
+        if order_by[1:] != 'timestamp':
+            GLib.idle_add(reply_handler, None)
+            return
+
+        try:
+            timestamp = int(metadata['timestamp'])
+        except (KeyError, TypeError, ValueError):
+            GLib.idle_add(reply_handler, None)
+            return
+
+        query = self._query.copy()
+        query.pop('offset', None)
+        query['limit'] = 1
+        query['uid'] = metadata['uid']
+
+        def match_reply_handler(entries_, count):
+            if count == 0:
+                reply_handler(-1)
+                return
+
+            # Count the entries sorted before this one
+            del query['uid']
+            date_range = query.get('timestamp', {})
+            start = int(date_range.get('start', 0))
+            end = int(date_range.get('end', sys.maxint))
+            if order_by[0] == '+':
+                start = max(start, timestamp + 1)
+            else:
+                end = min(end, timestamp - 1)
+            if start > end:
+                reply_handler(0)
+                return
+            query['timestamp'] = {'start': start, 'end': end}
+
+            def count_reply_handler(entries_, position):
+                reply_handler(position)
+
+            _get_datastore().find(query, ['uid'], byte_arrays=True,
+                                  reply_handler=count_reply_handler,
+                                  error_handler=error_handler)
+
+        _get_datastore().find(query, ['uid'], byte_arrays=True,
+                              reply_handler=match_reply_handler,
+                              error_handler=error_handler)
+
 
 class InplaceResultSet(BaseResultSet):
     """Encapsulates the result of a query on a mount point
+
+    The mount point is walked by a thread that feeds the files it finds
+    to a pool of worker threads. The workers apply the query and hand
+    the matches back to the main loop in batches, where they are
+    inserted at their sorted position and announced through
+    entries_added, before the whole mount point has been scanned.
     """
 
-    def __init__(self, query, page_size, mount_point):
-        BaseResultSet.__init__(self, query, page_size)
+    def __init__(self, query, page_size, mount_point,
+                 max_pages_to_cache=MAX_PAGES_TO_CACHE):
+        BaseResultSet.__init__(self, query, page_size, max_pages_to_cache)
         self._mount_point = mount_point
         self._file_list = None
-        self._pending_directories = []
-        self._visited_directories = []
-        self._pending_files = []
+        self._sort_keys = None
+        self._moved_file_info = None
+        self._cancel = None
+        self._workers_running = 0
+        self._last_progress = 0
         self._stopped = False
+        self._index = None
+        self._index_save_sid = None
 
         query_text = query.get('query', '')
         if query_text.startswith('"') and query_text.endswith('"'):
@@ -276,25 +546,133 @@ class InplaceResultSet(BaseResultSet):
         self._sort = query.get('order_by', ['+timestamp'])[0]
 
     def setup(self):
+        if self._index is None:
+            self._index = VolumeIndex(self._mount_point)
         self._file_list = []
-        self._pending_directories = [self._mount_point]
-        self._visited_directories = []
-        self._pending_files = []
-        GLib.idle_add(self._scan)
+        self._sort_keys = []
+        self._last_progress = 0
+        self._cancel = Event()
+        self._workers_running = _SCAN_WORKERS
+
+        files_queue = Queue.Queue(maxsize=_SCAN_QUEUE_SIZE)
+        walker = Thread(target=self._walk_thread_func,
+                        args=(files_queue, self._cancel))
+        walker.daemon = True
+        walker.start()
+        for i_ in range(_SCAN_WORKERS):
+            worker = Thread(target=self._filter_thread_func,
+                            args=(files_queue, self._cancel))
+            worker.daemon = True
+            worker.start()
 
     def stop(self):
         self._stopped = True
+        if self._cancel is not None:
+            self._cancel.set()
+        if self._index_save_sid is not None:
+            GLib.source_remove(self._index_save_sid)
+            self.__save_index_cb()
+        BaseResultSet.stop(self)
 
     def setup_ready(self):
+        self._index.save(prune=True)
+        self.ready.send(self)
+
+    def _schedule_index_save(self):
+        # Metadata read for the pages being shown is written in one go
+        if self._index_save_sid is None:
+            self._index_save_sid = GLib.timeout_add_seconds(
+                _INDEX_SAVE_DELAY, self.__save_index_cb)
+
+    def __save_index_cb(self):
+        self._index_save_sid = None
+        self._index.save()
+        return False
+
+    def get_length(self):
+        if self._file_list is None:
+            return BaseResultSet.get_length(self)
+        return len(self._file_list)
+
+    length = property(get_length)
+
+    def _get_sort_key(self, file_info):
         if self._sort[1:] == 'filesize':
-            keygetter = itemgetter(3)
+            key = file_info[3]
         else:
             # timestamp
-            keygetter = itemgetter(2)
-        self._file_list.sort(lambda a, b: cmp(b, a),
-                             key=keygetter,
-                             reverse=(self._sort[0] == '-'))
-        self.ready.send(self)
+            key = file_info[2]
+
+        # '+' sorts in descending order
+        if self._sort[0] == '+':
+            key = -key
+        return key
+
+    def _insert_sorted(self, file_infos):
+        positions = []
+        for file_info in file_infos:
+            key = self._get_sort_key(file_info)
+            position = bisect.bisect_right(self._sort_keys, key)
+            self._sort_keys.insert(position, key)
+            self._file_list.insert(position, file_info)
+            positions.append(position)
+
+        if positions:
+            # The cached pages after the first insertion no longer match
+            # the list positions
+            self._invalidate_cache(min(positions))
+            self._total_count = len(self._file_list)
+            self.entries_added.send(self, positions=positions)
+
+    def _get_updated_file_info(self, path):
+        stat = None
+        if os.path.exists(path):
+            stat = self._stat_file(path)
+        if stat is None or S_IFMT(stat.st_mode) != S_IFREG:
+            return None
+        return self._filter_file(path, stat)
+
+    def get_entry_position(self, metadata, old_position, reply_handler,
+                           error_handler):
+        GLib.idle_add(self.__entry_position_cb, metadata, old_position,
+                      reply_handler)
+
+    def __entry_position_cb(self, metadata, old_position, reply_handler):
+        file_info = self._get_updated_file_info(metadata['uid'])
+        self._moved_file_info = file_info
+        if file_info is None:
+            reply_handler(-1)
+            return False
+
+        position = bisect.bisect_right(self._sort_keys,
+                                       self._get_sort_key(file_info))
+        # The entry will no longer be at its old position
+        if old_position != -1 and old_position < position:
+            position -= 1
+        reply_handler(position)
+        return False
+
+    def move_entry(self, old_position, new_position, metadata):
+        if old_position != -1:
+            del self._file_list[old_position]
+            del self._sort_keys[old_position]
+
+        if new_position != -1:
+            file_info = self._moved_file_info
+            if file_info is None or file_info[0] != metadata['uid']:
+                file_info = self._get_updated_file_info(metadata['uid'])
+            if file_info is None:
+                # The file is gone, or no longer matches: it was deleted
+                new_position = -1
+            else:
+                self._file_list.insert(new_position, file_info)
+                self._sort_keys.insert(new_position,
+                                       self._get_sort_key(file_info))
+
+        self._moved_file_info = None
+        self._total_count = len(self._file_list)
+        self._invalidate_cache()
+        return new_position
 
     def find(self, query):
         if self._file_list is None:
@@ -314,9 +692,11 @@ class InplaceResultSet(BaseResultSet):
         entries = []
         for file_path, stat, mtime_, size_, metadata in files:
             if metadata is None:
-                metadata = _get_file_metadata(file_path, stat)
+                metadata = self._get_file_metadata(file_path, stat,
+                                                   fetch_preview=True)
             metadata['mountpoint'] = self._mount_point
             entries.append(metadata)
+        self._schedule_index_save()
 
         logging.debug('InplaceResultSet.find took %f s.', time.time() - t)
 
@@ -334,35 +714,120 @@ class InplaceResultSet(BaseResultSet):
             ids.append(file_path)
         return ids
 
-    def _scan(self):
-        if self._stopped:
-            return False
+    def _get_file_metadata(self, path, stat, fetch_preview=False):
+        metadata_path, preview_path = \
+            _get_metadata_file_paths(path, self._mount_point)
+        try:
+            metadata_mtime = os.stat(metadata_path).st_mtime
+        except OSError:
+            metadata_mtime = None
+
+        metadata = self._index.lookup(path, stat, metadata_mtime)
+        if metadata is None:
+            metadata = _get_file_metadata(path, stat, fetch_preview=False,
+                                          mount_point=self._mount_point)
+            if not metadata:
+                return metadata
+            self._index.update(path, stat, metadata_mtime, metadata)
+
+        if fetch_preview:
+            _read_file_preview(metadata, preview_path)
+        return metadata
+
+    def _walk_thread_func(self, files_queue, cancel):
+        pending_directories = deque([self._mount_point])
+        visited_directories = set()
 
-        self.progress.send(self)
+        while pending_directories:
+            if cancel.is_set():
+                return
+
+            dir_path = pending_directories.popleft()
+            try:
+                entries = os.listdir(dir_path)
+            except OSError as e:
+                if e.errno != errno.EACCES:
+                    logging.exception('Error reading directory %r', dir_path)
+                continue
 
-        if self._pending_files:
-            self._scan_a_file()
-            return True
+            for entry in entries:
+                if entry.startswith('.'):
+                    continue
+
+                full_path = dir_path + '/' + entry
+                stat = self._stat_file(full_path)
+                if stat is None:
+                    continue
+
+                if S_IFMT(stat.st_mode) == S_IFDIR:
+                    id_tuple = stat.st_ino, stat.st_dev
+                    if id_tuple not in visited_directories:
+                        visited_directories.add(id_tuple)
+                        pending_directories.append(full_path)
+                elif S_IFMT(stat.st_mode) == S_IFREG:
+                    if not _put_unless_cancelled(files_queue,
+                                                 (full_path, stat), cancel):
+                        return
+
+        # One end marker per worker
+        for i_ in range(_SCAN_WORKERS):
+            if not _put_unless_cancelled(files_queue, None, cancel):
+                return
+
+    def _filter_thread_func(self, files_queue, cancel):
+        batch = []
+        last_flush = time.time()
+
+        while not cancel.is_set():
+            try:
+                item = files_queue.get(timeout=_SCAN_BATCH_INTERVAL)
+            except Queue.Empty:
+                item = ()
+
+            if item is None:
+                break
+            elif item:
+                file_info = self._filter_file(*item)
+                if file_info is not None:
+                    batch.append(file_info)
+
+            if time.time() - last_flush >= _SCAN_BATCH_INTERVAL:
+                GLib.idle_add(self._add_batch, batch, cancel)
+                batch = []
+                last_flush = time.time()
+
+        GLib.idle_add(self._worker_finished, batch, cancel)
+
+    def _add_batch(self, batch, cancel):
+        if cancel.is_set():
+            return False
 
-        if self._pending_directories:
-            self._scan_a_directory()
-            return True
+        self._insert_sorted(batch)
 
-        self.setup_ready()
-        self._visited_directories = []
+        now = time.time()
+        if now - self._last_progress >= _SCAN_PROGRESS_INTERVAL:
+            self._last_progress = now
+            self.progress.send(self)
         return False
 
-    def _scan_a_file(self):
-        full_path = self._pending_files.pop(0)
-        metadata = None
+    def _worker_finished(self, batch, cancel):
+        if cancel.is_set():
+            return False
+
+        self._insert_sorted(batch)
+        self._workers_running -= 1
+        if self._workers_running == 0:
+            self.setup_ready()
+        return False
 
+    def _stat_file(self, full_path):
         try:
             stat = os.lstat(full_path)
         except OSError as e:
             if e.errno != errno.ENOENT:
                 logging.exception(
                     'Error reading metadata of file %r', full_path)
-            return
+            return None
 
         if S_IFMT(stat.st_mode) == S_IFLNK:
             try:
@@ -370,10 +835,10 @@ class InplaceResultSet(BaseResultSet):
             except OSError as e:
                 logging.exception(
                     'Error reading target of link %r', full_path)
-                return
+                return None
 
             if not os.path.abspath(link).startswith(self._mount_point):
-                return
+                return None
 
             try:
                 stat = os.stat(full_path)
@@ -382,24 +847,22 @@ class InplaceResultSet(BaseResultSet):
                 if e.errno != errno.ENOENT:
                     logging.exception(
                         'Error reading metadata of linked file %r', full_path)
-                return
+                return None
 
-        if S_IFMT(stat.st_mode) == S_IFDIR:
-            id_tuple = stat.st_ino, stat.st_dev
-            if id_tuple not in self._visited_directories:
-                self._visited_directories.append(id_tuple)
-                self._pending_directories.append(full_path)
-            return
+        return stat
 
-        if S_IFMT(stat.st_mode) != S_IFREG:
-            return
+    def _filter_file(self, full_path, stat):
+        """Return the file_info of a regular file if it matches the
+        query, None otherwise. Called from the scan worker threads.
+        """
+        metadata = None
+        self._index.touch(full_path)
 
         if self._regex is not None and \
                 not self._regex.match(full_path):
-            metadata = _get_file_metadata(full_path, stat,
-                                          fetch_preview=False)
+            metadata = self._get_file_metadata(full_path, stat)
             if not metadata:
-                return
+                return None
             add_to_list = False
             for f in ['fulltext', 'title',
                       'description', 'tags']:
@@ -408,71 +871,66 @@ class InplaceResultSet(BaseResultSet):
                     add_to_list = True
                     break
             if not add_to_list:
-                return
+                return None
 
         if self._only_favorites:
             if not metadata:
-                metadata = _get_file_metadata(full_path, stat,
-                                              fetch_preview=False)
+                metadata = self._get_file_metadata(full_path, stat)
             if 'keep' not in metadata:
-                return
+                return None
             try:
                 if int(metadata['keep']) == 0:
-                    return
+                    return None
             except ValueError:
-                return
+                return None
 
         if self._filter_by_activity:
             if not metadata:
-                metadata = _get_file_metadata(full_path, stat,
-                                              fetch_preview=False)
+                metadata = self._get_file_metadata(full_path, stat)
             if 'activity' not in metadata or \
                     metadata['activity'] != self._filter_by_activity:
-                return
+                return None
 
         if self._date_start is not None and stat.st_mtime < self._date_start:
-            return
+            return None
 
         if self._date_end is not None and stat.st_mtime > self._date_end:
-            return
+            return None
 
         if self._mime_types:
-            mime_type, uncertain_result_ = \
-                Gio.content_type_guess(filename=full_path, data=None)
+            mime_type = self._index.lookup_mime_type(full_path, stat)
+            if mime_type is None:
+                mime_type, uncertain_result_ = \
+                    Gio.content_type_guess(filename=full_path, data=None)
+                self._index.update_mime_type(full_path, stat, mime_type)
             if mime_type not in self._mime_types:
-                return
-
-        file_info = (full_path, stat, int(stat.st_mtime), stat.st_size,
-                     metadata)
-        self._file_list.append(file_info)
+                return None
 
-        return
+        return (full_path, stat, int(stat.st_mtime), stat.st_size,
+                metadata)
 
-    def _scan_a_directory(self):
-        dir_path = self._pending_directories.pop(0)
 
+def _put_unless_cancelled(queue, item, cancel):
+    """Put item in a bounded queue, giving up if cancel gets set while
+    waiting for room. Returns True if the item was queued.
+    """
+    while not cancel.is_set():
         try:
-            entries = os.listdir(dir_path)
-        except OSError as e:
-            if e.errno != errno.EACCES:
-                logging.exception('Error reading directory %r', dir_path)
-            return
-
-        for entry in entries:
-            if entry.startswith('.'):
-                continue
-            self._pending_files.append(dir_path + '/' + entry)
-        return
+            queue.put(item, timeout=_SCAN_BATCH_INTERVAL)
+        except Queue.Full:
+            continue
+        return True
+    return False
 
 
-def _get_file_metadata(path, stat, fetch_preview=True):
+def _get_file_metadata(path, stat, fetch_preview=True, mount_point=None):
     """Return the metadata from the corresponding file.
 
     Reads the metadata stored in the json file or create the
     metadata based on the file properties.
 
     """
-    metadata = _get_file_metadata_from_json(path, fetch_preview)
+    metadata = _get_file_metadata_from_json(path, fetch_preview, mount_point)
     if metadata:
         if 'filesize' not in metadata:
             metadata['filesize'] = stat.st_size
@@ -491,7 +949,7 @@ def _get_file_metadata(path, stat, fetch_preview=True):
             'description': path}
 
 
-def _get_file_metadata_from_json(path, fetch_preview):
+def _get_file_metadata_from_json(path, fetch_preview, mount_point=None):
     """Read the metadata from the json file and the preview
     stored on the external device.
 
@@ -499,19 +957,9 @@ def _get_file_metadata_from_json(path, fetch_preview):
 
     """
     filename = os.path.basename(path)
-    dir_path = os.path.dirname(path)
 
     metadata = None
-    mount_point = _get_mount_point(path)
-    subdir = ''
-    # check if the file is a subdirectory
-    if mount_point != dir_path:
-        subdir = os.path.relpath(dir_path, mount_point)
-
-    metadata_path = os.path.join(mount_point, JOURNAL_METADATA_DIR, subdir,
-                                 filename + '.metadata')
-    preview_path = os.path.join(mount_point, JOURNAL_METADATA_DIR, subdir,
-                                filename + '.preview')
+    metadata_path, preview_path = _get_metadata_file_paths(path, mount_point)
 
     if not os.path.exists(metadata_path):
         return None
@@ -532,16 +980,41 @@ def _get_file_metadata_from_json(path, fetch_preview):
         if 'preview' in metadata:
             del(metadata['preview'])
     else:
-        if os.path.exists(preview_path):
-            try:
-                metadata['preview'] = dbus.ByteArray(open(preview_path).read())
-            except EnvironmentError:
-                logging.debug('Could not read preview for file %r on '
-                              'external device.', filename)
+        _read_file_preview(metadata, preview_path)
 
     return metadata
 
 
+def _read_file_preview(metadata, preview_path):
+    if os.path.exists(preview_path):
+        try:
+            metadata['preview'] = dbus.ByteArray(open(preview_path).read())
+        except EnvironmentError:
+            logging.debug('Could not read preview %r on external device.',
+                          preview_path)
+
+
+def _get_metadata_file_paths(path, mount_point=None):
+    """Return the paths of the metadata and preview files that
+    .Sugar-Metadata holds for the file at path.
+    """
+    filename = os.path.basename(path)
+    dir_path = os.path.dirname(path)
+
+    if mount_point is None:
+        mount_point = _get_mount_point(path)
+    subdir = ''
+    # check if the file is a subdirectory
+    if mount_point != dir_path:
+        subdir = os.path.relpath(dir_path, mount_point)
+
+    metadata_path = os.path.join(mount_point, JOURNAL_METADATA_DIR, subdir,
+                                 filename + '.metadata')
+    preview_path = os.path.join(mount_point, JOURNAL_METADATA_DIR, subdir,
+                                filename + '.preview')
+    return metadata_path, preview_path
+
+
 def _get_datastore():
     global _datastore
     if _datastore is None:
@@ -568,8 +1041,11 @@ def _datastore_deleted_cb(object_id):
     deleted.send(None, object_id=object_id)
 
 
-def find(query_, page_size):
+def find(query_, page_size, max_pages_to_cache=MAX_PAGES_TO_CACHE):
     """Returns a ResultSet
+
+    max_pages_to_cache bounds the number of pages of page_size entries
+    the result set keeps in memory.
     """
     query = query_.copy()
 
@@ -578,9 +1054,10 @@ def find(query_, page_size):
         raise ValueError('Exactly one mount point must be specified')
 
     if mount_points[0] == '/':
-        return DatastoreResultSet(query, page_size)
+        return DatastoreResultSet(query, page_size, max_pages_to_cache)
     else:
-        return InplaceResultSet(query, page_size, mount_points[0])
+        return InplaceResultSet(query, page_size, mount_points[0],
+                                max_pages_to_cache)
 
 
 def _get_mount_point(path):
@@ -609,6 +1086,93 @@ def get(object_id):
     return metadata
 
 
+def _get_many_properties(properties):
+    if properties is None:
+        properties = [name for name in PROPERTIES if name != 'preview']
+    elif properties and 'uid' not in properties:
+        properties = list(properties) + ['uid']
+    return properties
+
+
+def _get_many_from_datastore(uids, properties, reply_handler=None,
+                             error_handler=None):
+    query = {'uid': list(uids), 'limit': len(uids)}
+
+    def sort_entries(entries):
+        entries_by_uid = {}
+        for entry in entries:
+            entry['mountpoint'] = '/'
+            entries_by_uid[entry['uid']] = entry
+        return [entries_by_uid.get(uid) for uid in uids]
+
+    if reply_handler is None:
+        entries, total_count_ = _get_datastore().find(query, properties,
+                                                      byte_arrays=True)
+        return sort_entries(entries)
+
+    def find_reply_handler(entries, total_count_):
+        reply_handler(sort_entries(entries))
+
+    _get_datastore().find(query, properties, byte_arrays=True,
+                          reply_handler=find_reply_handler,
+                          error_handler=error_handler)
+
+
+def get_many(uids, properties=None, reply_handler=None, error_handler=None):
+    """Returns the metadata for several objects
+
+    The result is a list in the order of uids, with None for the objects
+    that do not exist. Datastore entries are fetched with one query per
+    GET_MANY_CHUNK_SIZE uids. Unless properties are given, the preview
+    is not fetched. An empty list of properties fetches all of them.
+
+    When reply_handler is given the datastore is queried asynchronously
+    and the list is passed to it instead of being returned.
+    """
+    properties = _get_many_properties(properties)
+    fetch_preview = not properties or 'preview' in properties
+
+    results = [None] * len(uids)
+    datastore_positions = []
+    for position, uid in enumerate(uids):
+        if os.path.exists(uid):
+            stat = os.stat(uid)
+            metadata = _get_file_metadata(uid, stat, fetch_preview)
+            metadata['mountpoint'] = _get_mount_point(uid)
+            results[position] = metadata
+        else:
+            datastore_positions.append(position)
+
+    chunks = [datastore_positions[i:i + GET_MANY_CHUNK_SIZE]
+              for i in xrange(0, len(datastore_positions),
+                              GET_MANY_CHUNK_SIZE)]
+
+    if reply_handler is None:
+        for chunk in chunks:
+            entries = _get_many_from_datastore(
+                [uids[position] for position in chunk], properties)
+            for position, entry in zip(chunk, entries):
+                results[position] = entry
+        return results
+
+    def fetch_next_chunk():
+        if not chunks:
+            reply_handler(results)
+            return
+        chunk = chunks.pop(0)
+
+        def chunk_reply_handler(entries):
+            for position, entry in zip(chunk, entries):
+                results[position] = entry
+            fetch_next_chunk()
+
+        _get_many_from_datastore([uids[position] for position in chunk],
+                                 properties, chunk_reply_handler,
+                                 error_handler)
+
+    fetch_next_chunk()
+
+
 def get_file(object_id):
     """Returns the file for an object
     """
@@ -683,10 +1247,16 @@ def delete(object_id):
         deleted.send(None, object_id=object_id)
 
 
-def copy(metadata, mount_point, ready_callback=None):
+def copy(metadata, mount_point, ready_callback=None, complete=False):
     """Copies an object to another mount point
+
+    Unless complete is set, telling that metadata holds all the
+    properties of the object, the metadata is fetched again.
     """
-    metadata = get(metadata['uid'])
+    if complete:
+        metadata = metadata.copy()
+    else:
+        metadata = get(metadata['uid'])
     if mount_point == '/' and metadata.get('icon-color') == '#000000,#ffffff':
         settings = Gio.Settings('org.sugarlabs.user')
         metadata['icon-color'] = settings.get_string('color')
@@ -18,6 +18,7 @@ from gettext import gettext as _
 from gettext import ngettext
 import logging
 import os
+from collections import deque
 
 from gi.repository import GObject
 from gi.repository import GLib
@@ -395,7 +396,7 @@ class VolumeMenu(MenuItem):
 
             try:
                 metadata = model.get(uid)
-                model.copy(metadata, self._mount_point)
+                model.copy(metadata, self._mount_point, complete=True)
             except IOError as e:
                 logging.exception('Error while copying the entry. %s',
                                   e.strerror)
@@ -403,10 +404,11 @@ class VolumeMenu(MenuItem):
                           _('Error while copying the entry. %s') % e.strerror,
                           _('Error'))
         else:
+            # All the properties are fetched, to be copied along
             BatchOperator(
                 self._journalactivity, uid_list, _('Copy'),
                 self._get_confirmation_alert_message(len(uid_list)),
-                self._perform_copy)
+                self._perform_copy, properties=[])
 
     def _get_confirmation_alert_message(self, entries_len):
         return ngettext('Do you want to copy %d entry?',
@@ -419,7 +421,7 @@ class VolumeMenu(MenuItem):
             logging.warn('Entries without a file cannot be copied.')
             return
         try:
-            model.copy(metadata, self._mount_point)
+            model.copy(metadata, self._mount_point, complete=True)
         except IOError as e:
             logging.exception('Error while copying the entry. %s',
                               e.strerror)
@@ -583,7 +585,7 @@ class BatchOperator(GObject.GObject):
     def __init__(self, journalactivity,
                  uid_list,
                  alert_title, alert_message,
-                 operation_cb):
+                 operation_cb, properties=None):
         GObject.GObject.__init__(self)
 
         self._journalactivity = journalactivity
@@ -592,6 +594,9 @@ class BatchOperator(GObject.GObject):
         self._alert_title = alert_title
         self._alert_message = alert_message
         self._operation_cb = operation_cb
+        # Properties of the entries passed to operation_cb, as taken by
+        # model.get_many()
+        self._properties = properties
 
         self._show_confirmation_alert()
 
@@ -629,14 +634,71 @@ class BatchOperator(GObject.GObject):
             self._stop_batch_execution()
         elif hasattr(self, '_object_index') == False:
             self._object_index = 0
+            self._next_chunk_index = 0
+            self._fetched_metadata = deque()
+            self._fetching = False
+            self._waiting_for_metadata = True
+            self._fetch_next_chunk()
+
+    def _fetch_next_chunk(self):
+        # Chunks are fetched one at a time, when the metadata left to
+        # operate on is less than a chunk, so the datastore query for the
+        # next chunk runs while the current one is processed.
+        if self._fetching or self._next_chunk_index >= len(self._uid_list):
+            return
+        start = self._next_chunk_index
+        chunk = self._uid_list[start:start + model.GET_MANY_CHUNK_SIZE]
+        self._next_chunk_index += len(chunk)
+        self._fetching = True
+
+        def reply_handler(metadata_list):
+            self._fetching = False
+            self._add_fetched_metadata(metadata_list)
+
+        def error_handler(error):
+            self._fetching = False
+            logging.error('Error fetching metadata for batch operation: %s',
+                          error)
+            if hasattr(self, '_object_index'):
+                self._journalactivity.volume_error_cb(
+                    self,
+                    ngettext('Error while reading %d entry.',
+                             'Error while reading %d entries.',
+                             len(chunk)) % len(chunk),
+                    _('Error'))
+            self._add_fetched_metadata([None] * len(chunk))
+
+        model.get_many(chunk, self._properties,
+                       reply_handler=reply_handler,
+                       error_handler=error_handler)
+
+    def _add_fetched_metadata(self, metadata_list):
+        if not hasattr(self, '_object_index') or \
+                self._object_index >= len(self._uid_list):
+            return
+        self._fetched_metadata.extend(metadata_list)
+        if self._waiting_for_metadata:
+            self._waiting_for_metadata = False
             GLib.idle_add(self._operate_by_uid_internal)
 
     def _operate_by_uid_internal(self):
         # If there is still some uid left, proceed with the operation.
         # Else, proceed to post-operations.
-        if self._object_index < len(self._uid_list):
-            uid = self._uid_list[self._object_index]
-            metadata = model.get(uid)
+        if self._object_index >= len(self._uid_list):
+            self._finish_batch_execution()
+            return False
+
+        if len(self._fetched_metadata) < model.GET_MANY_CHUNK_SIZE:
+            self._fetch_next_chunk()
+        if not self._fetched_metadata:
+            self._waiting_for_metadata = True
+            return False
+
+        metadata = self._fetched_metadata.popleft()
+        if metadata is None:
+            logging.warning('Skipping missing entry %r',
+                            self._uid_list[self._object_index])
+        else:
             title = None
             if 'title' in metadata:
                 title = metadata['title']
@@ -648,19 +710,18 @@ class BatchOperator(GObject.GObject):
                 'object_title': title}
 
             self._confirmation_alert.props.msg = alert_message
-            GLib.idle_add(self._operate_per_metadata, metadata)
-        else:
-            self._finish_batch_execution()
-
-    def _operate_per_metadata(self, metadata):
-        self._operation_cb(metadata)
+            self._operation_cb(metadata)
 
         # process the next
         self._object_index = self._object_index + 1
         GLib.idle_add(self._operate_by_uid_internal)
+        return False
 
     def _stop_batch_execution(self):
         self._object_index = len(self._uid_list)
+        if getattr(self, '_waiting_for_metadata', False):
+            self._waiting_for_metadata = False
+            GLib.idle_add(self._operate_by_uid_internal)
 
     def _finish_batch_execution(self):
         del self._object_index
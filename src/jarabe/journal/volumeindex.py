@@ -0,0 +1,211 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import json
+import hashlib
+import tempfile
+from threading import Lock
+
+from gi.repository import Gio
+from gi.repository import GLib
+
+from sugar3 import env
+
+
+_INDEX_DIR = 'journal-index'
+_INDEX_VERSION = 1
+
+
+def _get_volume_key(mount_point):
+    """Identify a volume by the UUID of its mount, so the same stick
+    finds its index wherever it gets mounted. Folders that are not a
+    mount of their own (eg. ~/Documents) are identified by their path.
+    """
+    uuid = None
+    try:
+        mount = Gio.File.new_for_path(mount_point).find_enclosing_mount(None)
+    except GLib.GError:
+        mount = None
+    if mount is not None:
+        uuid = mount.get_uuid()
+
+    sha_hash = hashlib.sha1()
+    sha_hash.update(uuid or mount_point)
+    return sha_hash.hexdigest()
+
+
+class VolumeIndex(object):
+    """Persistent cache of the metadata of the files on a mount point
+
+    Entries are keyed by the path relative to the mount point and are
+    only trusted while the inode, modification time and size of the
+    file, and the modification time of its .Sugar-Metadata file, are
+    unchanged. Previews are never stored. The MIME type guessed from
+    the name of a file is kept too, for queries filtering on it.
+
+    The index can be queried and updated from several scan threads.
+    """
+
+    def __init__(self, mount_point):
+        self._mount_point = mount_point
+        self._path = os.path.join(env.get_profile_path(_INDEX_DIR),
+                                  _get_volume_key(mount_point) + '.json')
+        self._entries = {}
+        self._mime_types = {}
+        self._seen = set()
+        self._dirty = False
+        self._lock = Lock()
+
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+
+        try:
+            with open(self._path) as index_file:
+                data = json.load(index_file)
+        except (ValueError, EnvironmentError):
+            logging.warning('Discarding corrupted journal index %r',
+                            self._path)
+            return
+
+        if not isinstance(data, dict) or \
+                data.get('version') != _INDEX_VERSION or \
+                not isinstance(data.get('entries'), dict):
+            return
+
+        self._entries = data['entries']
+        mime_types = data.get('mime_types')
+        if isinstance(mime_types, dict):
+            self._mime_types = mime_types
+
+    def _get_key(self, path):
+        return os.path.relpath(path, self._mount_point)
+
+    def touch(self, path):
+        """Record that path still exists on the volume"""
+        with self._lock:
+            self._seen.add(self._get_key(path))
+
+    def lookup(self, path, stat, metadata_mtime):
+        """Return a copy of the indexed metadata or None when the entry
+        is missing or stale.
+        """
+        with self._lock:
+            entry = self._entries.get(self._get_key(path))
+        if entry is None:
+            return None
+
+        ino, mtime, size, indexed_metadata_mtime, metadata = entry
+        if ino != stat.st_ino or mtime != stat.st_mtime or \
+                size != stat.st_size or \
+                indexed_metadata_mtime != metadata_mtime:
+            return None
+
+        metadata = metadata.copy()
+        metadata['uid'] = path
+        return metadata
+
+    def lookup_mime_type(self, path, stat):
+        """Return the MIME type guessed for path, or None when it is
+        missing or stale.
+        """
+        with self._lock:
+            entry = self._mime_types.get(self._get_key(path))
+        if entry is None:
+            return None
+
+        ino, mtime, size, mime_type = entry
+        if ino != stat.st_ino or mtime != stat.st_mtime or \
+                size != stat.st_size:
+            return None
+        return mime_type
+
+    def update_mime_type(self, path, stat, mime_type):
+        with self._lock:
+            self._mime_types[self._get_key(path)] = \
+                [stat.st_ino, stat.st_mtime, stat.st_size, mime_type]
+            self._dirty = True
+
+    def update(self, path, stat, metadata_mtime, metadata):
+        metadata = metadata.copy()
+        metadata.pop('uid', None)
+        metadata.pop('preview', None)
+        metadata.pop('mountpoint', None)
+
+        with self._lock:
+            self._entries[self._get_key(path)] = \
+                [stat.st_ino, stat.st_mtime, stat.st_size, metadata_mtime,
+                 metadata]
+            self._dirty = True
+
+    def save(self, prune=False):
+        """Write the index to disk if it changed
+
+        With prune set, entries for files that were not touched since
+        the index was loaded are dropped first.
+        """
+        with self._lock:
+            if prune:
+                for entries in (self._entries, self._mime_types):
+                    for key in set(entries) - self._seen:
+                        del entries[key]
+                        self._dirty = True
+                self._seen = set()
+
+            if not self._dirty:
+                return
+            # Entries are replaced, never modified, so copies of the
+            # dicts can be serialized without holding the lock
+            entries = dict(self._entries)
+            mime_types = dict(self._mime_types)
+            # Changes made while writing mark the index dirty again
+            self._dirty = False
+
+        try:
+            data = json.dumps({'version': _INDEX_VERSION,
+                               'mount_point': self._mount_point,
+                               'entries': entries,
+                               'mime_types': mime_types})
+        except (TypeError, ValueError):
+            logging.exception('Could not serialize journal index')
+            self._set_dirty()
+            return
+
+        index_dir = os.path.dirname(self._path)
+        temp_path = None
+        try:
+            if not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            fd, temp_path = tempfile.mkstemp(dir=index_dir)
+            with os.fdopen(fd, 'w') as index_file:
+                index_file.write(data)
+            os.rename(temp_path, self._path)
+        except EnvironmentError:
+            logging.exception('Could not write journal index %r', self._path)
+            if temp_path is not None:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+            # Try again next time
+            self._set_dirty()
+
+    def _set_dirty(self):
+        with self._lock:
+            self._dirty = True
@@ -68,6 +68,7 @@ from gi.repository import Wnck
 from sugar3 import env
 
 from jarabe.model.session import get_session_manager
+from jarabe.model import bundleregistry
 from jarabe.model.update import updater
 from jarabe.model import screen
 from jarabe.view import keyhandler
@@ -224,12 +225,19 @@ def _begin_desktop_startup():
 
     session_manager = get_session_manager()
     session_manager.start()
+    session_manager.shutdown_signal.connect(__session_shutdown_cb)
 
     # open homewindow before window_manager to let desktop appear fast
     home_window = homewindow.get_instance()
     home_window.show()
 
 
+def __session_shutdown_cb(session_manager):
+    registry = bundleregistry.get_registry()
+    registry.flush_favorites()
+    registry.flush_registry_cache()
+
+
 def __intro_window_done_cb(window):
     _begin_desktop_startup()
 
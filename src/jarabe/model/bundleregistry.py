@@ -16,7 +16,10 @@
 
 import os
 import logging
+import Queue
+import tempfile
 from threading import Thread, Lock
+from collections import OrderedDict, deque
 
 from gi.repository import GObject
 from gi.repository import GLib
@@ -33,6 +36,8 @@ from sugar3 import env
 
 from jarabe.model import desktop
 from jarabe.model import mimeregistry
+from jarabe.model.registrycache import RegistryCache
+from jarabe.util import downloadcache
 
 """
 The bundle registry is a database of sorts of the trackable bundles available
@@ -55,8 +60,36 @@ immediately by the shell.
 """
 
 _DEFAULT_VIEW = 0
+# Number of threads parsing bundles while the registry is loaded
+_SCAN_WORKERS = 4
+# Number of bundles installed at the same time
+_INSTALL_WORKERS = 3
+# Quiet time after which file monitor events are processed, in ms
+_MONITOR_EVENTS_DELAY = 500
+# Time changes to the favorites are kept in memory before being written
+_FAVORITES_FLUSH_DELAY = 2000
+# Time after bundles were added or removed before the registry cache is
+# written, in ms
+_REGISTRY_CACHE_SAVE_DELAY = 5000
 _instance = None
 
+# update-mime-database is not safe to run for several bundles at once,
+# installs that register MIME types take turns
+_mime_database_lock = Lock()
+
+
+def install_mime_type(bundle, install_path):
+    """Register the MIME types of a bundle installed at install_path"""
+    with _mime_database_lock:
+        bundle.install_mime_type(install_path)
+
+
+def _registers_mime_types(bundle):
+    # Installing an activity updates the shared MIME database for the
+    # MIME types it declares
+    return isinstance(bundle, ActivityBundle) and \
+        bool(bundle.get_mime_types())
+
 
 class BundleRegistry(GObject.GObject):
     """Tracks the available activity bundles"""
@@ -68,6 +101,10 @@ class BundleRegistry(GObject.GObject):
                            ([GObject.TYPE_PYOBJECT])),
         'bundle-changed': (GObject.SignalFlags.RUN_FIRST, None,
                            ([GObject.TYPE_PYOBJECT])),
+        # bundle, state ('started' or 'finished'), number of finished
+        # installs and total number of installs since the queue was idle
+        'install-progress': (GObject.SignalFlags.RUN_FIRST, None,
+                             ([GObject.TYPE_PYOBJECT, str, int, int])),
     }
 
     def __init__(self):
@@ -80,29 +117,56 @@ class BundleRegistry(GObject.GObject):
         self._install_queue = _InstallQueue(self)
 
         # Bundle installation happens in a separate thread, which needs
-        # access to _bundles. Protect all _bundles access with a lock.
+        # access to the bundles. Protect all access to the indexes below
+        # with a lock.
         self._lock = Lock()
-        self._bundles = []
+        # Bundles by path, in the order they were added
+        self._bundles_by_path = OrderedDict()
+        self._bundles_by_id = {}
+        self._bundles_by_version = {}
+        # Activity bundles by the mime types they declare
+        self._bundles_by_mime_type = {}
+        # Immutable copy of the bundles for iteration, rebuilt lazily
+        self._bundles_snapshot = ()
+
+        # Parsed bundles from the previous session
+        self._registry_cache = RegistryCache()
+        self._registry_cache_save_sid = None
 
         # hold a reference to the monitors so they don't get disposed
         self._gio_monitors = []
+        # Monitor events waiting to be processed, by path
+        self._monitor_events = OrderedDict()
+        self._monitor_events_sid = None
 
-        dirs = [env.get_user_activities_path(), env.get_user_library_path()]
-
+        self._system_dirs = []
         for data_dir in GLib.get_system_data_dirs():
-            dirs.append(os.path.join(data_dir, "sugar", "activities"))
+            self._system_dirs.append(
+                os.path.join(data_dir, "sugar", "activities"))
+        # All the bundles in the system dirs by path, including those
+        # shadowed by another version
+        self._system_bundles = {}
 
+        dirs = [env.get_user_activities_path(), env.get_user_library_path()]
+        dirs.extend(self._system_dirs)
+
+        self._scan_directories(dirs)
         for activity_dir in dirs:
-            self._scan_directory(activity_dir)
             directory = Gio.File.new_for_path(activity_dir)
             monitor = directory.monitor_directory(
                 flags=Gio.FileMonitorFlags.NONE, cancellable=None)
             monitor.connect('changed', self.__file_monitor_changed_cb)
             self._gio_monitors.append(monitor)
+        self._registry_cache.save(prune=True)
 
         self._favorite_bundles = []
         for i in range(desktop.get_number_of_views()):
             self._favorite_bundles.append({})
+        # Views with changes not written to disk yet
+        self._dirty_favorite_views = set()
+        self._favorites_flush_sid = None
+        # Contents of the favorites files as last read or written, by path
+        self._favorites_contents = {}
 
         settings = Gio.Settings('org.sugarlabs')
         self._protected_activities = settings.get_strv('protected-activities')
@@ -127,6 +191,8 @@ class BundleRegistry(GObject.GObject):
         if len(self._favorite_bundles) < number_of_views:
             for i in range(number_of_views - len(self._favorite_bundles)):
                 self._favorite_bundles.append({})
+        # Don't lose pending changes when reading the files again
+        self.flush_favorites()
         try:
             self._load_favorites()
         except Exception:
@@ -134,29 +200,69 @@ class BundleRegistry(GObject.GObject):
 
     def __file_monitor_changed_cb(self, monitor, one_file, other_file,
                                   event_type):
+        # Unpacking a bundle fires many events, only the last one for
+        # each path is processed once the directories are quiet
         if event_type == Gio.FileMonitorEvent.CREATED or \
-           event_type == Gio.FileMonitorEvent.ATTRIBUTE_CHANGED:
-            self.add_bundle(one_file.get_path(), set_favorite=True)
-        elif event_type == Gio.FileMonitorEvent.DELETED:
-            self.remove_bundle(one_file.get_path())
-            for root in GLib.get_system_data_dirs():
-                root = os.path.join(root, 'sugar', 'activities')
+           event_type == Gio.FileMonitorEvent.ATTRIBUTE_CHANGED or \
+           event_type == Gio.FileMonitorEvent.DELETED:
+            path = one_file.get_path()
+            if os.path.basename(path).startswith('.'):
+                return
+            self._monitor_events.pop(path, None)
+            self._monitor_events[path] = event_type
+
+            if self._monitor_events_sid is not None:
+                GLib.source_remove(self._monitor_events_sid)
+            self._monitor_events_sid = GLib.timeout_add(
+                _MONITOR_EVENTS_DELAY, self.__process_monitor_events_cb)
+
+    def __process_monitor_events_cb(self):
+        self._monitor_events_sid = None
+        events = self._monitor_events
+        self._monitor_events = OrderedDict()
+
+        for path, event_type in events.iteritems():
+            if event_type == Gio.FileMonitorEvent.DELETED:
+                self._bundle_dir_deleted(path)
+            else:
+                self._bundle_dir_created(path)
+        return False
 
-                try:
-                    os.listdir(root)
-                except OSError:
-                    logging.debug('Can not find GLib system dir %s', root)
-                    continue
-                activity_dir = os.path.basename(one_file.get_path())
-                try:
-                    bundle = bundle_from_dir(os.path.join(root, activity_dir))
-                except MalformedBundleException:
-                    continue
+    def _is_system_path(self, path):
+        return os.path.dirname(path) in self._system_dirs
 
-                if bundle is not None:
-                    path = bundle.get_path()
-                    if path is not None:
-                        self.add_bundle(path)
+    def _bundle_dir_created(self, path):
+        if not self._is_system_path(path):
+            self.add_bundle(path, set_favorite=True)
+            return
+
+        self._system_bundles.pop(path, None)
+        try:
+            bundle = self._load_bundle(path)
+        except MalformedBundleException:
+            logging.exception('Error loading bundle %r', path)
+            return
+        if bundle is None:
+            logging.error('No bundle in %r', path)
+            return
+
+        self._system_bundles[path] = bundle
+        self._register_bundle(bundle, set_favorite=True)
+        self._schedule_registry_cache_save()
+
+    def _bundle_dir_deleted(self, path):
+        self.remove_bundle(path)
+        if self._is_system_path(path):
+            self._system_bundles.pop(path, None)
+
+        # Fall back to a system bundle installed in a folder of the same
+        # name
+        activity_dir = os.path.basename(path)
+        for root in self._system_dirs:
+            bundle = self._system_bundles.get(
+                os.path.join(root, activity_dir))
+            if bundle is not None:
+                self._register_bundle(bundle)
 
     def _load_mime_defaults(self):
         defaults = {}
@@ -181,16 +287,21 @@ class BundleRegistry(GObject.GObject):
             raise ValueError('bundle_id cannot contain spaces')
         return '%s %s' % (bundle_id, version)
 
+    def _get_favorites_path(self, favorite_view):
+        # Special-case 0 for backward compatibility
+        if favorite_view == 0:
+            return env.get_profile_path('favorite_activities')
+        else:
+            return env.get_profile_path('favorite_activities_%d' %
+                                        (favorite_view))
+
     def _load_favorites(self):
         for i in range(desktop.get_number_of_views()):
-            # Special-case 0 for backward compatibility
-            if i == 0:
-                favorites_path = env.get_profile_path('favorite_activities')
-            else:
-                favorites_path = env.get_profile_path(
-                    'favorite_activities_%d' % (i))
+            favorites_path = self._get_favorites_path(i)
             if os.path.exists(favorites_path):
-                favorites_data = json.load(open(favorites_path))
+                with open(favorites_path) as favorites_file:
+                    contents = favorites_file.read()
+                favorites_data = json.loads(contents)
 
                 favorite_bundles = favorites_data['favorites']
                 if not isinstance(favorite_bundles, dict):
@@ -208,6 +319,7 @@ class BundleRegistry(GObject.GObject):
                                          favorites_path)
 
                 self._favorite_bundles[i] = favorite_bundles
+                self._favorites_contents[favorites_path] = contents
 
     def _load_hidden_activities(self):
         path = os.environ.get('SUGAR_ACTIVITIES_HIDDEN', None)
@@ -244,27 +356,62 @@ class BundleRegistry(GObject.GObject):
     def get_bundle(self, bundle_id):
         """Returns an bundle given his service name"""
         with self._lock:
-            for bundle in self._bundles:
-                if bundle.get_bundle_id() == bundle_id:
-                    return bundle
-        return None
+            return self._bundles_by_id.get(bundle_id)
 
     def __iter__(self):
         with self._lock:
-            copy = list(self._bundles)
-        return copy.__iter__()
+            if self._bundles_snapshot is None:
+                self._bundles_snapshot = \
+                    tuple(self._bundles_by_path.itervalues())
+            return iter(self._bundles_snapshot)
 
     def __len__(self):
         with self._lock:
-            return len(self._bundles)
+            return len(self._bundles_by_path)
 
-    def _scan_directory(self, path):
+    def _index_bundle(self, bundle):
+        # Must be called with the lock held
+        bundle_id = bundle.get_bundle_id()
+        self._bundles_by_path[bundle.get_path()] = bundle
+        self._bundles_by_id[bundle_id] = bundle
+        self._bundles_by_version[
+            (bundle_id, bundle.get_activity_version())] = bundle
+        if isinstance(bundle, ActivityBundle):
+            for mime_type in set(bundle.get_mime_types() or []):
+                self._bundles_by_mime_type.setdefault(mime_type, []).append(
+                    bundle)
+        self._bundles_snapshot = None
+
+    def _unindex_bundle(self, bundle_path):
+        # Must be called with the lock held
+        bundle = self._bundles_by_path.pop(bundle_path, None)
+        if bundle is None:
+            return None
+        bundle_id = bundle.get_bundle_id()
+        if self._bundles_by_id.get(bundle_id) is bundle:
+            del self._bundles_by_id[bundle_id]
+        key = (bundle_id, bundle.get_activity_version())
+        if self._bundles_by_version.get(key) is bundle:
+            del self._bundles_by_version[key]
+        if isinstance(bundle, ActivityBundle):
+            for mime_type in set(bundle.get_mime_types() or []):
+                bundles = self._bundles_by_mime_type[mime_type]
+                bundles.remove(bundle)
+                if not bundles:
+                    del self._bundles_by_mime_type[mime_type]
+        self._bundles_snapshot = None
+        return bundle
+
+    def _get_bundle_dirs(self, path):
         if not os.path.isdir(path):
-            return
+            return []
 
         # Sort by mtime to ensure a stable activity order
         bundles = {}
         for f in os.listdir(path):
+            # Hidden folders are used to stage installs
+            if f.startswith('.'):
+                continue
             try:
                 bundle_dir = os.path.join(path, f)
                 if os.path.isdir(bundle_dir):
@@ -275,14 +422,65 @@ class BundleRegistry(GObject.GObject):
 
         bundle_dirs = bundles.keys()
         bundle_dirs.sort(lambda d1, d2: cmp(bundles[d1], bundles[d2]))
-        for folder in bundle_dirs:
+        return bundle_dirs
+
+    def _scan_directories(self, paths):
+        bundle_dirs = []
+        for path in paths:
+            bundle_dirs.extend(self._get_bundle_dirs(path))
+
+        # Parse in parallel, then register in the order of the scan so
+        # the favorites keep a stable order
+        bundles = self._load_bundles(bundle_dirs)
+        for folder, bundle in zip(bundle_dirs, bundles):
+            if bundle is None:
+                continue
+            if self._is_system_path(folder):
+                self._system_bundles[folder] = bundle
             try:
-                self.add_bundle(folder, emit_signals=False)
+                self._register_bundle(bundle, emit_signals=False)
             except:
                 # pylint: disable=W0702
                 logging.exception('Error while processing installed activity'
                                   ' bundle %s:', folder)
 
+    def _load_bundles(self, bundle_dirs):
+        """Parse bundle_dirs with a pool of threads
+
+        Returns a list with the bundles in the order of bundle_dirs, and
+        None for the folders that could not be parsed.
+        """
+        bundles = [None] * len(bundle_dirs)
+        pending = Queue.Queue()
+        for index, folder in enumerate(bundle_dirs):
+            pending.put((index, folder))
+
+        def worker():
+            while True:
+                try:
+                    index, folder = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    bundles[index] = self._load_bundle(folder)
+                except MalformedBundleException:
+                    logging.exception('Error loading bundle %r', folder)
+                except:
+                    # pylint: disable=W0702
+                    logging.exception('Error while processing installed '
+                                      'activity bundle %s:', folder)
+                else:
+                    if bundles[index] is None:
+                        logging.error('No bundle in %r', folder)
+
+        threads = [Thread(target=worker)
+                   for i_ in range(min(_SCAN_WORKERS, len(bundle_dirs)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return bundles
+
     def add_bundle(self, bundle_path, set_favorite=False, emit_signals=True,
                    force_downgrade=False):
         """
@@ -293,7 +491,7 @@ class BundleRegistry(GObject.GObject):
         failure.
         """
         try:
-            bundle = bundle_from_dir(bundle_path)
+            bundle = self._load_bundle(bundle_path)
         except MalformedBundleException:
             logging.exception('Error loading bundle %r', bundle_path)
             return None
@@ -302,7 +500,13 @@ class BundleRegistry(GObject.GObject):
         if bundle is None:
             logging.error('No bundle in %r', bundle_path)
             return None
+        self._schedule_registry_cache_save()
+
+        return self._register_bundle(bundle, set_favorite, emit_signals,
+                                     force_downgrade)
 
+    def _register_bundle(self, bundle, set_favorite=False, emit_signals=True,
+                         force_downgrade=False):
         bundle_id = bundle.get_bundle_id()
         logging.debug('STARTUP: Adding bundle %s', bundle_id)
         installed = self.get_bundle(bundle_id)
@@ -329,20 +533,45 @@ class BundleRegistry(GObject.GObject):
                                       favorite)
 
         with self._lock:
-            self._bundles.append(bundle)
+            self._index_bundle(bundle)
         if emit_signals:
             self.emit('bundle-added', bundle)
         return bundle
 
+    def _load_bundle(self, bundle_path):
+        bundle = self._registry_cache.get_bundle(bundle_path)
+        if bundle is None:
+            bundle = bundle_from_dir(bundle_path)
+            if bundle is not None:
+                self._registry_cache.update(bundle_path, bundle)
+        return bundle
+
+    def _schedule_registry_cache_save(self):
+        if self._registry_cache_save_sid is None:
+            self._registry_cache_save_sid = GLib.timeout_add(
+                _REGISTRY_CACHE_SAVE_DELAY, self.__save_registry_cache_cb)
+
+    def __save_registry_cache_cb(self):
+        self._registry_cache_save_sid = None
+        self.flush_registry_cache()
+        return False
+
+    def flush_registry_cache(self):
+        """Write the pending changes to the registry cache to disk"""
+        if self._registry_cache_save_sid is not None:
+            GLib.source_remove(self._registry_cache_save_sid)
+            self._registry_cache_save_sid = None
+        self._registry_cache.save()
+
     def remove_bundle(self, bundle_path, emit_signals=True):
-        removed = None
-        self._lock.acquire()
-        for bundle in self._bundles:
-            if bundle.get_path() == bundle_path:
-                self._bundles.remove(bundle)
-                removed = bundle
-                break
-        self._lock.release()
+        with self._lock:
+            removed = self._unindex_bundle(bundle_path)
+
+        # Bundles shadowed by a newer version are still on disk and
+        # keep their entry
+        if not os.path.exists(bundle_path):
+            self._registry_cache.remove(bundle_path)
+            self._schedule_registry_cache_save()
 
         if emit_signals and removed is not None:
             self.emit('bundle-removed', removed)
@@ -351,21 +580,23 @@ class BundleRegistry(GObject.GObject):
     def get_activities_for_type(self, mime_type):
         result = []
 
+        with self._lock:
+            bundles = list(self._bundles_by_mime_type.get(mime_type, []))
+        if not bundles:
+            return result
+
         mime = mimeregistry.get_registry()
         default_bundle_id = mime.get_default_activity(mime_type)
         default_bundle = None
+        system_default_bundle_id = self.get_default_for_type(mime_type)
 
-        for bundle in self:
-            if not isinstance(bundle, ActivityBundle):
-                continue
-            if mime_type in (bundle.get_mime_types() or []):
-                if bundle.get_bundle_id() == default_bundle_id:
-                    default_bundle = bundle
-                elif self.get_default_for_type(mime_type) == \
-                        bundle.get_bundle_id():
-                    result.insert(0, bundle)
-                else:
-                    result.append(bundle)
+        for bundle in bundles:
+            if bundle.get_bundle_id() == default_bundle_id:
+                default_bundle = bundle
+            elif system_default_bundle_id == bundle.get_bundle_id():
+                result.insert(0, bundle)
+            else:
+                result.append(bundle)
 
         if default_bundle is not None:
             result.insert(0, default_bundle)
@@ -377,10 +608,9 @@ class BundleRegistry(GObject.GObject):
 
     def _find_bundle(self, bundle_id, version):
         with self._lock:
-            for bundle in self._bundles:
-                if bundle.get_bundle_id() == bundle_id and \
-                        bundle.get_activity_version() == version:
-                    return bundle
+            bundle = self._bundles_by_version.get((bundle_id, version))
+        if bundle is not None:
+            return bundle
         raise ValueError('No bundle %r with version %r exists.' %
                          (bundle_id, version))
 
@@ -451,22 +681,49 @@ class BundleRegistry(GObject.GObject):
                 tuple(self._favorite_bundles[favorite_view][key]['position'])
 
     def _write_favorites_file(self, favorite_view):
-        if favorite_view == 0:
-            path = env.get_profile_path('favorite_activities')
-        else:
-            path = env.get_profile_path('favorite_activities_%d' %
-                                        (favorite_view))
-        favorites_data = {
-            'favorites': self._favorite_bundles[favorite_view]}
-        json.dump(favorites_data, open(path, 'w'), indent=1)
+        self._dirty_favorite_views.add(favorite_view)
+        if self._favorites_flush_sid is None:
+            self._favorites_flush_sid = GLib.timeout_add(
+                _FAVORITES_FLUSH_DELAY, self.__flush_favorites_cb)
+
+    def __flush_favorites_cb(self):
+        self._favorites_flush_sid = None
+        self.flush_favorites()
+        return False
+
+    def flush_favorites(self):
+        """Write the pending changes to the favorites to disk"""
+        if self._favorites_flush_sid is not None:
+            GLib.source_remove(self._favorites_flush_sid)
+            self._favorites_flush_sid = None
+
+        dirty_views = self._dirty_favorite_views
+        self._dirty_favorite_views = set()
+        for favorite_view in sorted(dirty_views):
+            path = self._get_favorites_path(favorite_view)
+            favorites_data = {
+                'favorites': self._favorite_bundles[favorite_view]}
+            contents = json.dumps(favorites_data, indent=1, sort_keys=True)
+            if contents == self._favorites_contents.get(path):
+                continue
+
+            try:
+                fd, temp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(path))
+                with os.fdopen(fd, 'w') as favorites_file:
+                    favorites_file.write(contents)
+                os.rename(temp_path, path)
+            except EnvironmentError:
+                logging.exception('Error writing favorites file %r', path)
+                continue
+            self._favorites_contents[path] = contents
 
     def is_installed(self, bundle):
-        for installed_bundle in self:
-            if bundle.get_bundle_id() == installed_bundle.get_bundle_id() and \
-                    NormalizedVersion(bundle.get_activity_version()) == \
-                    NormalizedVersion(installed_bundle.get_activity_version()):
-                return True
-        return False
+        installed_bundle = self.get_bundle(bundle.get_bundle_id())
+        if installed_bundle is None:
+            return False
+        return NormalizedVersion(bundle.get_activity_version()) == \
+            NormalizedVersion(installed_bundle.get_activity_version())
 
     def install(self, bundle, force_downgrade=False):
         """
@@ -504,7 +761,7 @@ class BundleRegistry(GObject.GObject):
         user_data[0] = result
 
     def install_async(self, bundle, callback, user_data,
-                      force_downgrade=False):
+                      force_downgrade=False, cache_archive=True):
         """
         Asynchronous version of install().
         The result of the installation is presented to a user-defined callback
@@ -515,8 +772,11 @@ class BundleRegistry(GObject.GObject):
           3. The user_data passed to this method
 
         The callback is always invoked from main-loop context.
+
+        Unless cache_archive is False, the archive the bundle was installed
+        from is kept in the download cache.
         """
-        self._install_queue.enqueue(bundle, force_downgrade,
+        self._install_queue.enqueue(bundle, force_downgrade, cache_archive,
                                     self._bundle_installed_cb,
                                     [callback, user_data])
 
@@ -590,25 +850,8 @@ class BundleRegistry(GObject.GObject):
         Returns a list of ActivityBundle or ContentBundle objects, or an empty
         list if there are none found.
         """
-        bundles = []
-        for root in GLib.get_system_data_dirs():
-            root = os.path.join(root, 'sugar', 'activities')
-
-            try:
-                dir_list = os.listdir(root)
-            except OSError:
-                logging.debug('Can not find GLib system dir %s', root)
-                continue
-
-            for activity_dir in dir_list:
-                try:
-                    bundle = bundle_from_dir(os.path.join(root, activity_dir))
-                except MalformedBundleException:
-                    continue
-
-                if bundle.get_bundle_id() == bundle_id:
-                    bundles.append(bundle)
-        return bundles
+        return [bundle for bundle in self._system_bundles.itervalues()
+                if bundle.get_bundle_id() == bundle_id]
 
 
 class _InstallQueue(object):
@@ -616,43 +859,86 @@ class _InstallQueue(object):
     A class to represent a queue of bundles to be installed, and to handle
     execution of each task in the queue. Only for internal bundleregistry use.
 
-    The use of a queue means that we serialize all bundle upgrade processing.
-    This is necessary to avoid many difficult corner-cases like: what happens
-    if two users try to asynchronously and simultaenously install different
-    version of the same bundle?
-
-    We maintain at maximum one thread to do the actual bundle install. When
-    done, the thread enqueues a callback in the main thread (via the GLib
-    main loop).
+    The use of a queue means that we serialize the processing of each
+    bundle. This is necessary to avoid many difficult corner-cases like:
+    what happens if two users try to asynchronously and simultaenously
+    install different version of the same bundle?
+
+    We maintain at maximum _INSTALL_WORKERS threads to do the actual bundle
+    installs. Tasks are started in the order they were enqueued, but a task
+    waits until the one for the same bundle id that is being processed has
+    been completed in the main thread. When done, the threads enqueue a
+    callback in the main thread (via the GLib main loop), and progress is
+    reported through the 'install-progress' signal of the registry.
     """
 
     def __init__(self, registry):
         self._lock = Lock()
-        self._queue = []
-        self._thread_running = False
+        self._queue = deque()
+        self._active_ids = set()
+        self._workers_running = 0
+        self._finished_count = 0
+        self._total_count = 0
         self._registry = registry
 
-    def enqueue(self, bundle, force_downgrade, callback, user_data):
-        task = _InstallTask(bundle, force_downgrade, callback, user_data)
-        self._lock.acquire()
-        self._queue.append(task)
-        if not self._thread_running:
-            self._thread_running = True
-            Thread(target=self._thread_func).start()
-        self._lock.release()
+    def enqueue(self, bundle, force_downgrade, cache_archive, callback,
+                user_data):
+        task = _InstallTask(bundle, force_downgrade, cache_archive, callback,
+                            user_data)
+        with self._lock:
+            self._queue.append(task)
+            self._total_count += 1
+            self._start_worker()
 
-    def _thread_func(self):
-        while True:
-            self._lock.acquire()
-            if len(self._queue) == 0:
-                self._thread_running = False
-                self._lock.release()
+    def _start_worker(self):
+        # Must be called with the lock held
+        if self._workers_running >= _INSTALL_WORKERS:
+            return
+        for task in self._queue:
+            if task.key not in self._active_ids:
+                self._workers_running += 1
+                Thread(target=self._thread_func).start()
                 return
 
-            task = self._queue.pop()
-            self._lock.release()
+    def _get_next_task(self):
+        # Must be called with the lock held
+        for task in self._queue:
+            if task.key not in self._active_ids:
+                self._queue.remove(task)
+                self._active_ids.add(task.key)
+                return task
+        return None
+
+    def _thread_func(self):
+        while True:
+            with self._lock:
+                task = self._get_next_task()
+                if task is None:
+                    self._workers_running -= 1
+                    return
+                GLib.idle_add(self._registry.emit, 'install-progress',
+                              task.bundle, 'started', self._finished_count,
+                              self._total_count)
 
             self._do_work(task)
+            # Queued after the completion callback of the task, so the
+            # next task for this bundle id sees the result registered
+            GLib.idle_add(self._task_finished_cb, task)
+
+    def _task_finished_cb(self, task):
+        with self._lock:
+            self._active_ids.discard(task.key)
+            self._finished_count += 1
+            finished_count = self._finished_count
+            total_count = self._total_count
+            if not self._queue and not self._active_ids:
+                self._finished_count = 0
+                self._total_count = 0
+            self._start_worker()
+
+        self._registry.emit('install-progress', task.bundle, 'finished',
+                            finished_count, total_count)
+        return False
 
     def _do_work(self, task):
         bundle = task.bundle
@@ -678,7 +964,9 @@ class _InstallQueue(object):
             # Uninstall the previous version, if we can
             if act.is_user_activity():
                 try:
-                    act.uninstall()
+                    # Uninstalling updates the MIME database too
+                    with _mime_database_lock:
+                        act.uninstall()
                 except:
                     logging.exception('Uninstall failed, still trying to '
                                       'install newer bundle')
@@ -688,10 +976,31 @@ class _InstallQueue(object):
                                 'activities')
 
         try:
-            task.queue_callback(bundle.install())
+            if _registers_mime_types(bundle):
+                with _mime_database_lock:
+                    result = bundle.install()
+            else:
+                result = bundle.install()
         except Exception as e:
             logging.debug("InstallThread install failed: %r", e)
             task.queue_callback(e)
+            return
+
+        # Before the callback, which may remove the archive
+        if task.cache_archive:
+            self._cache_archive(bundle)
+        task.queue_callback(result)
+
+    def _cache_archive(self, bundle):
+        # Keep the archive of the bundle, so the updater or a download of
+        # the same file doesn't need to fetch it again
+        path = bundle.get_path()
+        if not os.path.isfile(path):
+            return
+        try:
+            downloadcache.get_cache().add_file(path)
+        except EnvironmentError:
+            logging.exception('Could not add %s to the download cache', path)
 
 
 class _InstallTask(object):
@@ -700,11 +1009,16 @@ class _InstallTask(object):
     Only for use internal to InstallQueue.
     """
 
-    def __init__(self, bundle, force_downgrade, callback, user_data):
+    def __init__(self, bundle, force_downgrade, cache_archive, callback,
+                 user_data):
         self.bundle = bundle
         self.callback = callback
         self.force_downgrade = force_downgrade
+        self.cache_archive = cache_archive
         self.user_data = user_data
+        # Tasks with the same key are never processed at the same time,
+        # bundles without an id don't conflict with each other
+        self.key = bundle.get_bundle_id() or self
 
     def queue_callback(self, result):
         GLib.idle_add(self.callback, self.bundle, result, self.user_data)
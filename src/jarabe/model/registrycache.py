@@ -0,0 +1,306 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import json
+import locale
+import inspect
+import tempfile
+from threading import Lock
+
+from sugar3.bundle.bundle import Bundle
+from sugar3.bundle.activitybundle import ActivityBundle
+from sugar3.bundle.contentbundle import ContentBundle
+from sugar3 import env
+
+
+_CACHE_FILE = 'activity-registry.json'
+_CACHE_VERSION = 3
+
+# Attributes of the bundles the toolkit is known to set while parsing
+_BUNDLE_FIELDS = ('_path', '_zip_root_dir', '_zip_file', '_installation_time',
+                  '_manifest', '_name', '_local_name', '_icon', '_bundle_id',
+                  '_summary', '_description', '_mime_types', '_tags',
+                  '_activity_version')
+_ACTIVITY_BUNDLE_FIELDS = _BUNDLE_FIELDS + (
+    'activity_class', 'bundle_exec', '_show_launcher', '_single_instance',
+    '_max_participants', '_categories', '_url', '_repository', '_license')
+_CONTENT_BUNDLE_FIELDS = _BUNDLE_FIELDS + (
+    '_locale', '_l10n', '_category', '_subcategory', '_category_class',
+    '_category_icon', '_library_version', '_bundle_class', '_activity_start',
+    '_global_name', '_home_page')
+
+# Public accessors that must work on a restored bundle
+_BUNDLE_ACCESSORS = ('get_path', 'get_bundle_id', 'get_name',
+                     'get_activity_version')
+
+# Bundle classes that can be restored from the cache, with the path of
+# their info file relative to the bundle and the attributes that are
+# stored. Bundles with other attributes are not cached.
+_BUNDLE_TYPES = {
+    'ActivityBundle': (ActivityBundle,
+                       os.path.join('activity', 'activity.info'),
+                       _ACTIVITY_BUNDLE_FIELDS),
+    'ContentBundle': (ContentBundle,
+                      os.path.join('library', 'library.info'),
+                      _CONTENT_BUNDLE_FIELDS),
+}
+
+
+def _get_environment_key():
+    """Parsed bundles depend on the toolkit that parsed them and on the
+    language their translated fields were read for.
+    """
+    toolkit_mtimes = []
+    for bundle_class in (Bundle, ActivityBundle, ContentBundle):
+        try:
+            toolkit_mtimes.append(
+                os.stat(inspect.getfile(bundle_class)).st_mtime)
+        except (EnvironmentError, TypeError):
+            toolkit_mtimes.append(None)
+    return [toolkit_mtimes, os.environ.get('LANGUAGE'),
+            os.environ.get('LANG')]
+
+
+def _encode(value):
+    """Return a json value restored by _decode() with the same types,
+    json alone turns tuples into lists and strings into unicode.
+    """
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    elif isinstance(value, str):
+        return ['s', value.decode('utf-8')]
+    elif isinstance(value, unicode):
+        return ['u', value]
+    elif isinstance(value, list):
+        return ['l', [_encode(item) for item in value]]
+    elif isinstance(value, tuple):
+        return ['t', [_encode(item) for item in value]]
+    elif isinstance(value, dict):
+        return ['d', [[_encode(key), _encode(item)]
+                      for key, item in value.iteritems()]]
+    raise TypeError('Can not store %r' % type(value))
+
+
+def _decode(value):
+    if not isinstance(value, list):
+        return value
+
+    tag, payload = value
+    if tag == 's':
+        return payload.encode('utf-8')
+    elif tag == 'u':
+        return payload
+    elif tag == 'l':
+        return [_decode(item) for item in payload]
+    elif tag == 't':
+        return tuple(_decode(item) for item in payload)
+    elif tag == 'd':
+        return dict((_decode(key), _decode(item)) for key, item in payload)
+    raise ValueError('Unknown tag %r' % tag)
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except EnvironmentError:
+        return None
+
+
+def _stat_bundle(path, info_path):
+    """Return the modification times the parsed bundle depends on: the
+    ones of the bundle directory, its info file, its locale directory and
+    the translated info files that can be read for the current language.
+    """
+    mtimes = [_get_mtime(path), _get_mtime(os.path.join(path, info_path))]
+    if None in mtimes:
+        return None
+
+    locale_path = os.path.join(path, 'locale')
+    mtimes.append(_get_mtime(locale_path))
+    linfo_name = os.path.splitext(os.path.basename(info_path))[0] + '.linfo'
+    lang = locale.getdefaultlocale()[0]
+    if lang:
+        for lang_dir in (lang, lang[:2]):
+            mtimes.append(_get_mtime(os.path.join(locale_path, lang_dir,
+                                                  linfo_name)))
+    return mtimes
+
+
+class RegistryCache(object):
+    """Persistent cache of the parsed activity and content bundles
+
+    Entries are keyed by the path of the bundle and are only trusted
+    while the modification times of the bundle directory, of its info
+    file and of its translations are unchanged, so a bundle is validated
+    with a few stat calls instead of being parsed again. The whole cache
+    is discarded when it is missing, corrupted or was written by a
+    different toolkit or for a different language.
+
+    An entry is only restored when it has every attribute the toolkit
+    set on all the bundles of its type that it parsed, and when the
+    public accessors work on the result. Otherwise the bundle is parsed
+    again.
+    """
+
+    def __init__(self):
+        self._path = env.get_profile_path(_CACHE_FILE)
+        self._environment = _get_environment_key()
+        self._entries = {}
+        # type name -> attributes set on every parsed bundle of the type
+        self._attributes = {}
+        self._seen = set()
+        self._dirty = False
+        self._lock = Lock()
+
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+
+        try:
+            with open(self._path) as cache_file:
+                data = json.load(cache_file)
+        except (ValueError, EnvironmentError):
+            logging.warning('Discarding corrupted registry cache %r',
+                            self._path)
+            return
+
+        if not isinstance(data, dict) or \
+                data.get('version') != _CACHE_VERSION or \
+                data.get('environment') != self._environment or \
+                not isinstance(data.get('entries'), dict) or \
+                not isinstance(data.get('attributes'), dict):
+            return
+
+        self._entries = data['entries']
+        self._attributes = data['attributes']
+
+    def get_bundle(self, path):
+        """Return the cached bundle for path, or None when the entry is
+        missing or stale.
+        """
+        with self._lock:
+            self._seen.add(path)
+            entry = self._entries.get(path)
+        if entry is None:
+            return None
+
+        try:
+            type_name, mtimes, state = entry
+            bundle_class, info_path, fields = _BUNDLE_TYPES[type_name]
+            missing_fields = set(self._attributes[type_name]) - set(state)
+        except (KeyError, TypeError, ValueError):
+            logging.warning('Discarding corrupted registry cache entry %r',
+                            path)
+            return None
+
+        if missing_fields:
+            logging.debug('Registry cache entry %r misses attributes %r',
+                          path, sorted(missing_fields))
+            return None
+
+        if _stat_bundle(path, info_path) != mtimes:
+            return None
+
+        restored = bundle_class.__new__(bundle_class)
+        try:
+            for field in fields:
+                if field in state:
+                    setattr(restored, field, _decode(state[field]))
+            for accessor in _BUNDLE_ACCESSORS:
+                getattr(restored, accessor)()
+        except (AttributeError, TypeError, ValueError):
+            logging.warning('Discarding corrupted registry cache entry %r',
+                            path)
+            return None
+        return restored
+
+    def update(self, path, bundle):
+        """Remember a freshly parsed bundle"""
+        type_name = bundle.__class__.__name__
+        if type_name not in _BUNDLE_TYPES:
+            return
+        bundle_class_, info_path, fields = _BUNDLE_TYPES[type_name]
+        attributes = set(bundle.__dict__)
+        unknown_fields = attributes - set(fields)
+        if unknown_fields:
+            logging.debug('Not caching bundle %r with attributes %r', path,
+                          sorted(unknown_fields))
+            return
+        mtimes = _stat_bundle(path, info_path)
+        if mtimes is None:
+            return
+
+        try:
+            state = dict((field, _encode(value))
+                         for field, value in bundle.__dict__.iteritems())
+        except (TypeError, ValueError):
+            logging.debug('Not caching bundle %r', path)
+            return
+
+        with self._lock:
+            self._seen.add(path)
+            self._entries[path] = [type_name, mtimes, state]
+            if type_name in self._attributes:
+                attributes &= set(self._attributes[type_name])
+            self._attributes[type_name] = sorted(attributes)
+            self._dirty = True
+
+    def remove(self, path):
+        """Forget the bundle at path, after it was removed"""
+        with self._lock:
+            self._seen.discard(path)
+            if self._entries.pop(path, None) is not None:
+                self._dirty = True
+
+    def save(self, prune=False):
+        """Write the cache to disk if it changed
+
+        With prune set, entries for bundles that were not looked up or
+        updated since the cache was loaded are dropped first.
+        """
+        with self._lock:
+            if prune:
+                for path in set(self._entries) - self._seen:
+                    del self._entries[path]
+                    self._dirty = True
+                self._seen = set()
+
+            if not self._dirty:
+                return
+            data = json.dumps({'version': _CACHE_VERSION,
+                               'environment': self._environment,
+                               'entries': self._entries,
+                               'attributes': self._attributes})
+            self._dirty = False
+
+        cache_dir = os.path.dirname(self._path)
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as cache_file:
+                cache_file.write(data)
+            os.rename(temp_path, self._path)
+        except EnvironmentError:
+            logging.exception('Could not write registry cache %r',
+                              self._path)
+            if temp_path is not None and os.path.exists(temp_path):
+                os.unlink(temp_path)
+            # Try again on the next save
+            with self._lock:
+                self._dirty = True
@@ -17,7 +17,7 @@
 
 class BundleUpdate(object):
     def __init__(self, bundle_id, name, version, link, size,
-                 icon_file_name=None, optional=False):
+                 icon_file_name=None, optional=False, sha256=None):
         self.bundle_id = bundle_id
         self.name = name
         self.version = version
@@ -25,3 +25,5 @@ class BundleUpdate(object):
         self.size = size
         self.icon_file_name = icon_file_name
         self.optional = optional
+        # hex SHA-256 of the bundle, if the server tells it
+        self.sha256 = sha256
@@ -57,17 +57,26 @@ from sugar3.bundle.bundleversion import NormalizedVersion
 from sugar3.bundle.bundleversion import InvalidVersionError
 
 from jarabe import config
+from jarabe.model import bundleregistry
 from jarabe.model.update import BundleUpdate
+from jarabe.model.update.responsecache import ResponseCache
 from jarabe.util.downloader import Downloader
+from jarabe.util.downloader import SOUP_STATUS_NOT_MODIFIED
 
 _FIND_DESCRIPTION = \
     './/{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Description'
 _FIND_VERSION = './/{http://www.mozilla.org/2004/em-rdf#}version'
 _FIND_LINK = './/{http://www.mozilla.org/2004/em-rdf#}updateLink'
 _FIND_SIZE = './/{http://www.mozilla.org/2004/em-rdf#}updateSize'
+_FIND_HASH = './/{http://www.mozilla.org/2004/em-rdf#}updateHash'
 
 _UPDATE_PATH = 'http://activities.sugarlabs.org/services/update-aslo.php'
 
+# Number of bundles checked at the same time
+_MAX_CHECKS_IN_FLIGHT = 8
+# Seconds to wait for the answer about one bundle
+_CHECK_TIMEOUT = 30
+
 _logger = logging.getLogger('ASLO')
 
 
@@ -77,9 +86,17 @@ class _UpdateChecker(GObject.GObject):
     }
     _CHUNK_SIZE = 10240
 
-    def __init__(self):
+    def __init__(self, cache):
         GObject.GObject.__init__(self)
+        self._cache = cache
         self._bundle = None
+        self._url = None
+        self._downloader = None
+        self._timeout_sid = None
+        self._timed_out = False
+
+    def get_bundle(self):
+        return self._bundle
 
     def check(self, bundle):
         # ASLO knows only about stable SP releases
@@ -90,40 +107,77 @@ class _UpdateChecker(GObject.GObject):
             (_UPDATE_PATH, bundle.get_bundle_id(), sp_version)
 
         self._bundle = bundle
+        self._url = url
 
         _logger.debug('Fetch %s', url)
-        self._downloader = Downloader(url)
+        self._downloader = Downloader(
+            url, request_headers=self._cache.get_request_headers(url))
         self._downloader.connect('complete', self.__downloader_complete_cb)
         self._downloader.download()
+        self._timeout_sid = GLib.timeout_add_seconds(_CHECK_TIMEOUT,
+                                                     self.__timeout_cb)
+
+    def cancel(self):
+        if self._downloader is not None:
+            self._downloader.cancel()
+
+    def __timeout_cb(self):
+        self._timeout_sid = None
+        self._timed_out = True
+        self.cancel()
+        return False
 
     def __downloader_complete_cb(self, downloader, result):
+        self._downloader = None
+        if self._timeout_sid is not None:
+            GLib.source_remove(self._timeout_sid)
+            self._timeout_sid = None
+
+        if self._timed_out:
+            self.emit('check-complete',
+                      IOError('Timed out checking %s' %
+                              self._bundle.get_bundle_id()))
+            return
+
         if isinstance(result, Exception):
             self.emit('check-complete', result)
             return
 
+        if downloader.get_status_code() == SOUP_STATUS_NOT_MODIFIED:
+            # Same answer as last time, no need to parse it again
+            update_info = self._cache.get_data(self._url)
+            self.emit('check-complete', self._get_update(update_info))
+            return
+
         if result is None:
             _logger.error('No XML update data returned from ASLO')
+            self.emit('check-complete', None)
             return
 
-        document = XML(result.get_data())
+        try:
+            document = XML(result.get_data())
+        except SyntaxError as e:
+            self.emit('check-complete', e)
+            return
+
+        update_info = self._parse_update_info(document)
+        self._cache.set_data(self._url, update_info, downloader)
+        self.emit('check-complete', self._get_update(update_info))
 
+    def _parse_update_info(self, document):
         if document.find(_FIND_DESCRIPTION) is None:
             _logger.debug('Bundle %s not available in the server for the '
                           'version %s',
                           self._bundle.get_bundle_id(),
                           config.version)
-            version = None
-            link = None
-            size = None
-            self.emit('check-complete', None)
-            return
+            return None
 
+        version = document.find(_FIND_VERSION).text
         try:
-            version = NormalizedVersion(document.find(_FIND_VERSION).text)
+            NormalizedVersion(version)
         except InvalidVersionError:
             _logger.exception('Exception occurred while parsing version')
-            self.emit('check-complete', None)
-            return
+            return None
 
         link = document.find(_FIND_LINK).text
 
@@ -133,18 +187,39 @@ class _UpdateChecker(GObject.GObject):
             _logger.exception('Exception occurred while parsing size')
             size = 0
 
-        if version > NormalizedVersion(self._bundle.get_activity_version()):
-            result = BundleUpdate(self._bundle.get_bundle_id(),
-                                  self._bundle.get_name(), version, link, size)
-        else:
-            result = None
+        sha256 = None
+        update_hash = document.find(_FIND_HASH)
+        if update_hash is not None and update_hash.text and \
+                update_hash.text.startswith('sha256:'):
+            sha256 = update_hash.text[len('sha256:'):].lower()
+
+        return [version, link, size, sha256]
 
-        self.emit('check-complete', result)
+    def _get_update(self, update_info):
+        if update_info is None:
+            return None
+
+        version, link, size = update_info[:3]
+        # answers cached before the hash was kept don't have it
+        sha256 = update_info[3] if len(update_info) > 3 else None
+        version = NormalizedVersion(version)
+        if version > NormalizedVersion(self._bundle.get_activity_version()):
+            return BundleUpdate(self._bundle.get_bundle_id(),
+                                self._bundle.get_name(), version, link, size,
+                                sha256=sha256)
+        return None
 
 
 class AsloUpdater(object):
     """
     Track state while querying Activites.SugarLabs.Org for activity updates.
+
+    Up to _MAX_CHECKS_IN_FLIGHT bundles are checked at the same time,
+    sharing the connections of the Soup session. Progress is reported in
+    the order of the bundles, whatever order the answers arrive in.
+
+    The answers are kept in a ResponseCache, and bundles are checked
+    with conditional requests so unchanged answers are not parsed again.
     """
 
     def __init__(self):
@@ -152,33 +227,65 @@ class AsloUpdater(object):
         self._progress_cb = None
         self._cancelling = False
         self._updates = []
-        self._checker = _UpdateChecker()
-        self._checker.connect('check-complete', self._check_complete_cb)
+        self._bundles_to_check = []
+        self._next_bundle = 0
+        self._results = []
+        self._next_result = 0
+        self._checkers = {}
+        self._cache = None
+
+    def _check_complete_cb(self, checker, result, index):
+        del self._checkers[index]
 
-    def _check_complete_cb(self, checker, result):
         if isinstance(result, Exception):
             logging.warning("Failed to check bundle: %r", result)
-        elif isinstance(result, BundleUpdate):
-            self._updates.append(result)
+            result = None
+        self._results[index] = result
 
         if self._cancelling:
-            self._completion_cb(None)
-        else:
-            GLib.idle_add(self._check_next_update)
-
-    def _check_next_update(self):
-        total = self._total_bundles_to_check
-        current = total - len(self._bundles_to_check)
-        progress = current / float(total)
+            if not self._checkers:
+                self._completion_cb(None)
+            return
 
-        if not self._bundles_to_check:
+        self._report_results()
+        self._check_next_updates()
+
+    def _report_results(self):
+        total = len(self._bundles_to_check)
+        while self._next_result < self._next_bundle and \
+                self._next_result not in self._checkers:
+            bundle = self._bundles_to_check[self._next_result]
+            result = self._results[self._next_result]
+            if isinstance(result, BundleUpdate):
+                self._updates.append(result)
+
+            self._next_result += 1
+            self._progress_cb(bundle.get_name(),
+                              self._next_result / float(total))
+
+    def _check_next_updates(self):
+        while len(self._checkers) < _MAX_CHECKS_IN_FLIGHT and \
+                self._next_bundle < len(self._bundles_to_check):
+            index = self._next_bundle
+            self._next_bundle += 1
+
+            bundle = self._bundles_to_check[index]
+            _logger.debug("Checking %s", bundle.get_bundle_id())
+            checker = _UpdateChecker(self._cache)
+            checker.connect('check-complete', self._check_complete_cb, index)
+            self._checkers[index] = checker
+            checker.check(bundle)
+
+        if not self._checkers:
+            self._cache.save(prune=self._checked_all_installed())
             self._completion_cb(self._updates)
-            return
 
-        bundle = self._bundles_to_check.pop()
-        _logger.debug("Checking %s", bundle.get_bundle_id())
-        self._progress_cb(bundle.get_name(), progress)
-        self._checker.check(bundle)
+    def _checked_all_installed(self):
+        # Answers about bundles left out of this run are still good
+        checked_ids = set(bundle.get_bundle_id()
+                          for bundle in self._bundles_to_check)
+        return all(bundle.get_bundle_id() in checked_ids
+                   for bundle in bundleregistry.get_registry())
 
     def fetch_update_info(self, installed_bundles, auto, progress_cb,
                           completion_cb, error_cb):
@@ -187,12 +294,18 @@ class AsloUpdater(object):
         self._error_cb = error_cb
         self._cancelling = False
         self._updates = []
-        self._bundles_to_check = installed_bundles
-        self._total_bundles_to_check = len(self._bundles_to_check)
-        self._check_next_update()
+        self._bundles_to_check = list(installed_bundles)
+        self._next_bundle = 0
+        self._results = [None] * len(self._bundles_to_check)
+        self._next_result = 0
+        self._checkers = {}
+        self._cache = ResponseCache('aslo')
+        self._check_next_updates()
 
     def cancel(self):
         self._cancelling = True
+        for checker in self._checkers.values():
+            checker.cancel()
 
     def clean(self):
         pass
@@ -25,7 +25,10 @@ http://wiki.sugarlabs.org/go/Activity_Team/Activity_Microformat
 import os
 import locale
 import logging
+from collections import deque
 from tempfile import NamedTemporaryFile
+from threading import Lock
+from threading import Thread
 
 from StringIO import StringIO
 from ConfigParser import ConfigParser
@@ -39,15 +42,22 @@ from gi.repository import Gio
 
 from sugar3.bundle.bundleversion import NormalizedVersion, InvalidVersionError
 
+from jarabe.util import downloadcache
 from jarabe.util import httprange
 from jarabe.model import bundleregistry
 from jarabe.model.update import BundleUpdate
+from jarabe.model.update.responsecache import ResponseCache
 from jarabe.util.downloader import Downloader
+from jarabe.util.downloader import SOUP_STATUS_NOT_MODIFIED
+from jarabe.util.downloader import new_sync_soup_session
 
 _logger = logging.getLogger('microformat')
 _MICROFORMAT_URL_PATH = 'org.sugarlabs.update'
 _MICROFORMAT_URL_KEY = 'microformat-update-url'
 
+# Metadata lookups running at the same time
+_LOOKUP_WORKERS = 4
+
 
 class _UpdateHTMLParser(HTMLParser):
     """HTML parser to pull out data expressed in our microformat."""
@@ -188,10 +198,26 @@ class MicroformatUpdater(object):
        a) If we already have this activity installed, use GIO to asynchronously
           lookup the size of the download.
        b) If we don't have the activity installed, use MetadataLookup
-          to lookup activity name and size.
+          to lookup activity name and size. Up to _LOOKUP_WORKERS lookups
+          run at the same time in threads, while the next updates are
+          being checked, and they report back through the main loop.
+
+    The parsed page, and the size, name and icon found for each link, are
+    kept in a ResponseCache. The page is requested conditionally, it is
+    not parsed again when it did not change, and the entries that did not
+    change are not looked up again.
     """
     def __init__(self):
         self._icon_temp_files = []
+        self._cache = None
+        self._unchanged_links = set()
+        self._lock = Lock()
+        self._lookup_queue = deque()
+        self._lookup_workers = 0
+        # Lookups started and not completed yet, in the main thread
+        self._lookups = set()
+        self._lookup_session = None
+        self._checking_done = False
 
     def _query(self):
         self.clean()
@@ -202,10 +228,12 @@ class MicroformatUpdater(object):
             self._completion_cb([])
             return
 
+        self._url = url
         self._parser = _UpdateHTMLParser(url)
         # wiki.laptop.org have agresive cache, we set max-age=600
         # to be sure the page is no older than 10 minutes
         request_headers = {'Cache-Control': 'max-age=600'}
+        request_headers.update(self._cache.get_request_headers(url))
         downloader = Downloader(url, request_headers=request_headers)
         downloader.connect('got-chunk', self._got_chunk_cb)
         downloader.connect('complete', self._complete_cb)
@@ -221,8 +249,30 @@ class MicroformatUpdater(object):
             self._error_cb(result)
             return
 
-        self._parser.close()
-        _logger.debug("Found %d activities", len(self._parser.results))
+        cached_results = self._cache.get_data(self._url) or {}
+        if downloader.get_status_code() == SOUP_STATUS_NOT_MODIFIED:
+            results = cached_results
+            self._results = {}
+            for bundle_id, (version, link, optional) in results.iteritems():
+                self._results[bundle_id] = (NormalizedVersion(version), link,
+                                            optional)
+        else:
+            self._parser.close()
+            self._results = self._parser.results
+            results = {}
+            for bundle_id, (version, link, optional) in \
+                    self._results.iteritems():
+                results[bundle_id] = [str(version), link, optional]
+            self._cache.set_data(self._url, results, downloader)
+
+        # The size and name found last time are still good for the entries
+        # that did not change
+        self._unchanged_links = set()
+        for bundle_id, entry in results.iteritems():
+            if cached_results.get(bundle_id) == entry:
+                self._unchanged_links.add(entry[1])
+
+        _logger.debug("Found %d activities", len(self._results))
         self._filter_results()
         self._check_next_update()
 
@@ -231,7 +281,7 @@ class MicroformatUpdater(object):
         # version installed. Queue the remaining ones to be checked.
         registry = bundleregistry.get_registry()
         self._bundles_to_check = []
-        for bundle_id, data in self._parser.results.iteritems():
+        for bundle_id, data in self._results.iteritems():
             # filter optional activities for automatic updates
             if self._auto and data[2] is True:
                 logging.debug('filtered optional activity %s', bundle_id)
@@ -251,7 +301,8 @@ class MicroformatUpdater(object):
 
     def _check_next_update(self):
         if self._cancelling or len(self._bundles_to_check) == 0:
-            self._completion_cb(self._updates)
+            self._checking_done = True
+            self._check_complete()
             return
 
         total = self._total_bundles_to_check
@@ -267,23 +318,81 @@ class MicroformatUpdater(object):
         if self._bundle_update.name is None and self._auto:
             self._bundle_update.name = self._bundle_update.bundle_id
 
+        link = self._bundle_update.link
         if self._bundle_update.name is not None:
+            size = self._cache.get_data('size:' + link)
+            if link in self._unchanged_links and size is not None:
+                self._progress_cb(self._bundle_update.name, progress)
+                self._bundle_update.size = size
+                self._updates.append(self._bundle_update)
+                GLib.idle_add(self._check_next_update)
+                return
+
             # if we know the name, we just perform an asynchronous size check
             _logger.debug("Performing async size lookup")
-            size_check = Downloader(self._bundle_update.link)
+            size_check = Downloader(
+                link,
+                request_headers=self._cache.get_request_headers('size:' +
+                                                                link))
             size_check.connect('complete', self._size_lookup_cb)
             size_check.get_size()
             self._progress_cb(self._bundle_update.name, progress)
         else:
-            # if we don't know the name, we run a metadata lookup and get
-            # the size and name that way
-            _logger.debug("Performing metadata lookup")
-            namelookup = MetadataLookup(self._bundle_update.link)
-            namelookup.connect('complete', self._name_lookup_complete)
-            namelookup.run()
             self._progress_cb(self._bundle_update.bundle_id, progress)
+            metadata = self._cache.get_data('metadata:' + link)
+            if link in self._unchanged_links and metadata is not None:
+                name, size, icon_data = metadata
+                self._add_looked_up_update(self._bundle_update, name, size,
+                                           self._write_icon_file(icon_data))
+            else:
+                # if we don't know the name, we run a metadata lookup and
+                # get the size and name that way
+                _logger.debug("Performing metadata lookup")
+                self._start_lookup(self._bundle_update)
+            GLib.idle_add(self._check_next_update)
+
+    def _start_lookup(self, bundle_update):
+        if self._lookup_session is None:
+            self._lookup_session = new_sync_soup_session()
+        lookup = MetadataLookup(bundle_update.link, self._lookup_session)
+        lookup.connect('complete', self._name_lookup_complete, bundle_update)
+        self._lookups.add(lookup)
+        with self._lock:
+            self._lookup_queue.append(lookup)
+            if self._lookup_workers < _LOOKUP_WORKERS:
+                self._lookup_workers += 1
+                Thread(target=self._lookup_thread_func).start()
+
+    def _lookup_thread_func(self):
+        while True:
+            with self._lock:
+                if not self._lookup_queue:
+                    self._lookup_workers -= 1
+                    return
+                lookup = self._lookup_queue.popleft()
+            lookup.run()
+
+    def _check_complete(self):
+        # The check is complete when all the updates were checked and all
+        # the lookups reported back
+        if not self._checking_done or self._lookups:
+            return
+
+        if not self._cancelling:
+            # Every run goes through the whole update page
+            self._cache.save(prune=True)
+        self._completion_cb(self._updates)
 
     def _size_lookup_cb(self, downloader, result):
+        key = 'size:' + self._bundle_update.link
+        if downloader.get_status_code() == SOUP_STATUS_NOT_MODIFIED:
+            result = self._cache.get_data(key)
+            if result is None:
+                result = IOError('Size of %s not in the cache' %
+                                 self._bundle_update.link)
+        elif not isinstance(result, Exception):
+            self._cache.set_data(key, result, downloader)
+
         if isinstance(result, Exception):
             _logger.warning("Failed to perform size lookup: %s", result)
         else:
@@ -292,30 +401,59 @@ class MicroformatUpdater(object):
 
         GLib.idle_add(self._check_next_update)
 
-    def _name_lookup_complete(self, lookup, result, size, icon_file_name):
+    def _name_lookup_complete(self, lookup, result, size, icon_file_name,
+                              bundle_update):
         _logger.debug("Name lookup result: %r", result)
+        self._lookups.discard(lookup)
+
+        if size is not None and not self._cancelling and \
+                result is not None and not isinstance(result, Exception):
+            self._cache.set_data('metadata:' + bundle_update.link,
+                                 [result, size,
+                                  self._read_icon_file(icon_file_name)])
+        self._add_looked_up_update(bundle_update, result, size,
+                                   icon_file_name)
+        self._check_complete()
+
+    def _add_looked_up_update(self, bundle_update, result, size,
+                              icon_file_name):
         if icon_file_name is not None:
             self._icon_temp_files.append(icon_file_name)
             logging.debug('Adding temporary file %s to list', icon_file_name)
 
-        if size is None:
+        if size is None or self._cancelling:
             # if the size lookup failed, assume this update is bad
-            self._check_next_update()
             return
 
         if result is None or isinstance(result, Exception):
             # if we failed to find the name, add the update anyway, using the
             # bundle_id as the best name we have
-            self._bundle_update.name = self._bundle_update.bundle_id
+            bundle_update.name = bundle_update.bundle_id
         else:
-            self._bundle_update.name = result
+            bundle_update.name = result
 
-        self._bundle_update.size = size
+        bundle_update.size = size
         if icon_file_name is not None:
-            self._bundle_update.icon_file_name = icon_file_name
+            bundle_update.icon_file_name = icon_file_name
 
-        self._updates.append(self._bundle_update)
-        self._check_next_update()
+        self._updates.append(bundle_update)
+
+    def _read_icon_file(self, icon_file_name):
+        if icon_file_name is None:
+            return None
+        try:
+            with open(icon_file_name) as icon_file:
+                return icon_file.read()
+        except IOError:
+            return None
+
+    def _write_icon_file(self, icon_data):
+        if icon_data is None:
+            return None
+        with NamedTemporaryFile(mode='w', suffix='.svg',
+                                delete=False) as icon_file:
+            icon_file.write(icon_data)
+            return icon_file.name
 
     def fetch_update_info(self, installed_bundles, auto, progress_cb,
                           completion_cb, error_cb):
@@ -327,10 +465,19 @@ class MicroformatUpdater(object):
         self._bundles_to_check = []
         self._total_bundles_to_check = 0
         self._auto = auto
+        self._cache = ResponseCache('microformat')
+        self._unchanged_links = set()
+        self._checking_done = False
         self._query()
 
     def cancel(self):
         self._cancelling = True
+        # Running lookups fail as their requests are aborted, and the
+        # queued ones complete without doing any work
+        for lookup in self._lookups:
+            lookup.cancel()
+        if self._lookup_session is not None:
+            self._lookup_session.abort()
 
     def clean(self):
         for filename in self._icon_temp_files:
@@ -354,24 +501,44 @@ class MetadataLookup(GObject.GObject):
                      None, (object, object, object)),
     }
 
-    def __init__(self, url):
+    def __init__(self, url, session=None):
         GObject.GObject.__init__(self)
         self._url = url
+        self._session = session
         self._icon_file_name = None
         self._size = None
+        self._cancelled = False
 
     def run(self):
         # Perform the name lookup, catch any exceptions, and report the result.
+        # With a synchronous session, this can be called from any thread.
         try:
+            if self._cancelled:
+                raise IOError('Lookup of %s cancelled' % self._url)
             name = self._do_name_lookup()
             self._complete(name)
         except Exception, e:
             self._complete(e)
 
+    def cancel(self):
+        self._cancelled = True
+
     def _do_name_lookup(self):
-        fd = httprange.open(self._url)
+        cached_file = downloadcache.get_cache().open_url(self._url)
+        if cached_file is not None:
+            # The bundle was downloaded already, read it from the disk
+            with cached_file:
+                self._size = os.fstat(cached_file.fileno()).st_size
+                return self._name_from_fd(cached_file)
+
+        fd = httprange.open(self._url, self._session)
         self._size = fd.size()
-        return self._name_from_fd(fd)
+        try:
+            return self._name_from_fd(fd)
+        finally:
+            stats = fd.get_stats()
+            _logger.debug('Looked up %s with %d requests for %d reads',
+                          self._url, stats['requests'], stats['reads'])
 
     def _name_from_fd(self, fd):
         self._zf = ZipFile(fd)
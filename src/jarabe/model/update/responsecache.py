@@ -0,0 +1,140 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import json
+import tempfile
+
+from sugar3 import env
+
+
+_CACHE_DIR = 'update-cache'
+_CACHE_VERSION = 1
+
+
+def _to_str(value):
+    # json returns unicode, the backends parse utf-8 strings
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [_to_str(item) for item in value]
+    elif isinstance(value, dict):
+        return dict((_to_str(key), _to_str(item))
+                    for key, item in value.iteritems())
+    return value
+
+
+class ResponseCache(object):
+    """Persistent cache of what the update backends learnt from the server
+
+    Each entry holds the data a backend extracted from a response, and
+    the ETag and Last-Modified validators of that response if there were
+    any, so the next update run can ask the server whether it changed
+    and skip parsing it again when the answer is 304 Not Modified.
+
+    Entries that were not used during a run can be dropped when the cache
+    is saved, which is only right after a run that checked everything.
+    """
+
+    def __init__(self, name):
+        self._path = os.path.join(env.get_profile_path(_CACHE_DIR),
+                                  name + '.json')
+        self._entries = {}
+        self._seen = set()
+        self._dirty = False
+
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+
+        try:
+            with open(self._path) as cache_file:
+                data = json.load(cache_file)
+        except (ValueError, EnvironmentError):
+            logging.warning('Discarding corrupted update cache %r',
+                            self._path)
+            return
+
+        if not isinstance(data, dict) or \
+                data.get('version') != _CACHE_VERSION or \
+                not isinstance(data.get('entries'), dict):
+            return
+
+        self._entries = _to_str(data['entries'])
+
+    def get_data(self, key):
+        """Return the data stored for key, or None"""
+        self._seen.add(key)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return entry['data']
+
+    def get_request_headers(self, key):
+        """Return the headers making a request for key conditional"""
+        self._seen.add(key)
+        headers = {}
+        entry = self._entries.get(key)
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def set_data(self, key, data, downloader=None):
+        """Store data for key, with the validators of the response that
+        downloader received, if given.
+        """
+        entry = {'data': data}
+        if downloader is not None:
+            entry['etag'] = downloader.get_response_header('ETag')
+            entry['last_modified'] = \
+                downloader.get_response_header('Last-Modified')
+        self._seen.add(key)
+        self._entries[key] = entry
+        self._dirty = True
+
+    def save(self, prune=False):
+        """Write the cache to disk if it changed
+
+        With prune set, entries that were not used since the cache was
+        loaded are dropped first.
+        """
+        if prune:
+            for key in set(self._entries) - self._seen:
+                del self._entries[key]
+                self._dirty = True
+            self._seen = set()
+
+        if not self._dirty:
+            return
+        self._dirty = False
+
+        cache_dir = os.path.dirname(self._path)
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump({'version': _CACHE_VERSION,
+                           'entries': self._entries}, cache_file)
+            os.rename(temp_path, self._path)
+        except (EnvironmentError, TypeError, ValueError):
+            logging.exception('Could not write update cache %r', self._path)
@@ -16,8 +16,11 @@
 
 
 import os
+import re
 import logging
 import time
+import shutil
+import tempfile
 import importlib
 
 from gi.repository import GObject
@@ -25,9 +28,17 @@ from gi.repository import GLib
 from gi.repository import Gio
 
 from sugar3.bundle.helpers import bundle_from_archive
+from sugar3.bundle.helpers import bundle_from_dir
+from sugar3.bundle.bundle import MalformedBundleException
+from sugar3 import env
 
 from jarabe.model import bundleregistry
+from jarabe.util import downloadcache
 from jarabe.util.downloader import Downloader
+from jarabe.util.downloader import has_partial_download
+from jarabe.util.zipstream import ZipStreamExtractor
+from jarabe.util.zipstream import ZipStreamError
+from jarabe.util.zipstream import ZipStreamUnsupported
 
 _logger = logging.getLogger('Updater')
 _instance = None
@@ -36,6 +47,14 @@ _LAST_UPDATE_KEY = 'last-activity-update'
 _UPDATE_FREQUENCY_KEY = 'auto-update-frequency'
 _UPDATE_BACKEND_KEY = 'backend'
 _URGENT_TRIGGER_FILE = os.path.expanduser('~/.sugar-update')
+# Ranges of a bundle downloaded in parallel, when it is not unpacked while
+# being downloaded
+_DOWNLOAD_SEGMENTS = 4
+# Times an interrupted download that is unpacked while it arrives is
+# requested again
+_STREAM_RETRIES = 3
+
+_CONTENT_RANGE_START_RE = re.compile(r'bytes (\d+)-')
 
 STATE_IDLE = 0
 STATE_CHECKING = 1
@@ -48,6 +67,33 @@ class UpdaterStateException(Exception):
     pass
 
 
+class _StagedBundle(object):
+    """An activity bundle already unpacked next to the activities
+
+    It behaves like the bundle parsed from the staged directory, but
+    installing it just moves the directory into place.
+    """
+
+    def __init__(self, staged_path):
+        self._staged_path = staged_path
+        self._bundle = bundle_from_dir(staged_path)
+        if self._bundle is None:
+            raise ZipStreamError('No bundle in %r' % staged_path)
+
+    def __getattr__(self, name):
+        return getattr(self._bundle, name)
+
+    def install(self):
+        install_path = os.path.join(env.get_user_activities_path(),
+                                    os.path.basename(self._staged_path))
+        os.rename(self._staged_path, install_path)
+
+        bundle = bundle_from_dir(install_path)
+        if hasattr(bundle, 'install_mime_type'):
+            bundleregistry.install_mime_type(bundle, install_path)
+        return install_path
+
+
 class Updater(GObject.GObject):
     __gtype_name__ = 'SugarUpdater'
 
@@ -83,6 +129,19 @@ class Updater(GObject.GObject):
         self._bundles_failed = None
 
         self._downloader = None
+        # Where the bundle being downloaded is unpacked while it arrives
+        self._staging_dir = None
+        self._extractor = None
+        self._extract_error = None
+        # Bytes of the bundle fed to the extractor, where an interrupted
+        # download is resumed from
+        self._stream_offset = 0
+        # Offset the current request of the bundle started at
+        self._stream_start = 0
+        self._stream_validator = None
+        self._stream_retries = 0
+        # Bytes per second the current bundle is being downloaded at
+        self._download_rate = 0
         self._cancelling = False
         self._state = STATE_IDLE
         self._auto = False
@@ -90,6 +149,9 @@ class Updater(GObject.GObject):
     def get_state(self):
         return self._state
 
+    def get_download_rate(self):
+        return self._download_rate
+
     def trigger_automatic_update(self):
         if self._state == STATE_IDLE:
             _logger.debug("Starting automatic activity update")
@@ -166,12 +228,206 @@ class Updater(GObject.GObject):
         total = self._total_bundles_to_update * 2
         current = total - len(self._bundles_to_update) * 2 - 2
         progress = current / float(total)
+        self._download_rate = 0
         self.emit('progress', self._state, self._bundle_update.name, progress)
 
+        if self._install_cached_update():
+            return
+
+        if has_partial_download(self._bundle_update.link):
+            # What was downloaded last time can't be unpacked as it arrives
+            _logger.debug('Resuming download of %s',
+                          self._bundle_update.bundle_id)
+            self._start_download()
+            return
+
+        try:
+            self._start_streaming_download()
+        except EnvironmentError:
+            _logger.exception('Can not stage the update, downloading the '
+                              'whole bundle first')
+            self._cleanup_staging()
+            self._start_download()
+
+    def _install_cached_update(self):
+        # The same bundle may have been downloaded from another link, or
+        # installed from the Journal, before
+        sha256 = self._bundle_update.sha256
+        if sha256 is None:
+            return False
+
+        fd, file_path = tempfile.mkstemp(
+            dir=os.path.join(env.get_profile_path(), 'data'), suffix='.xo')
+        os.close(fd)
+        os.unlink(file_path)
+        if not downloadcache.get_cache().copy_file(sha256, file_path):
+            return False
+
+        _logger.debug('Update for %s found in the download cache',
+                      self._bundle_update.bundle_id)
+        self._install_update(self._bundle_update, file_path)
+        return True
+
+    def _start_download(self):
         self._downloader = Downloader(self._bundle_update.link)
         self._downloader.connect('progress', self.__downloader_progress_cb)
         self._downloader.connect('complete', self.__downloader_complete_cb)
-        self._downloader.download_to_temp()
+        # The download cache keeps the archive under its link, so the next
+        # request for it is conditional and the microformat name lookup
+        # reads it from the disk
+        self._downloader.download_to_temp(segments=_DOWNLOAD_SEGMENTS)
+
+    def _start_streaming_download(self):
+        self._stream_retries = 0
+        self._start_extraction()
+        self._request_stream()
+
+    def _start_extraction(self):
+        # Unpack the bundle while it is downloaded, in a hidden folder of
+        # the activities directory so it can be moved into place
+        activities_path = env.get_user_activities_path()
+        if not os.path.isdir(activities_path):
+            os.makedirs(activities_path)
+        self._staging_dir = tempfile.mkdtemp(prefix='.update-',
+                                             dir=activities_path)
+        self._extractor = ZipStreamExtractor(self._staging_dir)
+        self._extract_error = None
+        self._stream_offset = 0
+        self._stream_validator = None
+
+    def _request_stream(self):
+        # The bundle only goes through memory, an interrupted download
+        # asks for the rest of it if the server tells it didn't change
+        request_headers = None
+        if self._stream_offset > 0:
+            request_headers = {'Range': 'bytes=%d-' % self._stream_offset,
+                               'If-Range': self._stream_validator}
+        self._stream_start = self._stream_offset
+
+        self._downloader = Downloader(self._bundle_update.link,
+                                      request_headers=request_headers)
+        self._downloader.connect('progress', self.__stream_progress_cb)
+        self._downloader.connect('got-chunk', self.__downloader_got_chunk_cb)
+        self._downloader.connect('complete',
+                                 self.__streaming_download_complete_cb)
+        self._downloader.download_chunked()
+
+    def _get_stream_validator(self, downloader):
+        # Only strong entity tags can validate a range request
+        etag = downloader.get_response_header('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return downloader.get_response_header('Last-Modified')
+
+    def _check_stream_start(self, downloader):
+        # Called with the first chunk of a response
+        content_range = downloader.get_response_header('Content-Range')
+        match = _CONTENT_RANGE_START_RE.match(content_range or '')
+        start = int(match.group(1)) if match is not None else 0
+        if start != self._stream_offset:
+            if start != 0:
+                raise IOError('Unexpected range %r' % content_range)
+            # The bundle changed, and is sent again from the start
+            _logger.debug('Unpacking %s again', self._bundle_update.bundle_id)
+            self._cleanup_staging()
+            self._start_extraction()
+            self._stream_start = 0
+        if self._stream_offset == 0:
+            self._stream_validator = self._get_stream_validator(downloader)
+
+    def __downloader_got_chunk_cb(self, downloader, data):
+        if self._extract_error is not None:
+            return
+        try:
+            if self._stream_offset == self._stream_start:
+                self._check_stream_start(downloader)
+            self._extractor.feed(data.get_data())
+        except (ZipStreamError, EnvironmentError) as e:
+            self._extract_error = e
+            if self._extractor is not None:
+                self._extractor.abort()
+            downloader.cancel()
+            return
+        self._stream_offset += data.get_size()
+
+    def _resume_stream(self):
+        if self._stream_offset > 0 and \
+                (self._stream_validator is None or
+                 self._stream_offset == self._stream_start > 0):
+            # The rest can't be asked for safely, or asking for it failed,
+            # start over
+            self._cleanup_staging()
+            self._start_extraction()
+        self._request_stream()
+
+    def __stream_progress_cb(self, downloader, progress, resumed_size_,
+                             rate):
+        # A resumed request only tells about the rest of the bundle
+        length = downloader.get_response_header('Content-Length')
+        if self._stream_start > 0 and length:
+            length = int(length)
+            progress = (self._stream_start + progress * length) / \
+                float(self._stream_start + length)
+        self.__downloader_progress_cb(downloader, progress,
+                                      self._stream_start, rate)
+
+    def __streaming_download_complete_cb(self, downloader, result):
+        self._downloader = None
+
+        if self._cancelling:
+            self._cleanup_staging()
+            self._finished(True)
+            return
+
+        if isinstance(self._extract_error, ZipStreamUnsupported):
+            _logger.debug('Can not unpack %s while downloading: %s',
+                          self._bundle_update.bundle_id, self._extract_error)
+            self._cleanup_staging()
+            self._start_download()
+            return
+
+        if self._extract_error is None and isinstance(result, Exception) \
+                and self._stream_retries < _STREAM_RETRIES:
+            self._stream_retries += 1
+            _logger.debug('Download of %s interrupted at %d bytes: %s',
+                          self._bundle_update.bundle_id, self._stream_offset,
+                          result)
+            try:
+                self._resume_stream()
+            except EnvironmentError as e:
+                self._extract_error = e
+            else:
+                return
+
+        error = self._extract_error
+        if error is None and isinstance(result, Exception):
+            error = result
+        if error is None:
+            try:
+                bundle = _StagedBundle(self._extractor.finish())
+            except (ZipStreamError, MalformedBundleException) as e:
+                error = e
+
+        if error is not None:
+            _logger.error('Error downloading update: %s', error)
+            self._cleanup_staging()
+            self._bundles_failed.append(self._bundle_update)
+            self._download_next_update()
+            return
+
+        self._state = STATE_UPDATING
+        total = self._total_bundles_to_update
+        current = total - len(self._bundles_to_update)
+
+        _logger.debug("Installing update for %s",
+                      self._bundle_update.bundle_id)
+        self.emit('progress', self._state, self._bundle_update.name,
+                  (current - 0.5) / float(total))
+
+        registry = bundleregistry.get_registry()
+        # The archive only went through memory, there is nothing to cache
+        registry.install_async(bundle, self._bundle_installed_cb, current,
+                               cache_archive=False)
 
     def __downloader_complete_cb(self, downloader, result):
         if self._cancelling:
@@ -189,7 +445,9 @@ class Updater(GObject.GObject):
                                  self._downloader.get_local_file_path())
             self._downloader = None
 
-    def __downloader_progress_cb(self, downloader, progress):
+    def __downloader_progress_cb(self, downloader, progress, resumed_size,
+                                 rate):
+        self._download_rate = rate
         total = self._total_bundles_to_update * 2
         current = total - len(self._bundles_to_update) * 2 - 2 + progress
         progress = current / float(total)
@@ -207,18 +465,24 @@ class Updater(GObject.GObject):
         current += 0.5
         bundle = bundle_from_archive(local_file_path)
         registry = bundleregistry.get_registry()
-        registry.install_async(bundle, self._bundle_installed_cb, current)
+        # The archive is in the download cache already
+        registry.install_async(bundle, self._bundle_installed_cb, current,
+                               cache_archive=False)
 
     def _bundle_installed_cb(self, bundle, result, progress):
         _logger.debug("%s installed: %r", bundle.get_bundle_id(), result)
         progress = progress / float(self._total_bundles_to_update)
         self.emit('progress', self._state, bundle.get_name(), progress)
 
-        # Remove downloaded bundle archive
-        try:
-            os.unlink(bundle.get_path())
-        except OSError:
-            pass
+        # Remove downloaded bundle archive, or what is left of the
+        # staged one
+        if self._staging_dir is not None:
+            self._cleanup_staging()
+        else:
+            try:
+                os.unlink(bundle.get_path())
+            except OSError:
+                pass
 
         if result is True:
             self._bundles_updated.append(bundle)
@@ -265,6 +529,14 @@ class Updater(GObject.GObject):
             except OSError:
                 pass
 
+    def _cleanup_staging(self):
+        if self._extractor is not None:
+            self._extractor.abort()
+            self._extractor = None
+        if self._staging_dir is not None:
+            shutil.rmtree(self._staging_dir, ignore_errors=True)
+            self._staging_dir = None
+
     def clean(self):
         self._model.clean()
 
@@ -0,0 +1,395 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from threading import Thread, Lock
+
+from gi.repository import GLib
+
+from sugar3 import env
+
+
+_CACHE_DIR = 'download-cache'
+_INDEX_FILE = 'index.json'
+# Prefix of the files being hashed before they are added
+_ADDING_PREFIX = '.adding-'
+_CACHE_VERSION = 1
+
+# Bytes of files kept in the cache, the least recently used ones are
+# removed when there are more
+_MAX_CACHE_SIZE = 100 * 1024 * 1024
+# Size of the blocks files are hashed in
+_HASH_BLOCK_SIZE = 64 * 1024
+
+_cache = None
+_cache_lock = Lock()
+
+
+def _to_str(value):
+    # json returns unicode, URLs and hashes are used as byte strings
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [_to_str(item) for item in value]
+    elif isinstance(value, dict):
+        return dict((_to_str(key), _to_str(item))
+                    for key, item in value.iteritems())
+    return value
+
+
+def hash_file(path):
+    """Return the hex SHA-256 digest of the contents of the file at path"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as hashed_file:
+        while True:
+            data = hashed_file.read(_HASH_BLOCK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _copy_and_hash(source, destination):
+    # Files in the cache are never hard links to files outside of it, so
+    # writing to a copy can't change the cached contents. The digest is of
+    # the bytes that were copied.
+    digest = hashlib.sha256()
+    with open(source, 'rb') as source_file:
+        with open(destination, 'wb') as destination_file:
+            while True:
+                data = source_file.read(_HASH_BLOCK_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+                destination_file.write(data)
+    return digest.hexdigest()
+
+
+class DownloadCache(object):
+    """Persistent content-addressed cache of downloaded bundles
+
+    Files are stored by the SHA-256 of their contents, so the same bundle
+    is stored once whether it was downloaded by the updater, by Browse or
+    was installed from the Journal. Downloaded files are also recorded
+    under their URL, with the ETag and Last-Modified validators of the
+    response, so the next download of that URL can be a conditional
+    request answered with the cached file.
+
+    The total size of the files is bounded by _MAX_CACHE_SIZE, and the
+    least recently used ones are removed first. The cache can be used
+    from any thread. It is kept in the profile, unless another cache_dir
+    is given.
+    """
+
+    def __init__(self, cache_dir=None):
+        self._dir = cache_dir or env.get_profile_path(_CACHE_DIR)
+        self._index_path = os.path.join(self._dir, _INDEX_FILE)
+        # sha256 -> [size, time of last use]
+        self._files = {}
+        # url -> {'sha256', 'etag', 'last_modified'}
+        self._urls = {}
+        self._lock = Lock()
+
+        self._load()
+
+    def _load(self):
+        if os.path.isdir(self._dir):
+            # Files that were still being hashed when Sugar stopped
+            for name in os.listdir(self._dir):
+                if name.startswith(_ADDING_PREFIX):
+                    try:
+                        os.unlink(os.path.join(self._dir, name))
+                    except OSError:
+                        pass
+
+        if not os.path.exists(self._index_path):
+            return
+
+        try:
+            with open(self._index_path) as index_file:
+                data = json.load(index_file)
+        except (ValueError, EnvironmentError):
+            logging.warning('Discarding corrupted download cache index %r',
+                            self._index_path)
+            return
+
+        if not isinstance(data, dict) or \
+                data.get('version') != _CACHE_VERSION or \
+                not isinstance(data.get('files'), dict) or \
+                not isinstance(data.get('urls'), dict):
+            return
+
+        files = _to_str(data['files'])
+        self._files = dict((sha256, entry)
+                           for sha256, entry in files.iteritems()
+                           if os.path.exists(self._get_path(sha256)))
+        self._urls = dict((url, entry)
+                          for url, entry in _to_str(data['urls']).iteritems()
+                          if entry.get('sha256') in self._files)
+
+    def _save(self):
+        with self._lock:
+            data = {'version': _CACHE_VERSION,
+                    'files': dict(self._files),
+                    'urls': dict(self._urls)}
+
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self._dir)
+            with os.fdopen(fd, 'w') as index_file:
+                json.dump(data, index_file)
+            os.rename(temp_path, self._index_path)
+        except (EnvironmentError, TypeError, ValueError):
+            logging.exception('Could not write download cache index %r',
+                              self._index_path)
+
+    def _get_path(self, sha256):
+        return os.path.join(self._dir, sha256)
+
+    def _touch(self, sha256):
+        # must be called with the lock held
+        self._files[sha256][1] = time.time()
+
+    def _evict(self, keep):
+        # must be called with the lock held
+        total = sum(size for size, used_ in self._files.itervalues())
+        for sha256 in sorted(self._files, key=lambda key: self._files[key][1]):
+            if total <= _MAX_CACHE_SIZE:
+                break
+            if sha256 == keep:
+                continue
+            total -= self._files.pop(sha256)[0]
+            try:
+                os.unlink(self._get_path(sha256))
+            except OSError:
+                pass
+        self._forget_urls()
+
+    def _forget_urls(self):
+        # must be called with the lock held
+        for url, entry in self._urls.items():
+            if entry['sha256'] not in self._files:
+                del self._urls[url]
+
+    def get_request_headers(self, url):
+        """Return the headers making a request for url conditional on the
+        cached file being still valid, or an empty dict.
+        """
+        headers = {}
+        with self._lock:
+            entry = self._urls.get(url)
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def get_validators(self, url):
+        """Return the ETag and Last-Modified of the cached response for url
+        as a dict, or None if url is not cached.
+        """
+        with self._lock:
+            entry = self._urls.get(url)
+        if entry is None:
+            return None
+        return {'etag': entry.get('etag'),
+                'last_modified': entry.get('last_modified')}
+
+    def has_file(self, sha256):
+        with self._lock:
+            return sha256 in self._files
+
+    def copy_file(self, sha256, destination):
+        """Put a copy of the file with the given hash at destination, which
+        must not exist. Return whether the file was in the cache.
+        """
+        with self._lock:
+            if sha256 not in self._files:
+                return False
+            self._touch(sha256)
+        path = self._get_path(sha256)
+
+        try:
+            copied_sha256 = _copy_and_hash(path, destination)
+        except EnvironmentError:
+            if os.path.exists(path):
+                logging.exception('Could not copy %s from the download '
+                                  'cache', sha256)
+            else:
+                # Removed behind the back of the cache
+                self._remove(sha256)
+            self._remove_destination(destination)
+            return False
+
+        if copied_sha256 != sha256:
+            logging.warning('Removing corrupted %s from the download cache',
+                            sha256)
+            self._remove(sha256)
+            self._remove_destination(destination)
+            return False
+
+        self._save()
+        return True
+
+    def _remove(self, sha256):
+        with self._lock:
+            if self._files.pop(sha256, None) is None:
+                return
+            self._forget_urls()
+        try:
+            os.unlink(self._get_path(sha256))
+        except OSError:
+            pass
+        self._save()
+
+    def _remove_destination(self, destination):
+        try:
+            os.unlink(destination)
+        except OSError:
+            pass
+
+    def copy_url(self, url, destination):
+        """Like copy_file(), for the file last downloaded from url"""
+        with self._lock:
+            entry = self._urls.get(url)
+        if entry is None:
+            return False
+        return self.copy_file(entry['sha256'], destination)
+
+    def open_url(self, url):
+        """Return the file last downloaded from url opened for reading, or
+        None if url is not cached.
+        """
+        with self._lock:
+            entry = self._urls.get(url)
+            if entry is None:
+                return None
+            self._touch(entry['sha256'])
+            try:
+                return open(self._get_path(entry['sha256']), 'rb')
+            except EnvironmentError:
+                logging.exception('Could not open %s from the download cache',
+                                  url)
+                return None
+
+    def add_file(self, path, url=None, validators=None):
+        """Add the file at path to the cache, and record it as downloaded
+        from url with the given validators, if any. The file at path is
+        left in place. Return the SHA-256 of the file.
+
+        The file is read whole to hash it, use add_file_async() from the
+        main loop.
+        """
+        size = os.path.getsize(path)
+        if size > _MAX_CACHE_SIZE:
+            return hash_file(path)
+
+        adding_path = self._get_adding_path()
+        try:
+            sha256 = _copy_and_hash(path, adding_path)
+            self._add(adding_path, sha256, url, validators)
+        finally:
+            if os.path.exists(adding_path):
+                os.unlink(adding_path)
+        return sha256
+
+    def add_file_async(self, path, url=None, validators=None,
+                       callback=None):
+        """Like add_file(), but the file is hashed in a thread. The file
+        at path can be removed as soon as this returns. The callback, if
+        any, is called from the main loop with the SHA-256 of the file, or
+        None if it could not be added.
+        """
+        if os.path.getsize(path) > _MAX_CACHE_SIZE:
+            if callback is not None:
+                GLib.idle_add(callback, None)
+            return
+
+        # A link keeps the contents around if the file is removed, the
+        # thread copies them before they are cached
+        linked_path = self._get_adding_path()
+        try:
+            os.link(path, linked_path)
+        except OSError:
+            shutil.copyfile(path, linked_path)
+
+        thread = Thread(target=self._add_file_thread,
+                        args=(linked_path, url, validators, callback))
+        thread.daemon = True
+        thread.start()
+
+    def _add_file_thread(self, linked_path, url, validators, callback):
+        sha256 = None
+        adding_path = self._get_adding_path()
+        try:
+            sha256 = _copy_and_hash(linked_path, adding_path)
+            self._add(adding_path, sha256, url, validators)
+        except EnvironmentError:
+            logging.exception('Could not add %s to the download cache',
+                              url or linked_path)
+            sha256 = None
+        finally:
+            for temp_path in (adding_path, linked_path):
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+        if callback is not None:
+            GLib.idle_add(callback, sha256)
+
+    def _get_adding_path(self):
+        if not os.path.exists(self._dir):
+            os.makedirs(self._dir)
+        fd, adding_path = tempfile.mkstemp(dir=self._dir,
+                                           prefix=_ADDING_PREFIX)
+        os.close(fd)
+        os.unlink(adding_path)
+        return adding_path
+
+    def _add(self, adding_path, sha256, url, validators):
+        # adding_path is a private copy of the file, renamed into the cache
+        size = os.path.getsize(adding_path)
+        with self._lock:
+            if sha256 not in self._files:
+                os.rename(adding_path, self._get_path(sha256))
+                self._files[sha256] = [size, 0]
+            self._record(sha256, url, validators)
+        self._save()
+
+    def _record(self, sha256, url, validators):
+        # must be called with the lock held
+        self._touch(sha256)
+
+        if url is not None:
+            entry = {'sha256': sha256}
+            if validators is not None:
+                entry['etag'] = validators.get('etag')
+                entry['last_modified'] = validators.get('last_modified')
+            self._urls[url] = entry
+
+        self._evict(keep=sha256)
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DownloadCache()
+    return _cache
@@ -16,6 +16,14 @@
 
 
 import os
+import re
+import json
+import time
+import hashlib
+import logging
+import Queue
+from threading import Thread
+from collections import deque
 from urlparse import urlparse
 import tempfile
 
@@ -27,33 +35,188 @@ from gi.repository import Gio
 from gi.repository import GLib
 
 from jarabe import config
+from jarabe.util import downloadcache
 from sugar3 import env
 
 _session = None
 
 SOUP_STATUS_CANCELLED = 1
+SOUP_STATUS_PARTIAL_CONTENT = 206
+SOUP_STATUS_NOT_MODIFIED = 304
+
+# Requests to the same server that can share the session at the same time
+_MAX_CONNS_PER_HOST = 8
+
+# Unfinished downloads are kept in this folder of the profile data folder,
+# so they can be resumed
+_PARTIAL_DIR = 'partial'
+# Segments of a segmented download are not made smaller than this
+_MIN_SEGMENT_SIZE = 1024 * 1024
+# Seconds between saves of the progress of a segmented download
+_SEGMENTS_SAVE_INTERVAL = 1
+# Bytes received and not written yet to the output stream before the
+# download is paused, it goes on when half of them are written
+_MAX_PENDING_SIZE = 1024 * 1024
+# Small chunks waiting to be written are joined up to this size
+_WRITE_SIZE = 64 * 1024
+
+_CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
 
 
 def soup_status_is_successful(status):
     return status >= 200 and status < 300
 
 
+def _soup_status_is_transport_error(status):
+    # Soup uses codes below 100 for requests that didn't get an answer
+    return status < 100
+
+
+def _get_partial_paths(url):
+    partial_dir = os.path.join(env.get_profile_path(), 'data', _PARTIAL_DIR)
+    key = hashlib.sha1(url).hexdigest()
+    return (os.path.join(partial_dir, key + '.part'),
+            os.path.join(partial_dir, key + '.json'))
+
+
+def has_partial_download(url):
+    """Return whether an unfinished download of url can be resumed"""
+    data_path, state_path = _get_partial_paths(url)
+    return os.path.exists(data_path) and os.path.exists(state_path)
+
+
+def _read_validators(headers):
+    return {'etag': headers.get_one('ETag'),
+            'last_modified': headers.get_one('Last-Modified')}
+
+
+def _get_validator(state):
+    # Only strong entity tags can validate a range request
+    etag = state.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return state.get('last_modified')
+
+
+class _Segment(object):
+    """A range of a segmented download, end included"""
+
+    def __init__(self, position, end):
+        self.position = position
+        self.end = end
+        self.message = None
+        self.status_code = None
+
+    def get_remaining(self):
+        return self.end + 1 - self.position
+
+
+def _write_state(state_path, state):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(state_path))
+    with os.fdopen(fd, 'w') as state_file:
+        json.dump(state, state_file)
+    os.rename(temp_path, state_path)
+
+
+class _SegmentsWriter(object):
+    """Writes the data of a segmented download, and saves its progress,
+    in a thread so the main loop never waits for the disk.
+
+    Operations are done in the order they are queued, so a saved state
+    only tells about data that is written and synced before it. The
+    callbacks are called from the main loop: written_cb with the number
+    of bytes written, error_cb with the first error, closed_cb once the
+    file is closed.
+    """
+
+    def __init__(self, path, state_path, written_cb, error_cb):
+        self._file = open(path, 'r+b')
+        self._state_path = state_path
+        self._written_cb = written_cb
+        self._error_cb = error_cb
+        self._failed = False
+        self._queue = Queue.Queue()
+
+        thread = Thread(target=self._thread_func)
+        thread.daemon = True
+        thread.start()
+
+    def write(self, position, data):
+        self._queue.put(('write', (position, data)))
+
+    def save(self, state):
+        self._queue.put(('save', (state,)))
+
+    def close(self, closed_cb):
+        self._queue.put(('close', (closed_cb,)))
+
+    def _thread_func(self):
+        while True:
+            operation, args = self._queue.get()
+            if operation == 'close':
+                self._file.close()
+                GLib.idle_add(args[0])
+                return
+
+            try:
+                if operation == 'write':
+                    position, data = args
+                    if not self._failed:
+                        self._file.seek(position)
+                        self._file.write(data)
+                    GLib.idle_add(self._written_cb, len(data))
+                elif not self._failed:
+                    # The data must be on disk before the state tells it
+                    # is there
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    self._save_state(args[0])
+            except EnvironmentError as e:
+                logging.exception('Could not write the download')
+                if not self._failed:
+                    self._failed = True
+                    GLib.idle_add(self._error_cb, e)
+
+    def _save_state(self, state):
+        try:
+            _write_state(self._state_path, state)
+        except EnvironmentError:
+            logging.exception('Could not save the state of the download')
+
+
+def _setup_soup_session(session):
+    session.set_property("timeout", 60)
+    session.set_property("idle-timeout", 60)
+    session.set_property("user-agent", "Sugar/%s" % config.version)
+    session.set_property("max-conns-per-host", _MAX_CONNS_PER_HOST)
+    session.add_feature_by_type(Soup.ProxyResolverDefault)
+
+
 def get_soup_session():
     global _session
     if _session is None:
         _session = Soup.SessionAsync()
-        _session.set_property("timeout", 60)
-        _session.set_property("idle-timeout", 60)
-        _session.set_property("user-agent", "Sugar/%s" % config.version)
-        _session.add_feature_by_type(Soup.ProxyResolverDefault)
+        _setup_soup_session(_session)
     return _session
 
 
+def new_sync_soup_session():
+    """
+    Return a new session for blocking requests, which can be sent from
+    threads other than the main one.
+    """
+    session = Soup.SessionSync()
+    _setup_soup_session(session)
+    return session
+
+
 class Downloader(GObject.GObject):
     __gsignals__ = {
+        # fraction done, bytes resumed from a previous download, and bytes
+        # per second received
         'progress': (GObject.SignalFlags.RUN_FIRST,
                      None,
-                     ([float])),
+                     ([float, object, float])),
         'got-chunk': (GObject.SignalFlags.RUN_FIRST,
                       None,
                       (object,)),
@@ -66,7 +229,9 @@ class Downloader(GObject.GObject):
         GObject.GObject.__init__(self)
         self._uri = Soup.URI.new(url)
         self._session = session or get_soup_session()
-        self._pending_buffers = []
+        self._pending_buffers = deque()
+        self._pending_size = 0
+        self._paused = False
         self._downloaded_size = 0
         self._total_size = 0
         self._cancelling = False
@@ -75,8 +240,24 @@ class Downloader(GObject.GObject):
         self._output_stream = None
         self._message = None
         self._request_headers = request_headers
+        self._error = None
+        self._start_time = None
+        self._resumed_size = 0
+        self._resume_offset = 0
+        self._partial_path = None
+        self._state_path = None
+        self._partial_state = None
+        self._keep_partial = True
+        self._use_cache = True
+        self._segments = None
+        self._segments_writer = None
+        self._segments_pending = 0
+        self._segments_saved_time = 0
+        self._segments_pending_size = 0
+        self._segments_paused = False
 
     def _setup_message(self, method="GET"):
+        self._start_time = time.time()
         self._message = Soup.Message(method=method, uri=self._uri)
         self._message.connect('got-chunk', self._got_chunk_cb)
         self._message.connect('got-headers', self._headers_cb, None)
@@ -85,18 +266,292 @@ class Downloader(GObject.GObject):
                 self._message.request_headers.append(
                     header_key, self._request_headers[header_key])
 
-    def download_to_temp(self):
+    def download_to_temp(self, segments=1, cache=True):
         """
         Download the contents of the provided URL to temporary file storage.
         Use .get_local_file_path() to find the location of where the file
         is saved. Upon completion, a successful download is indicated by a
         result of None in the complete signal parameters.
+
+        A download that fails or is cancelled is kept, and the next download
+        of the same URL resumes it if the server tells the file is the same.
+        Unless cache is False, downloaded files are kept in the download
+        cache, and are not fetched again while the server tells they didn't
+        change. Such downloads complete with a status code of
+        SOUP_STATUS_NOT_MODIFIED and don't emit the 'got-chunk' signal.
+        With more than one segment, and if the server supports it, that many
+        ranges of the file are downloaded in parallel. Segmented downloads
+        don't emit the 'got-chunk' signal.
         """
         url = self._uri.to_string(False)
-        temp_file_path = self._get_temp_file_path(url)
-        self._output_file = Gio.File.new_for_path(temp_file_path)
-        self._output_stream = self._output_file.create(
-            Gio.FileCreateFlags.PRIVATE, None)
+        self._use_cache = cache
+        self._partial_path, self._state_path = _get_partial_paths(url)
+        self._partial_state = self._load_partial_state(url)
+        self._output_file = Gio.File.new_for_path(self._partial_path)
+        if segments > 1:
+            self._start_segments(segments)
+        else:
+            self._start_resumable_download()
+
+    def _load_partial_state(self, url):
+        partial_dir = os.path.dirname(self._partial_path)
+        if not os.path.isdir(partial_dir):
+            os.makedirs(partial_dir)
+
+        try:
+            with open(self._state_path) as state_file:
+                state = json.load(state_file)
+        except (ValueError, EnvironmentError):
+            return None
+        if not isinstance(state, dict) or state.get('url') != url or \
+                not os.path.exists(self._partial_path):
+            return None
+        return state
+
+    def _save_partial_state(self):
+        try:
+            _write_state(self._state_path, self._partial_state)
+        except EnvironmentError:
+            logging.exception('Could not save the state of the download')
+
+    def _remove_partial(self):
+        for path in (self._partial_path, self._state_path):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _start_resumable_download(self, conditional=True):
+        self._setup_message()
+        self._message.response_body.set_accumulate(False)
+
+        validator = None
+        if self._partial_state is not None and \
+                'segments' not in self._partial_state:
+            validator = _get_validator(self._partial_state)
+        if validator is not None:
+            self._resume_offset = os.path.getsize(self._partial_path)
+        if self._resume_offset > 0:
+            # the server sends the whole file if it changed
+            self._message.request_headers.set_range(self._resume_offset, -1)
+            self._message.request_headers.append('If-Range', validator)
+        elif self._use_cache and conditional:
+            # the server answers 304 if the cached file is still valid
+            headers = downloadcache.get_cache().get_request_headers(
+                self._uri.to_string(False))
+            for header_key, value in headers.items():
+                self._message.request_headers.append(header_key, value)
+
+        self._session.queue_message(self._message, self._message_cb, None)
+
+    def _open_output_stream(self, message):
+        headers = message.response_headers
+        start = 0
+        if message.status_code == SOUP_STATUS_PARTIAL_CONTENT:
+            match = _CONTENT_RANGE_RE.match(
+                headers.get_one('Content-Range') or '')
+            start = int(match.group(1)) if match else None
+
+        if self._resume_offset > 0 and start == self._resume_offset:
+            self._output_stream = self._output_file.append_to(
+                Gio.FileCreateFlags.PRIVATE, None)
+            self._resumed_size = self._resume_offset
+            self._downloaded_size = self._resumed_size
+            self._total_size += self._resumed_size
+        elif start == 0:
+            self._output_stream = self._output_file.replace(
+                None, False, Gio.FileCreateFlags.PRIVATE, None)
+        else:
+            self._error = IOError('Unexpected range %r' %
+                                  headers.get_one('Content-Range'))
+            self.cancel(keep_partial=False)
+            return
+
+        self._partial_state = _read_validators(headers)
+        self._partial_state['url'] = self._uri.to_string(False)
+        self._save_partial_state()
+
+    def _start_segments(self, segments):
+        # Find whether the server supports ranges, and the size of the file
+        self._message = Soup.Message(method='HEAD', uri=self._uri)
+        if self._request_headers is not None:
+            for header_key in self._request_headers.keys():
+                self._message.request_headers.append(
+                    header_key, self._request_headers[header_key])
+        self._session.queue_message(self._message, self._head_cb, segments)
+
+    def _head_cb(self, session, message, segments):
+        if self._cancelling:
+            self._status_code = message.status_code
+            self._complete()
+            return
+
+        headers = message.response_headers
+        size = headers.get_content_length()
+        state = _read_validators(headers)
+        cached = None
+        if self._use_cache:
+            cached = downloadcache.get_cache().get_validators(
+                self._uri.to_string(False))
+        if soup_status_is_successful(message.status_code) and \
+                cached is not None and _get_validator(state) is not None and \
+                _get_validator(cached) == _get_validator(state):
+            # The cached file is still valid
+            self._status_code = SOUP_STATUS_NOT_MODIFIED
+            self._complete()
+            return
+
+        previous = self._partial_state
+        if not soup_status_is_successful(message.status_code) or \
+                headers.get_one('Accept-Ranges') != 'bytes' or \
+                _get_validator(state) is None or \
+                size < 2 * _MIN_SEGMENT_SIZE or \
+                (previous is not None and 'segments' not in previous):
+            # Download, or resume, the file in one go
+            self._start_resumable_download()
+            return
+
+        state['url'] = self._uri.to_string(False)
+        state['size'] = size
+        if previous is not None and previous.get('size') == size and \
+                _get_validator(previous) == _get_validator(state) and \
+                os.path.getsize(self._partial_path) == size:
+            positions = previous['segments']
+        else:
+            count = min(segments, size // _MIN_SEGMENT_SIZE)
+            bounds = [size * i // count for i in range(count + 1)]
+            positions = [[bounds[i], bounds[i + 1] - 1]
+                         for i in range(count)]
+            with open(self._partial_path, 'wb') as partial_file:
+                partial_file.truncate(size)
+
+        self._segments = [_Segment(position, end)
+                          for position, end in positions]
+        self._segments_writer = _SegmentsWriter(
+            self._partial_path, self._state_path,
+            self.__segments_written_cb, self.__segments_error_cb)
+        self._partial_state = state
+        self._save_segments_state()
+
+        self._total_size = size
+        self._resumed_size = size - sum(segment.get_remaining()
+                                        for segment in self._segments)
+        self._downloaded_size = self._resumed_size
+        self._start_time = time.time()
+
+        validator = _get_validator(state)
+        for segment in self._segments:
+            if segment.get_remaining() == 0:
+                continue
+            message = Soup.Message(method='GET', uri=self._uri)
+            message.request_headers.set_range(segment.position, segment.end)
+            message.request_headers.append('If-Range', validator)
+            message.response_body.set_accumulate(False)
+            message.connect('got-chunk', self._segment_got_chunk_cb, segment)
+            segment.message = message
+            self._message = message
+            self._segments_pending += 1
+            self._session.queue_message(message, self._segment_message_cb,
+                                        segment)
+
+        if self._segments_pending == 0:
+            self._finish_segments()
+
+    def _segment_got_chunk_cb(self, message, buf, segment):
+        if self._cancelling or self._error is not None:
+            return
+        if message.status_code != SOUP_STATUS_PARTIAL_CONTENT:
+            # The server sent the whole file, it changed since the HEAD
+            self._error = IOError('%s changed while being downloaded' %
+                                  self._uri.to_string(False))
+            self._cancel_segments()
+            return
+
+        data = buf.get_as_bytes().get_data()[:segment.get_remaining()]
+        self._segments_writer.write(segment.position, data)
+        segment.position += len(data)
+        self._downloaded_size += len(data)
+        self._segments_pending_size += len(data)
+        if self._segments_pending_size > _MAX_PENDING_SIZE and \
+                not self._segments_paused:
+            # Wait for the disk to catch up
+            self._segments_paused = True
+            for segment in self._get_running_segments():
+                self._session.pause_message(segment.message)
+        self._emit_progress()
+
+        if time.time() - self._segments_saved_time > \
+                _SEGMENTS_SAVE_INTERVAL:
+            self._save_segments_state()
+
+    def _get_running_segments(self):
+        return [segment for segment in self._segments
+                if segment.message is not None and
+                segment.status_code is None]
+
+    def __segments_written_cb(self, size):
+        self._segments_pending_size -= size
+        if self._segments_paused and \
+                self._segments_pending_size <= _MAX_PENDING_SIZE / 2:
+            self._segments_paused = False
+            for segment in self._get_running_segments():
+                self._session.unpause_message(segment.message)
+        return False
+
+    def __segments_error_cb(self, error):
+        if self._error is None:
+            self._error = error
+            self._cancel_segments()
+        return False
+
+    def _save_segments_state(self):
+        state = dict(self._partial_state)
+        state['segments'] = \
+            [[segment.position, segment.end] for segment in self._segments]
+        self._partial_state = state
+        self._segments_writer.save(state)
+        self._segments_saved_time = time.time()
+
+    def _segment_message_cb(self, session, message, segment):
+        segment.status_code = message.status_code
+        self._segments_pending -= 1
+        if not soup_status_is_successful(message.status_code):
+            self._cancel_segments()
+        if self._segments_pending == 0:
+            self._finish_segments()
+
+    def _cancel_segments(self):
+        for segment in self._get_running_segments():
+            self._session.cancel_message(segment.message,
+                                         SOUP_STATUS_CANCELLED)
+
+    def _finish_segments(self):
+        self._save_segments_state()
+        self._segments_writer.close(self.__segments_closed_cb)
+        self._segments_writer = None
+
+    def __segments_closed_cb(self):
+        self._status_code = SOUP_STATUS_PARTIAL_CONTENT
+        for segment in self._segments:
+            if segment.status_code is not None and \
+                    not soup_status_is_successful(segment.status_code):
+                self._status_code = segment.status_code
+                if segment.status_code != SOUP_STATUS_CANCELLED:
+                    break
+        if self._error is None and \
+                soup_status_is_successful(self._status_code) and \
+                any(segment.get_remaining() for segment in self._segments):
+            self._error = IOError('Incomplete download')
+        self._complete()
+        return False
+
+    def download_to_stream(self, output_stream):
+        """
+        Download the contents of the provided URL to a Gio.OutputStream,
+        which is closed upon completion. A successful download is indicated
+        by a result of None in the complete signal parameters.
+        """
+        self._output_stream = output_stream
         self.download_chunked()
 
     def download_chunked(self):
@@ -135,13 +590,32 @@ class Downloader(GObject.GObject):
         self._status_code = message.status_code
         self._check_if_finished()
 
-    def cancel(self):
+    def get_status_code(self):
+        return self._status_code
+
+    def get_response_header(self, name):
+        if self._message is None:
+            return None
+        return self._message.response_headers.get_one(name)
+
+    def cancel(self, keep_partial=True):
+        """
+        Cancel the download. Unless keep_partial is False, what was
+        downloaded to a temporary file is kept to be resumed later.
+        """
         self._cancelling = True
-        self._session.cancel_message(self._message, SOUP_STATUS_CANCELLED)
+        self._keep_partial = keep_partial
+        if self._segments is not None:
+            self._cancel_segments()
+        else:
+            self._session.cancel_message(self._message,
+                                         SOUP_STATUS_CANCELLED)
 
     def _headers_cb(self, message, user_data):
         if soup_status_is_successful(message.status_code):
             self._total_size = message.response_headers.get_content_length()
+            if self._output_file is not None:
+                self._open_output_stream(message)
 
     def _got_chunk_cb(self, message, buf):
         if self._cancelling or \
@@ -152,25 +626,111 @@ class Downloader(GObject.GObject):
         self.emit('got-chunk', data)
         if self._output_stream:
             self._pending_buffers.append(data)
+            self._pending_size += data.get_size()
+            if self._pending_size >= _MAX_PENDING_SIZE and not self._paused:
+                # The disk is slower than the network, wait for it
+                self._session.pause_message(message)
+                self._paused = True
             self._write_next_buffer()
+        else:
+            self._downloaded_size += data.get_size()
+            self._emit_progress()
 
-    def __write_async_cb(self, output_stream, result, user_data):
+    def __write_async_cb(self, output_stream, result, data):
         count = output_stream.write_bytes_finish(result)
+        if count < data.get_size():
+            # Short write, the rest goes first next time
+            rest = data.get_data()[count:]
+            self._pending_buffers.appendleft(GLib.Bytes.new(rest))
+
+        self._pending_size -= count
+        if self._paused and self._pending_size <= _MAX_PENDING_SIZE / 2:
+            self._session.unpause_message(self._message)
+            self._paused = False
 
         self._downloaded_size += count
-        if self._total_size > 0:
-            progress = self._downloaded_size / float(self._total_size)
-            self.emit('progress', progress)
+        self._emit_progress()
 
         self._check_if_finished()
 
+    def _emit_progress(self):
+        if self._total_size <= 0:
+            return
+        progress = self._downloaded_size / float(self._total_size)
+        rate = 0.0
+        elapsed = time.time() - self._start_time
+        if elapsed > 0:
+            rate = (self._downloaded_size - self._resumed_size) / elapsed
+        self.emit('progress', progress, self._resumed_size, rate)
+
+    def _finish_partial(self):
+        url = self._uri.to_string(False)
+        if self._error is None and \
+                soup_status_is_successful(self._status_code):
+            file_path = self._get_temp_file_path(url)
+            try:
+                os.rename(self._partial_path, file_path)
+            except OSError as e:
+                self._error = e
+                self._output_file = None
+            else:
+                self._output_file = Gio.File.new_for_path(file_path)
+                if self._use_cache:
+                    self._add_to_cache(url, file_path)
+        elif self._error is None and \
+                self._status_code == SOUP_STATUS_NOT_MODIFIED:
+            # _complete() copied the file from the cache
+            pass
+        elif self._error is None and self._keep_partial and \
+                _soup_status_is_transport_error(self._status_code) and \
+                self._partial_state is not None and \
+                _get_validator(self._partial_state) is not None:
+            logging.debug('Keeping partial download of %s', url)
+            self._output_file = None
+            return
+        else:
+            self._output_file = None
+        self._remove_partial()
+
+    def _add_to_cache(self, url, file_path):
+        try:
+            downloadcache.get_cache().add_file_async(file_path, url,
+                                                     self._partial_state)
+        except EnvironmentError:
+            logging.exception('Could not add %s to the download cache', url)
+
+    def _copy_from_cache(self):
+        url = self._uri.to_string(False)
+        file_path = self._get_temp_file_path(url)
+        if not downloadcache.get_cache().copy_url(url, file_path):
+            return False
+        self._output_file = Gio.File.new_for_path(file_path)
+        return True
+
     def _complete(self):
         if self._output_stream:
             self._output_stream.close(None)
+        if self._partial_path is not None:
+            if self._error is None and not self._cancelling and \
+                    self._status_code == SOUP_STATUS_NOT_MODIFIED and \
+                    not self._copy_from_cache():
+                # The file was removed from the cache after the request
+                # was sent, ask for it again
+                logging.debug('%s is not in the download cache any more',
+                              self._uri.to_string(False))
+                self._status_code = None
+                self._start_resumable_download(conditional=False)
+                return
+            self._finish_partial()
 
         result = None
-        if soup_status_is_successful(self._status_code):
-            if self._message.method == "HEAD":
+        if self._error is not None:
+            result = self._error
+        elif soup_status_is_successful(self._status_code):
+            if self._output_file is not None:
+                # download_to_temp, the data is in the file
+                pass
+            elif self._message.method == "HEAD":
                 # this is a get_size request
                 result = self._total_size
             elif self._message.response_body.get_accumulate():
@@ -180,6 +740,10 @@ class Downloader(GObject.GObject):
                 # string
                 # https://bugzilla.gnome.org/show_bug.cgi?id=704105
                 result = self._message.response_body.flatten().get_as_bytes()
+        elif self._status_code == SOUP_STATUS_NOT_MODIFIED:
+            # the request was conditional, and what the caller has is
+            # still valid
+            result = None
         else:
             result = IOError("HTTP error code %d" % self._status_code)
         self.emit('complete', result)
@@ -203,11 +767,23 @@ class Downloader(GObject.GObject):
         self._write_next_buffer()
 
     def _write_next_buffer(self):
-        if not self._output_stream.has_pending():
-            data = self._pending_buffers.pop(0)
-            self._output_stream.write_bytes_async(data, GLib.PRIORITY_LOW,
-                                                  None, self.__write_async_cb,
-                                                  None)
+        if self._output_stream.has_pending() or not self._pending_buffers:
+            return
+
+        data = self._pending_buffers.popleft()
+        if self._pending_buffers and data.get_size() < _WRITE_SIZE:
+            # Join the chunks that arrived during the previous write
+            parts = [data.get_data()]
+            size = data.get_size()
+            while self._pending_buffers and size < _WRITE_SIZE:
+                part = self._pending_buffers.popleft().get_data()
+                parts.append(part)
+                size += len(part)
+            data = GLib.Bytes.new(''.join(parts))
+
+        self._output_stream.write_bytes_async(data, GLib.PRIORITY_LOW,
+                                              None, self.__write_async_cb,
+                                              data)
 
     def _get_temp_file_path(self, uri):
         # TODO: Should we use the HTTP headers for the file name?
@@ -18,22 +18,48 @@
 A simple HTTP-based file-like object that supports seek() via the HTTP
 Range header. This means it doesn't have to download the whole file just
 to read a small part of it. Uses Downloader as a backend, and runs the
-regular main loop while waiting for data.
+regular main loop while waiting for data, unless a synchronous Soup
+session is given, in which case it blocks and can be used from any thread.
+
+The remote file is cached in aligned blocks. A read fetches the blocks it
+misses, plus a few blocks after them, in a single request, and the size
+of the file is found by fetching its tail, where zip archives keep their
+central directory, so ZipFile can list an archive with a single request.
 """
 
+import re
+from collections import OrderedDict
+
 from gi.repository import Gtk
+from gi.repository import Soup
 
 from jarabe.util.downloader import Downloader
+from jarabe.util.downloader import soup_status_is_successful
+
+# Size of the blocks the remote file is fetched and cached in
+_BLOCK_SIZE = 16 * 1024
+# Blocks fetched after the ones a read needs
+_READ_AHEAD_BLOCKS = 2
+# Blocks kept in the cache
+_MAX_CACHED_BLOCKS = 256
+# Bytes fetched from the end of the file along with its size, enough for
+# the central directory of most bundles
+_TAIL_SIZE = 64 * 1024
+
+_CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
 
 
 class _HttpRangeFileObject(object):
 
-    def __init__(self, url):
+    def __init__(self, url, session=None):
         self._url = url
+        self._session = session
         self._size = None
         self._offset = 0
         self._result = None
         self._complete = False
+        self._blocks = OrderedDict()
+        self._stats = {'requests': 0, 'bytes': 0, 'reads': 0, 'hits': 0}
 
     def _downloader_complete_cb(self, downloader, result):
         self._result = result
@@ -46,34 +72,135 @@ class _HttpRangeFileObject(object):
         downloader = Downloader(self._url)
         downloader.connect('complete', self._downloader_complete_cb)
         getattr(downloader, method)(**kwargs)
+        self._stats['requests'] += 1
 
         while not self._complete:
             Gtk.main_iteration()
 
         if isinstance(self._result, Exception):
             raise self._result
+        return downloader
+
+    def _send_message(self, start, end):
+        # blocking request through the synchronous session
+        message = Soup.Message(method='GET', uri=Soup.URI.new(self._url))
+        message.request_headers.set_range(start, end)
+        self._session.send_message(message)
+        self._stats['requests'] += 1
+
+        if not soup_status_is_successful(message.status_code):
+            raise IOError("HTTP error code %d" % message.status_code)
+        data = message.response_body.flatten().get_as_bytes().get_data()
+        return data, message.response_headers.get_one('Content-Range')
+
+    def _request(self, start, end):
+        # Return the data in the range from start to end, both included,
+        # and the Content-Range header of the response
+        if self._session is not None:
+            return self._send_message(start, end)
+        downloader = self._do_download('download', start=start, end=end)
+        return (self._result.get_data(),
+                downloader.get_response_header('Content-Range'))
+
+    def _fetch(self, start, end):
+        # Fetch the range [start, end), or the last -start bytes when start
+        # is negative, and cache the blocks it covers
+        if start < 0:
+            data, content_range = self._request(start, -1)
+        else:
+            data, content_range = self._request(start, end - 1)
+        self._stats['bytes'] += len(data)
+
+        match = None
+        if content_range is not None:
+            match = _CONTENT_RANGE_RE.match(content_range)
+        if match is not None:
+            start = int(match.group(1))
+            if match.group(3) != '*':
+                self._size = int(match.group(3))
+        else:
+            # The server ignored the range and sent the whole file
+            start = 0
+            self._size = len(data)
+        self._store(start, data)
+
+    def _store(self, start, data):
+        end = start + len(data)
+        index = (start + _BLOCK_SIZE - 1) // _BLOCK_SIZE
+        while index * _BLOCK_SIZE < end:
+            block_start = index * _BLOCK_SIZE
+            block_end = block_start + _BLOCK_SIZE
+            if block_end > end and end != self._size:
+                # only the last block of the file can be short
+                break
+            self._blocks.pop(index, None)
+            self._blocks[index] = data[block_start - start:
+                                       block_end - start]
+            index += 1
+
+    def _evict(self):
+        while len(self._blocks) > _MAX_CACHED_BLOCKS:
+            self._blocks.popitem(last=False)
+
+    def _get_block(self, index):
+        try:
+            data = self._blocks.pop(index)
+        except KeyError:
+            # The server sent less than the range that was asked for
+            raise IOError('Block %d of %s was not received' %
+                          (index, self._url))
+        self._blocks[index] = data
+        return data
+
+    def get_stats(self):
+        """Return the number of requests issued and bytes fetched, and the
+        number of reads and how many of them the cache answered.
+        """
+        return dict(self._stats)
 
     def tell(self):
         return self._offset
 
     def size(self):
         if self._size is None:
-            self._do_download('get_size')
-            if self._result is None:
-                raise IOError("No content length header")
-            self._size = self._result
+            self._fetch(-_TAIL_SIZE, None)
+            if self._size is None:
+                # bytes a-b/* in the Content-Range
+                raise IOError("Unknown size of %s" % self._url)
         return self._size
 
     def read(self, size=-1):
-        if size < 0:
-            end = self.size()
+        file_size = self.size()
+        end = file_size
+        if size >= 0:
+            end = min(end, self._offset + size)
+        if self._offset >= end:
+            return ''
+
+        self._stats['reads'] += 1
+        first = self._offset // _BLOCK_SIZE
+        last = (end - 1) // _BLOCK_SIZE
+        missing = [index for index in xrange(first, last + 1)
+                   if index not in self._blocks]
+        if missing:
+            # Coalesce all the missing blocks, and the ones after them that
+            # are not cached yet, in a single request
+            fetch_last = missing[-1]
+            last_block = (file_size - 1) // _BLOCK_SIZE
+            while fetch_last - missing[-1] < _READ_AHEAD_BLOCKS and \
+                    fetch_last < last_block and \
+                    fetch_last + 1 not in self._blocks:
+                fetch_last += 1
+            self._fetch(missing[0] * _BLOCK_SIZE,
+                        min((fetch_last + 1) * _BLOCK_SIZE, file_size))
         else:
-            end = self._offset + size
-
-        self._complete = False
+            self._stats['hits'] += 1
 
-        self._do_download('download', start=self._offset, end=end - 1)
-        data = self._result.get_data()
+        data = ''.join(self._get_block(index)
+                       for index in xrange(first, last + 1))
+        data = data[self._offset - first * _BLOCK_SIZE:
+                    end - first * _BLOCK_SIZE]
+        self._evict()
         self._offset += len(data)
         return data
 
@@ -86,5 +213,5 @@ class _HttpRangeFileObject(object):
             self._offset = self.size() + offset
 
 
-def open(url):
-    return _HttpRangeFileObject(url)
+def open(url, session=None):
+    return _HttpRangeFileObject(url, session)
@@ -0,0 +1,287 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Extraction of zip archives while they are being downloaded.
+
+The archive is read front to back: every member is decompressed and its
+size and CRC checked as the data arrives, and the central directory at the
+end is checked against the members that were extracted before the result
+is accepted. Archives that can't be read that way (encrypted, zip64, or
+stored members with a trailing data descriptor) are refused with
+ZipStreamUnsupported so the caller can fall back to a regular download.
+"""
+
+import os
+import struct
+import zlib
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_LOCAL_HEADER_SIGNATURE = 'PK\x03\x04'
+_CENTRAL_HEADER = struct.Struct('<4sHHHHHHIIIHHHHHII')
+_CENTRAL_HEADER_SIGNATURE = 'PK\x01\x02'
+_END_SIGNATURE = 'PK\x05\x06'
+_DESCRIPTOR_SIGNATURE = 'PK\x07\x08'
+
+_FLAG_ENCRYPTED = 0x1
+_FLAG_DATA_DESCRIPTOR = 0x8
+
+_STORED = 0
+_DEFLATED = 8
+
+_ZIP64_LIMIT = 0xffffffff
+
+
+class ZipStreamError(Exception):
+    pass
+
+
+class ZipStreamUnsupported(ZipStreamError):
+    pass
+
+
+class _Member(object):
+
+    def __init__(self, name, flags, method, crc, compressed_size, size):
+        self.name = name
+        self.flags = flags
+        self.method = method
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.size = size
+        self.path = None
+        self.output = None
+        self.read = 0
+        self.written = 0
+        self.computed_crc = 0
+        self.decompressor = None
+        if method == _DEFLATED:
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+
+class ZipStreamExtractor(object):
+    """Extract a zip archive fed in chunks into dest_dir
+
+    All the members must be inside one top level directory, which is
+    returned by finish() once the whole archive has been verified.
+    """
+
+    def __init__(self, dest_dir):
+        self._dest_dir = dest_dir
+        self._buffer = ''
+        self._member = None
+        self._members = {}
+        self._root = None
+        self._in_central_directory = False
+        self._done = False
+
+    def feed(self, data):
+        if self._done:
+            return
+        self._buffer += data
+        while self._process():
+            pass
+
+    def finish(self):
+        """Return the path of the extracted top level directory, or raise
+        ZipStreamError if the archive was incomplete or invalid.
+        """
+        if self._member is not None or not self._done:
+            self.abort()
+            raise ZipStreamError('Truncated zip archive')
+        if self._members:
+            self.abort()
+            raise ZipStreamError('Members missing from the central directory')
+        if self._root is None:
+            raise ZipStreamError('Empty zip archive')
+        return os.path.join(self._dest_dir, self._root)
+
+    def abort(self):
+        if self._member is not None and self._member.output is not None:
+            self._member.output.close()
+        self._member = None
+        self._done = True
+
+    def _process(self):
+        if self._done:
+            return False
+        if self._member is not None:
+            return self._process_member_data()
+        if len(self._buffer) < 4:
+            return False
+
+        signature = self._buffer[:4]
+        if signature == _LOCAL_HEADER_SIGNATURE:
+            if self._in_central_directory:
+                raise ZipStreamError('Member after the central directory')
+            return self._process_local_header()
+        elif signature == _CENTRAL_HEADER_SIGNATURE:
+            self._in_central_directory = True
+            return self._process_central_header()
+        elif signature == _END_SIGNATURE:
+            self._done = True
+            self._buffer = ''
+            return False
+        raise ZipStreamError('Invalid zip signature %r' % signature)
+
+    def _process_local_header(self):
+        if len(self._buffer) < _LOCAL_HEADER.size:
+            return False
+        signature_, version_, flags, method, time_, date_, crc, \
+            compressed_size, size, name_length, extra_length = \
+            _LOCAL_HEADER.unpack_from(self._buffer)
+        header_size = _LOCAL_HEADER.size + name_length + extra_length
+        if len(self._buffer) < header_size:
+            return False
+        name = self._buffer[_LOCAL_HEADER.size:
+                            _LOCAL_HEADER.size + name_length]
+        self._buffer = self._buffer[header_size:]
+
+        if flags & _FLAG_ENCRYPTED:
+            raise ZipStreamUnsupported('Encrypted member %r' % name)
+        if compressed_size == _ZIP64_LIMIT or size == _ZIP64_LIMIT:
+            raise ZipStreamUnsupported('Zip64 member %r' % name)
+        if method not in (_STORED, _DEFLATED):
+            raise ZipStreamUnsupported('Compression method %d' % method)
+        if method == _STORED and flags & _FLAG_DATA_DESCRIPTOR:
+            raise ZipStreamUnsupported('Stored member %r of unknown size' %
+                                       name)
+
+        member = _Member(name, flags, method, crc, compressed_size, size)
+        member.path = self._get_member_path(name)
+        if name.endswith('/'):
+            if not os.path.isdir(member.path):
+                os.makedirs(member.path)
+        else:
+            dir_path = os.path.dirname(member.path)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+            member.output = open(member.path, 'wb')
+        self._member = member
+        return True
+
+    def _get_member_path(self, name):
+        parts = name.rstrip('/').split('/')
+        if not name or name.startswith('/') or '\\' in name or \
+                set(parts) & set(['', '.', '..']):
+            raise ZipStreamError('Invalid member name %r' % name)
+
+        if self._root is None:
+            self._root = parts[0]
+        elif parts[0] != self._root:
+            raise ZipStreamError('Member %r outside of %r' %
+                                 (name, self._root))
+        if name in self._members:
+            raise ZipStreamError('Duplicated member %r' % name)
+        return os.path.join(self._dest_dir, *parts)
+
+    def _process_member_data(self):
+        member = self._member
+        if member.flags & _FLAG_DATA_DESCRIPTOR:
+            # Deflated data of unknown size, it ends with the stream
+            if member.decompressor.unused_data:
+                return self._process_descriptor()
+            data = self._buffer
+        else:
+            data = self._buffer[:member.compressed_size - member.read]
+        if not data:
+            if member.read == member.compressed_size and \
+                    not member.flags & _FLAG_DATA_DESCRIPTOR:
+                self._finish_member()
+                return True
+            return False
+
+        self._buffer = self._buffer[len(data):]
+        member.read += len(data)
+        if member.decompressor is not None:
+            try:
+                data = member.decompressor.decompress(data)
+            except zlib.error as e:
+                raise ZipStreamError('Corrupted member %r: %s' %
+                                     (member.name, e))
+            if member.decompressor.unused_data:
+                # Data after the end of the compressed stream
+                unused = member.decompressor.unused_data
+                member.read -= len(unused)
+                self._buffer = unused + self._buffer
+        self._write(member, data)
+        return True
+
+    def _process_descriptor(self):
+        member = self._member
+        if len(self._buffer) < 16:
+            return False
+        if self._buffer[:4] == _DESCRIPTOR_SIGNATURE:
+            descriptor = self._buffer[4:16]
+            self._buffer = self._buffer[16:]
+        else:
+            descriptor = self._buffer[:12]
+            self._buffer = self._buffer[12:]
+        member.crc, member.compressed_size, member.size = \
+            struct.unpack('<III', descriptor)
+        self._finish_member()
+        return True
+
+    def _write(self, member, data):
+        if not data:
+            return
+        if member.output is None:
+            raise ZipStreamError('Data in directory member %r' % member.name)
+        member.output.write(data)
+        member.written += len(data)
+        member.computed_crc = zlib.crc32(data, member.computed_crc)
+
+    def _finish_member(self):
+        member = self._member
+        if member.decompressor is not None:
+            self._write(member, member.decompressor.flush())
+        if member.output is not None:
+            member.output.close()
+            member.output = None
+
+        if member.read != member.compressed_size or \
+                member.written != member.size or \
+                member.computed_crc & 0xffffffff != member.crc:
+            raise ZipStreamError('Corrupted member %r' % member.name)
+
+        self._members[member.name] = member
+        self._member = None
+
+    def _process_central_header(self):
+        if len(self._buffer) < _CENTRAL_HEADER.size:
+            return False
+        fields = _CENTRAL_HEADER.unpack_from(self._buffer)
+        crc, compressed_size_, size = fields[7:10]
+        name_length, extra_length, comment_length = fields[10:13]
+        external_attributes = fields[15]
+        header_size = _CENTRAL_HEADER.size + name_length + extra_length + \
+            comment_length
+        if len(self._buffer) < header_size:
+            return False
+        name = self._buffer[_CENTRAL_HEADER.size:
+                            _CENTRAL_HEADER.size + name_length]
+        self._buffer = self._buffer[header_size:]
+
+        member = self._members.pop(name, None)
+        if member is None or member.crc != crc or member.size != size:
+            raise ZipStreamError('Central directory does not match member '
+                                 '%r' % name)
+
+        # Keep the permissions of executable files, like zipfile users
+        # in the toolkit do
+        mode = (external_attributes >> 16) & 0777
+        if mode and not name.endswith('/'):
+            os.chmod(member.path, mode)
+        return True
@@ -0,0 +1,214 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+from gi.repository import Gtk
+from gi.repository import GLib
+
+from jarabe.model.update import aslo
+
+GLib.threads_init()
+
+base_dir = os.path.dirname(os.getcwd())
+
+# The update checks look at the bundle registry
+os.environ["SUGAR_MIME_DEFAULTS"] = \
+    os.path.join(base_dir, "data", "mime.defaults")
+
+_UPDATE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<RDF:RDF xmlns:RDF="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+        xmlns:em="http://www.mozilla.org/2004/em-rdf#">
+<RDF:Description about="urn:mozilla:extension:%(id)s:%(version)s">
+    <em:version>%(version)s</em:version>
+    <em:targetApplication>
+        <RDF:Description>
+            <em:updateLink>http://example.org/%(id)s.xo</em:updateLink>
+            <em:updateSize>7</em:updateSize>
+        </RDF:Description>
+    </em:targetApplication>
+</RDF:Description></RDF:RDF>
+"""
+
+_NO_UPDATE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<RDF:RDF xmlns:RDF="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+        xmlns:em="http://www.mozilla.org/2004/em-rdf#">
+</RDF:RDF>
+"""
+
+
+class _UpdateHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Stand-in for update-aslo.php
+
+    Bundles with an even number have version 10 available. Lower numbers
+    answer later, so the answers arrive out of order. Answers carry an
+    ETag, and requests that send it back get 304 Not Modified.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        bundle_id = query['id'][0]
+        number = int(bundle_id.rsplit('.', 1)[1][3:])
+
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight,
+                                       server.in_flight)
+        time.sleep(0.02 * (20 - number))
+        with server.lock:
+            server.in_flight -= 1
+
+        etag = '"%s-%d"' % (bundle_id, number % 2)
+        if self.headers.get('If-None-Match') == etag:
+            with server.lock:
+                server.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        if number % 2 == 0:
+            body = _UPDATE_XML % {'id': bundle_id, 'version': 10}
+        else:
+            body = _NO_UPDATE_XML
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UpdateServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Bundle(object):
+    def __init__(self, number):
+        self._number = number
+
+    def get_bundle_id(self):
+        return 'org.sugarlabs.Act%d' % self._number
+
+    def get_name(self):
+        return 'Act%d' % self._number
+
+    def get_activity_version(self):
+        return '1'
+
+
+class TestAslo(unittest.TestCase):
+    def setUp(self):
+        # Keep the response cache of the tests out of the real profile
+        self._sugar_home = os.environ.get('SUGAR_HOME')
+        os.environ['SUGAR_HOME'] = tempfile.mkdtemp()
+
+        self._server = _UpdateServer(("", 0), _UpdateHandler)
+        self._server.lock = threading.Lock()
+        self._server.in_flight = 0
+        self._server.max_in_flight = 0
+        self._server.not_modified = 0
+        self._port = self._server.server_address[1]
+        self._server_thread = threading.Thread(target=self._run_http_server)
+        self._server_thread.daemon = True
+        self._server_thread.start()
+
+        self._update_path = aslo._UPDATE_PATH
+        aslo._UPDATE_PATH = 'http://0.0.0.0:%d/update-aslo.php' % self._port
+
+    def tearDown(self):
+        aslo._UPDATE_PATH = self._update_path
+        self._server.shutdown()
+        self._server_thread.join()
+
+        shutil.rmtree(os.environ['SUGAR_HOME'])
+        if self._sugar_home is None:
+            del os.environ['SUGAR_HOME']
+        else:
+            os.environ['SUGAR_HOME'] = self._sugar_home
+
+    def _run_http_server(self):
+        self._server.serve_forever()
+
+    def _fetch_update_info(self, bundles):
+        result = []
+
+        def completion_cb(updates):
+            result.append(updates)
+
+        def error_cb(error):
+            result.append(error)
+
+        updater = aslo.AsloUpdater()
+        updater.fetch_update_info(bundles, False, lambda *args: None,
+                                  completion_cb, error_cb)
+        while not result:
+            Gtk.main_iteration()
+        return result[0]
+
+    def test_fetch_update_info(self):
+        bundles = [_Bundle(number) for number in range(20)]
+        progress = []
+        result = []
+
+        def progress_cb(name, fraction):
+            progress.append((name, fraction))
+
+        def completion_cb(updates):
+            result.append(updates)
+
+        def error_cb(error):
+            result.append(error)
+
+        updater = aslo.AsloUpdater()
+        updater.fetch_update_info(bundles, False, progress_cb,
+                                  completion_cb, error_cb)
+        while not result:
+            Gtk.main_iteration()
+
+        updates = result[0]
+        self.assertEqual([update.bundle_id for update in updates],
+                         ['org.sugarlabs.Act%d' % number
+                          for number in range(0, 20, 2)])
+        self.assertEqual([name for name, fraction_ in progress],
+                         [bundle.get_name() for bundle in bundles])
+        self.assertEqual(progress[-1][1], 1.0)
+        self.assertTrue(1 < self._server.max_in_flight <=
+                        aslo._MAX_CHECKS_IN_FLIGHT)
+
+    def test_not_modified(self):
+        bundles = [_Bundle(number) for number in range(10)]
+        updates = self._fetch_update_info(bundles)
+        self._server.not_modified = 0
+
+        cached_updates = self._fetch_update_info(bundles)
+        self.assertEqual(self._server.not_modified, len(bundles))
+        self.assertEqual([update.bundle_id for update in cached_updates],
+                         [update.bundle_id for update in updates])
+        self.assertEqual(len(cached_updates), 5)
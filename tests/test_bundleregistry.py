@@ -14,12 +14,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from gi.repository import GLib
+from gi.repository import Gtk
+import logging
 import shutil
 import tempfile
+import threading
+import time
 import unittest
+import zipfile
 import os
 
 from jarabe.model import bundleregistry
+from sugar3.bundle.activitybundle import ActivityBundle
 from sugar3.bundle.helpers import bundle_from_archive
 
 GLib.threads_init()
@@ -31,6 +37,37 @@ base_dir = os.path.dirname(tests_dir)
 os.environ["SUGAR_MIME_DEFAULTS"] = \
     os.path.join(base_dir, "data", "mime.defaults")
 
+_ACTIVITY_INFO = """[Activity]
+name = %(name)s
+activity_version = %(version)s
+bundle_id = %(bundle_id)s
+exec = foo
+"""
+
+# Time each _SlowActivityBundle takes to install, in seconds
+_SLOW_INSTALL_TIME = 0.2
+
+
+def _make_activity_xo(xo_dir, name, bundle_id, version, mime_types=None):
+    """Write an activity bundle shaped like data/activity-1.xo"""
+    path = os.path.join(xo_dir, '%s-%s.xo' % (name, version))
+    info = _ACTIVITY_INFO % {'name': name, 'version': version,
+                             'bundle_id': bundle_id}
+    if mime_types:
+        info += 'mime_types = %s\n' % ';'.join(mime_types)
+    xo = zipfile.ZipFile(path, 'w')
+    xo.writestr('%s.activity/activity/activity.info' % name, info)
+    xo.close()
+    return path
+
+
+class _SlowActivityBundle(ActivityBundle):
+    """Activity bundle whose install is slowed down like on a slow disk"""
+
+    def install(self):
+        time.sleep(_SLOW_INSTALL_TIME)
+        return ActivityBundle.install(self)
+
 
 class TestBundleRegistry(unittest.TestCase):
     def setUp(self):
@@ -61,3 +98,174 @@ class TestBundleRegistry(unittest.TestCase):
         registry.install(bundle)
         installed_bundle = registry.get_bundle("org.sugarlabs.MyActivity")
         self.assertIsNotNone(installed_bundle)
+
+    def test_install_many_activities(self):
+        registry = bundleregistry.get_registry()
+        xo_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, xo_dir)
+
+        paths = []
+        for i in range(20):
+            # Half of the bundles register MIME types
+            mime_types = ['application/x-bench%d' % i] if i % 2 else None
+            paths.append(_make_activity_xo(
+                xo_dir, 'Bench%d' % i, 'org.sugarlabs.Bench%d' % i, 1,
+                mime_types))
+        # Two versions of the same bundle must be installed one after
+        # the other, in the order they were requested
+        paths.append(_make_activity_xo(
+            xo_dir, 'Bench0', 'org.sugarlabs.Bench0', 2))
+
+        results = []
+        progress = []
+        mime_type_installs = {'running': 0, 'max_running': 0}
+        mime_type_lock = threading.Lock()
+        install_mime_type = ActivityBundle.install_mime_type
+
+        def counting_install_mime_type(bundle, install_path):
+            if not bundle.get_mime_types():
+                install_mime_type(bundle, install_path)
+                return
+            with mime_type_lock:
+                mime_type_installs['running'] += 1
+                mime_type_installs['max_running'] = max(
+                    mime_type_installs['max_running'],
+                    mime_type_installs['running'])
+            # Give other installs the chance to overlap
+            time.sleep(0.01)
+            try:
+                install_mime_type(bundle, install_path)
+            finally:
+                with mime_type_lock:
+                    mime_type_installs['running'] -= 1
+
+        ActivityBundle.install_mime_type = counting_install_mime_type
+        self.addCleanup(setattr, ActivityBundle, 'install_mime_type',
+                        install_mime_type)
+
+        def install_cb(bundle, result, user_data):
+            results.append((bundle.get_bundle_id(),
+                            str(bundle.get_activity_version()), result))
+
+        def progress_cb(registry, bundle, state, finished, total):
+            progress.append((state, bundle.get_bundle_id(),
+                             str(bundle.get_activity_version()), finished,
+                             total))
+
+        handler = registry.connect('install-progress', progress_cb)
+        self.addCleanup(registry.disconnect, handler)
+
+        for path in paths:
+            registry.install_async(bundle_from_archive(path), install_cb,
+                                   None)
+        while not progress or progress[-1][0] != 'finished' or \
+                progress[-1][3:] != (len(paths), len(paths)):
+            Gtk.main_iteration()
+
+        self.assertEqual(len(results), len(paths))
+        self.assertEqual([result for id_, version_, result in results],
+                         [True] * len(paths))
+        self.assertEqual([version for bundle_id, version, result_ in results
+                          if bundle_id == 'org.sugarlabs.Bench0'],
+                         ['1', '2'])
+        installed_bundle = registry.get_bundle('org.sugarlabs.Bench0')
+        self.assertEqual(str(installed_bundle.get_activity_version()), '2')
+        self.assertEqual(len([event for event in progress
+                              if event[0] == 'started']), len(paths))
+
+        # No more installs than workers at a time, and the MIME database
+        # is updated for one bundle at a time
+        running = 0
+        max_running = 0
+        for event in progress:
+            running += 1 if event[0] == 'started' else -1
+            max_running = max(max_running, running)
+        self.assertTrue(1 <= max_running <= bundleregistry._INSTALL_WORKERS)
+        self.assertEqual(mime_type_installs['max_running'], 1)
+
+        # The second version of the bundle only starts once the first one
+        # is finished
+        bench0_events = [event[:3] for event in progress
+                         if event[1] == 'org.sugarlabs.Bench0']
+        self.assertEqual(bench0_events,
+                         [('started', 'org.sugarlabs.Bench0', '1'),
+                          ('finished', 'org.sugarlabs.Bench0', '1'),
+                          ('started', 'org.sugarlabs.Bench0', '2'),
+                          ('finished', 'org.sugarlabs.Bench0', '2')])
+
+    def _install_all(self, paths, workers):
+        """Install paths with workers threads, returns the elapsed time, the
+        'started' events and the results, in the order they happened"""
+        install_workers = bundleregistry._INSTALL_WORKERS
+        bundleregistry._INSTALL_WORKERS = workers
+        self.addCleanup(setattr, bundleregistry, '_INSTALL_WORKERS',
+                        install_workers)
+
+        registry = bundleregistry.get_registry()
+        results = []
+        progress = []
+
+        def install_cb(bundle, result, user_data):
+            results.append((bundle.get_bundle_id(),
+                            str(bundle.get_activity_version()), result))
+
+        def progress_cb(registry, bundle, state, finished, total):
+            progress.append((state, bundle.get_bundle_id(),
+                             str(bundle.get_activity_version())))
+
+        handler = registry.connect('install-progress', progress_cb)
+        start = time.time()
+        for path in paths:
+            registry.install_async(_SlowActivityBundle(path), install_cb,
+                                   None)
+        while len([event for event in progress
+                   if event[0] == 'finished']) < len(paths):
+            Gtk.main_iteration()
+        elapsed = time.time() - start
+        registry.disconnect(handler)
+
+        bundleregistry._INSTALL_WORKERS = install_workers
+        return elapsed, progress, results
+
+    def test_install_queue_workers(self):
+        xo_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, xo_dir)
+
+        batches = {}
+        for workers in (1, 3):
+            paths = []
+            for i in range(9):
+                name = 'Workers%dBench%d' % (workers, i)
+                paths.append(_make_activity_xo(
+                    xo_dir, name, 'org.sugarlabs.%s' % name, 1))
+            # Enqueued right after the first version, but it has to wait
+            # for it to be finished
+            name = 'Workers%dBench0' % workers
+            paths.insert(1, _make_activity_xo(
+                xo_dir, name, 'org.sugarlabs.%s' % name, 2))
+            batches[workers] = self._install_all(paths, workers)
+
+        for workers, (elapsed, progress, results) in batches.items():
+            logging.info('Installed %d bundles with %d workers in %.2fs',
+                         len(results), workers, elapsed)
+            self.assertEqual([result for id_, version_, result in results],
+                             [True] * len(results))
+
+            # Tasks start in the order they were enqueued, the second
+            # version only once the first one is finished
+            first_id = 'org.sugarlabs.Workers%dBench0' % workers
+            first_finished = progress.index(('finished', first_id, '1'))
+            second_started = progress.index(('started', first_id, '2'))
+            self.assertTrue(first_finished < second_started)
+            started = [event[1:] for event in progress
+                       if event[0] == 'started']
+            expected = [('org.sugarlabs.Workers%dBench%d' % (workers, i), '1')
+                        for i in range(9)]
+            if workers == 1:
+                expected.insert(1, (first_id, '2'))
+            else:
+                started.remove((first_id, '2'))
+            self.assertEqual(started, expected)
+
+        # The slow installs overlap when there are several workers
+        self.assertTrue(batches[3][0] < batches[1][0] * 0.7)
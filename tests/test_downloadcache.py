@@ -0,0 +1,140 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from gi.repository import Gtk
+
+from jarabe.util import downloadcache
+from jarabe.util.downloadcache import DownloadCache
+
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._cache_dir = os.path.join(self._temp_dir, 'cache')
+        self._max_cache_size = downloadcache._MAX_CACHE_SIZE
+
+    def tearDown(self):
+        downloadcache._MAX_CACHE_SIZE = self._max_cache_size
+        shutil.rmtree(self._temp_dir)
+
+    def _write(self, name, data):
+        path = os.path.join(self._temp_dir, name)
+        with open(path, 'w') as data_file:
+            data_file.write(data)
+        return path
+
+    def _read(self, path):
+        with open(path) as data_file:
+            return data_file.read()
+
+    def test_content_addressed(self):
+        cache = DownloadCache(self._cache_dir)
+        sha256 = cache.add_file(self._write('a.xo', 'bundle'))
+        self.assertEqual(sha256, hashlib.sha256('bundle').hexdigest())
+        self.assertEqual(cache.add_file(self._write('b.xo', 'bundle'),
+                                        'http://example.org/b.xo'), sha256)
+        self.assertEqual(os.listdir(self._cache_dir).count(sha256), 1)
+
+        destination = os.path.join(self._temp_dir, 'copy.xo')
+        self.assertTrue(cache.copy_file(sha256, destination))
+        self.assertEqual(self._read(destination), 'bundle')
+        self.assertFalse(cache.copy_file('0' * 64, destination + '~'))
+
+    def test_copies_are_private(self):
+        cache = DownloadCache(self._cache_dir)
+        path = self._write('a.xo', 'bundle')
+        sha256 = cache.add_file(path)
+        destination = os.path.join(self._temp_dir, 'copy.xo')
+        cache.copy_file(sha256, destination)
+
+        # Writing to the added file or to a copy leaves the cache intact
+        for written_path in (path, destination):
+            with open(written_path, 'w') as written_file:
+                written_file.write('changed')
+        os.unlink(destination)
+        self.assertTrue(cache.copy_file(sha256, destination))
+        self.assertEqual(self._read(destination), 'bundle')
+
+    def test_corrupted_file(self):
+        cache = DownloadCache(self._cache_dir)
+        url = 'http://example.org/a.xo'
+        sha256 = cache.add_file(self._write('a.xo', 'bundle'), url)
+        with open(os.path.join(self._cache_dir, sha256), 'w') as cached:
+            cached.write('changed')
+
+        destination = os.path.join(self._temp_dir, 'copy.xo')
+        self.assertFalse(cache.copy_url(url, destination))
+        self.assertFalse(os.path.exists(destination))
+        self.assertFalse(cache.has_file(sha256))
+        self.assertIsNone(cache.get_validators(url))
+
+    def test_url(self):
+        cache = DownloadCache(self._cache_dir)
+        url = 'http://example.org/a.xo'
+        cache.add_file(self._write('a.xo', 'bundle'), url,
+                       {'etag': '"1"', 'last_modified': None})
+        self.assertEqual(cache.get_request_headers(url),
+                         {'If-None-Match': '"1"'})
+        self.assertEqual(cache.get_request_headers(url + '?'), {})
+
+        # The index is kept on disk
+        cache = DownloadCache(self._cache_dir)
+        self.assertEqual(cache.get_validators(url)['etag'], '"1"')
+        with cache.open_url(url) as cached_file:
+            self.assertEqual(cached_file.read(), 'bundle')
+        self.assertIsNone(cache.open_url(url + '?'))
+
+    def test_evict(self):
+        downloadcache._MAX_CACHE_SIZE = 10
+        cache = DownloadCache(self._cache_dir)
+        first = cache.add_file(self._write('a.xo', 'aaaa'),
+                               'http://example.org/a.xo')
+        second = cache.add_file(self._write('b.xo', 'bbbb'))
+        # Using the first file makes the second the least recently used
+        cache._files[second][1] -= 1
+        cache.copy_file(first, os.path.join(self._temp_dir, 'copy.xo'))
+        third = cache.add_file(self._write('c.xo', 'cccc'))
+
+        self.assertTrue(cache.has_file(first))
+        self.assertFalse(cache.has_file(second))
+        self.assertTrue(cache.has_file(third))
+        self.assertFalse(os.path.exists(os.path.join(self._cache_dir,
+                                                     second)))
+
+        cache.add_file(self._write('d.xo', 'dddddddd'))
+        self.assertFalse(cache.has_file(first))
+        self.assertIsNone(cache.get_validators('http://example.org/a.xo'))
+
+    def test_add_file_async(self):
+        cache = DownloadCache(self._cache_dir)
+        url = 'http://example.org/a.xo'
+        result = []
+        path = self._write('a.xo', 'bundle')
+        cache.add_file_async(path, url, {'etag': '"1"'}, result.append)
+        # The file is not needed once the call returns
+        os.unlink(path)
+        while not result:
+            Gtk.main_iteration()
+
+        self.assertEqual(result, [hashlib.sha256('bundle').hexdigest()])
+        self.assertEqual(cache.get_validators(url)['etag'], '"1"')
+        self.assertEqual(sorted(os.listdir(self._cache_dir)),
+                         sorted([result[0], downloadcache._INDEX_FILE]))
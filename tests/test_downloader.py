@@ -14,8 +14,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
+import json
+import time
+import shutil
+import tempfile
 import unittest
 import threading
+import BaseHTTPServer
 import SimpleHTTPServer
 import SocketServer
 
@@ -23,6 +29,8 @@ from gi.repository import Gtk
 from gi.repository import GLib
 
 from sugar3 import env
+from jarabe.util import downloadcache
+from jarabe.util import downloader as downloader_module
 from jarabe.util.downloader import Downloader
 
 profile_data_dir = os.path.join(env.get_profile_path(), 'data')
@@ -90,3 +98,329 @@ class TestDownloader(unittest.TestCase):
             Gtk.main_iteration()
 
         self.assertEqual(6, self._result)
+
+
+class _RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve the test data with an ETag, and support for If-None-Match,
+    If-Range and single byte ranges"""
+
+    protocol_version = 'HTTP/1.1'
+    etag = '"test"'
+
+    def _send_headers(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+            return ''
+
+        path = os.path.join(data_dir, os.path.basename(self.path))
+        with open(path) as data_file:
+            data = data_file.read()
+        size = len(data)
+
+        match = re.match(r'bytes=(\d+)-(\d*)$',
+                         self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if match is None or (if_range is not None and
+                             if_range != self.etag):
+            self.send_response(200)
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or size - 1), size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, end, size))
+            data = data[start:end + 1]
+            self.server.ranges.append((start, end))
+
+        self.send_header('ETag', self.etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        return data
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        self.wfile.write(self._send_headers())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _RangeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestResumableDownloader(unittest.TestCase):
+    def setUp(self):
+        self._server = _RangeServer(("", 0), _RangeHandler)
+        self._server.ranges = []
+        self._server.not_modified = 0
+        self._port = self._server.server_address[1]
+        self._server_thread = threading.Thread(target=self._run_http_server)
+        self._server_thread.daemon = True
+        self._server_thread.start()
+
+        self._url = "http://0.0.0.0:%d/data/test.txt" % self._port
+        self._min_segment_size = downloader_module._MIN_SEGMENT_SIZE
+
+    def tearDown(self):
+        downloader_module._MIN_SEGMENT_SIZE = self._min_segment_size
+        self._server.shutdown()
+        self._server_thread.join()
+
+    def _run_http_server(self):
+        self._server.serve_forever()
+
+    def _download(self, **kwargs):
+        result = []
+        progress = []
+
+        def progress_cb(downloader, fraction, resumed_size, rate):
+            progress.append((fraction, resumed_size))
+
+        def complete_cb(downloader, result_):
+            result.append(result_)
+
+        downloader = Downloader(self._url)
+        downloader.connect('progress', progress_cb)
+        downloader.connect('complete', complete_cb)
+        downloader.download_to_temp(**kwargs)
+        while not result:
+            Gtk.main_iteration()
+
+        self.assertIsNone(result[0])
+        path = downloader.get_local_file_path()
+        with open(path) as downloaded_file:
+            data = downloaded_file.read()
+        os.unlink(path)
+        return data, progress
+
+    def _wait_for_cache(self):
+        # Downloaded files are hashed and added to the cache in a thread
+        cache = downloadcache.get_cache()
+        while cache.get_validators(self._url) is None:
+            time.sleep(0.01)
+
+    def _write_partial(self, data, state):
+        partial_path, state_path = \
+            downloader_module._get_partial_paths(self._url)
+        if not os.path.isdir(os.path.dirname(partial_path)):
+            os.makedirs(os.path.dirname(partial_path))
+        with open(partial_path, 'w') as partial_file:
+            partial_file.write(data)
+        state['url'] = self._url
+        with open(state_path, 'w') as state_file:
+            json.dump(state, state_file)
+
+    def test_resume(self):
+        self._write_partial('hel', {'etag': _RangeHandler.etag})
+        self.assertTrue(downloader_module.has_partial_download(self._url))
+
+        data, progress = self._download()
+        self.assertEqual("hello\n", data)
+        self.assertEqual(self._server.ranges, [(3, 5)])
+        self.assertEqual(progress[-1], (1.0, 3))
+        self.assertFalse(downloader_module.has_partial_download(self._url))
+
+    def test_resume_changed(self):
+        self._write_partial('xyz', {'etag': '"old"'})
+
+        data, progress = self._download()
+        self.assertEqual("hello\n", data)
+        self.assertEqual(self._server.ranges, [])
+        self.assertEqual(progress[-1], (1.0, 0))
+
+    def test_segments(self):
+        downloader_module._MIN_SEGMENT_SIZE = 2
+
+        data, progress = self._download(segments=3)
+        self.assertEqual("hello\n", data)
+        self.assertEqual(sorted(self._server.ranges),
+                         [(0, 1), (2, 3), (4, 5)])
+        self.assertFalse(downloader_module.has_partial_download(self._url))
+
+    def test_resume_segments(self):
+        downloader_module._MIN_SEGMENT_SIZE = 2
+        self._write_partial('he\0\0o\0', {'etag': _RangeHandler.etag,
+                                          'size': 6,
+                                          'segments': [[2, 3], [5, 5]]})
+
+        data, progress = self._download(segments=3)
+        self.assertEqual("hello\n", data)
+        self.assertEqual(sorted(self._server.ranges), [(2, 3), (5, 5)])
+        self.assertEqual(progress[-1], (1.0, 3))
+
+    def test_download_cache(self):
+        self._download()
+        self._wait_for_cache()
+        data, progress = self._download()
+        self.assertEqual("hello\n", data)
+        self.assertEqual(self._server.not_modified, 1)
+
+    def test_download_cache_evicted(self):
+        self._download()
+        self._wait_for_cache()
+        # The cached file is gone when the server answers 304
+        cache = downloadcache.get_cache()
+        os.unlink(cache._get_path(cache._urls[self._url]['sha256']))
+
+        data, progress = self._download()
+        self.assertEqual("hello\n", data)
+        self.assertEqual(self._server.not_modified, 1)
+        self.assertEqual(progress[-1], (1.0, 0))
+
+    def test_download_uncached(self):
+        self._download(cache=False)
+        data, progress = self._download(cache=False)
+        self.assertEqual("hello\n", data)
+        self.assertEqual(self._server.not_modified, 0)
+        self.assertIsNone(downloadcache.get_cache().get_validators(self._url))
+
+    def test_download_cache_segments(self):
+        downloader_module._MIN_SEGMENT_SIZE = 2
+        self._download(segments=3)
+        self._wait_for_cache()
+        self._server.ranges = []
+
+        data, progress = self._download(segments=3)
+        self.assertEqual("hello\n", data)
+        self.assertEqual(self._server.ranges, [])
+
+
+_LARGE_SIZE = 512 * 1024
+
+
+def _get_large_data():
+    return ''.join(chr(i % 251) for i in xrange(_LARGE_SIZE))
+
+
+class _LargeFileHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Send _LARGE_SIZE bytes, as fast as possible"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        data = _get_large_data()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        for i in range(0, len(data), 1024):
+            self.wfile.write(data[i:i + 1024])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThrottledOutputStream(object):
+    """Stand-in for a Gio.OutputStream on a slow disk, which writes at
+    most 4 KiB per call, one call every few milliseconds"""
+
+    def __init__(self, downloader):
+        self.data = []
+        self.closed = False
+        self.max_pending_size = 0
+        self._downloader = downloader
+        self._pending = False
+        self._count = 0
+
+    def has_pending(self):
+        return self._pending
+
+    def write_bytes_async(self, data, priority, cancellable, callback,
+                          user_data):
+        self.max_pending_size = max(self.max_pending_size,
+                                    self._downloader._pending_size)
+        self._pending = True
+        GLib.timeout_add(2, self._write_cb, data, callback, user_data)
+
+    def _write_cb(self, data, callback, user_data):
+        chunk = data.get_data()[:4096]
+        self.data.append(chunk)
+        self._count = len(chunk)
+        self._pending = False
+        callback(self, None, user_data)
+        return False
+
+    def write_bytes_finish(self, result):
+        return self._count
+
+    def close(self, cancellable):
+        self.closed = True
+
+
+class TestThrottledDownloader(unittest.TestCase):
+    def setUp(self):
+        self._server = _RangeServer(("", 0), _LargeFileHandler)
+        self._port = self._server.server_address[1]
+        self._server_thread = threading.Thread(target=self._run_http_server)
+        self._server_thread.daemon = True
+        self._server_thread.start()
+
+        self._max_pending_size = downloader_module._MAX_PENDING_SIZE
+        downloader_module._MAX_PENDING_SIZE = 32 * 1024
+
+    def tearDown(self):
+        downloader_module._MAX_PENDING_SIZE = self._max_pending_size
+        self._server.shutdown()
+        self._server_thread.join()
+
+    def _run_http_server(self):
+        self._server.serve_forever()
+
+    def test_download_to_stream(self):
+        result = []
+        downloader = Downloader("http://0.0.0.0:%d/large" % self._port)
+        downloader.connect('complete',
+                           lambda downloader, result_: result.append(result_))
+        stream = _ThrottledOutputStream(downloader)
+        downloader.download_to_stream(stream)
+
+        while not result:
+            Gtk.main_iteration()
+
+        self.assertEqual(result, [None])
+        self.assertTrue(stream.closed)
+        self.assertEqual(''.join(stream.data), _get_large_data())
+        # Paused while the writes caught up
+        self.assertTrue(stream.max_pending_size <=
+                        2 * downloader_module._MAX_PENDING_SIZE)
+
+
+class TestSegmentsWriter(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._temp_dir, 'partial')
+        self._state_path = os.path.join(self._temp_dir, 'state')
+        with open(self._path, 'wb') as partial_file:
+            partial_file.write('\0' * 6)
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_write_and_save(self):
+        written = []
+        errors = []
+        closed = []
+        writer = downloader_module._SegmentsWriter(
+            self._path, self._state_path, written.append, errors.append)
+        writer.write(2, 'll')
+        writer.write(0, 'he')
+        writer.save({'segments': [[4, 5]]})
+        writer.close(lambda: closed.append(True))
+        # Nothing is written by the main loop
+        self.assertEqual(written, [])
+
+        while not closed:
+            Gtk.main_iteration()
+
+        self.assertEqual(written, [2, 2])
+        self.assertEqual(errors, [])
+        with open(self._path, 'rb') as partial_file:
+            self.assertEqual(partial_file.read(), 'hell\0\0')
+        with open(self._state_path) as state_file:
+            self.assertEqual(json.load(state_file), {'segments': [[4, 5]]})
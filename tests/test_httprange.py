@@ -0,0 +1,183 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import unittest
+import threading
+import zipfile
+import BaseHTTPServer
+import SocketServer
+
+from gi.repository import GLib
+
+from jarabe.util import httprange
+from jarabe.util.downloader import new_sync_soup_session
+from jarabe.model.update.microformat import MetadataLookup
+
+tests_dir = os.getcwd()
+data_dir = os.path.join(tests_dir, "data")
+
+GLib.threads_init()
+
+
+class _RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve the test data with support for single byte ranges
+
+    The server can hide the size of the files, and send less than the
+    range that was asked for.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests += 1
+        path = os.path.join(data_dir, os.path.basename(self.path))
+        with open(path) as data_file:
+            data = data_file.read()
+        size = len(data)
+
+        match = re.match(r'bytes=(\d*)-(\d*)$',
+                         self.headers.get('Range', ''))
+        if match is None:
+            self.send_response(200)
+        else:
+            if match.group(1):
+                start = int(match.group(1))
+                end = int(match.group(2) or size - 1)
+            else:
+                start = max(0, size - int(match.group(2)))
+                end = size - 1
+            end = min(end, size - 1)
+            if self.server.max_reply is not None:
+                end = min(end, start + self.server.max_reply - 1)
+            self.send_response(206)
+            if self.server.unknown_size:
+                self.send_header('Content-Range',
+                                 'bytes %d-%d/*' % (start, end))
+            else:
+                self.send_header('Content-Range',
+                                 'bytes %d-%d/%d' % (start, end, size))
+            data = data[start:end + 1]
+
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _RangeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestHttpRange(unittest.TestCase):
+    def setUp(self):
+        self._server = _RangeServer(("", 0), _RangeHandler)
+        self._server.requests = 0
+        self._server.unknown_size = False
+        self._server.max_reply = None
+        self._port = self._server.server_address[1]
+        self._server_thread = threading.Thread(target=self._run_http_server)
+        self._server_thread.daemon = True
+        self._server_thread.start()
+
+        self._url = "http://0.0.0.0:%d/data/activity-1.xo" % self._port
+        with open(os.path.join(data_dir, "activity-1.xo")) as data_file:
+            self._data = data_file.read()
+
+        self._block_size = httprange._BLOCK_SIZE
+        self._tail_size = httprange._TAIL_SIZE
+
+    def tearDown(self):
+        httprange._BLOCK_SIZE = self._block_size
+        httprange._TAIL_SIZE = self._tail_size
+        self._server.shutdown()
+        self._server_thread.join()
+
+    def _run_http_server(self):
+        self._server.serve_forever()
+
+    def test_name_lookup(self):
+        fd = httprange.open(self._url)
+        self.assertEqual(fd.size(), len(self._data))
+
+        lookup = MetadataLookup(self._url)
+        name = lookup._name_from_fd(fd)
+        self.assertEqual("My Activity", name)
+
+        # The size request fetched the whole bundle
+        self.assertEqual(fd.get_stats()['requests'], 1)
+        self.assertEqual(self._server.requests, 1)
+
+    def test_small_blocks(self):
+        httprange._BLOCK_SIZE = 64
+        httprange._TAIL_SIZE = 128
+
+        fd = httprange.open(self._url)
+        self.assertEqual(fd.size(), len(self._data))
+        fd.seek(-80, 2)
+        self.assertEqual(fd.read(), self._data[-80:])
+        self.assertEqual(fd.get_stats()['requests'], 1)
+
+        fd.seek(10)
+        self.assertEqual(fd.read(100), self._data[10:110])
+        fd.seek(0)
+        self.assertEqual(fd.read(10), self._data[:10])
+        self.assertEqual(fd.get_stats()['requests'], 2)
+
+        remote = zipfile.ZipFile(fd)
+        local = zipfile.ZipFile(os.path.join(data_dir, "activity-1.xo"))
+        self.assertEqual(remote.namelist(), local.namelist())
+        for name in local.namelist():
+            self.assertEqual(remote.read(name), local.read(name))
+
+        stats = fd.get_stats()
+        self.assertTrue(stats['hits'] > 0)
+        self.assertTrue(stats['requests'] < stats['reads'])
+        self.assertEqual(self._server.requests, stats['requests'])
+
+    def test_unknown_size(self):
+        self._server.unknown_size = True
+
+        fd = httprange.open(self._url)
+        self.assertRaises(IOError, fd.size)
+        self.assertRaises(IOError, fd.read, 10)
+
+    def test_short_reply(self):
+        httprange._BLOCK_SIZE = 64
+        httprange._TAIL_SIZE = 128
+
+        fd = httprange.open(self._url)
+        self.assertEqual(fd.size(), len(self._data))
+
+        self._server.max_reply = 10
+        self.assertRaises(IOError, fd.read, 100)
+
+    def test_sync_session_in_thread(self):
+        result = []
+
+        def lookup():
+            fd = httprange.open(self._url, new_sync_soup_session())
+            result.append(zipfile.ZipFile(fd).namelist())
+            result.append(fd.get_stats()['requests'])
+
+        thread = threading.Thread(target=lookup)
+        thread.start()
+        thread.join()
+
+        local = zipfile.ZipFile(os.path.join(data_dir, "activity-1.xo"))
+        self.assertEqual(result, [local.namelist(), 1])
@@ -0,0 +1,119 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from sugar3.bundle.activitybundle import ActivityBundle
+
+from jarabe.model import registrycache
+from jarabe.model.registrycache import RegistryCache
+
+_ACTIVITY_INFO = """[Activity]
+name = Cached
+activity_version = 3
+bundle_id = org.sugarlabs.Cached
+exec = foo
+"""
+
+
+class TestRegistryCache(unittest.TestCase):
+    def setUp(self):
+        self._environ = dict((key, os.environ.get(key))
+                             for key in ('SUGAR_HOME', 'LANG'))
+        os.environ['SUGAR_HOME'] = tempfile.mkdtemp()
+
+        self._activities_dir = tempfile.mkdtemp()
+        self._bundle_path = os.path.join(self._activities_dir,
+                                         'Cached.activity')
+        os.makedirs(os.path.join(self._bundle_path, 'activity'))
+        self._info_path = os.path.join(self._bundle_path, 'activity',
+                                       'activity.info')
+        with open(self._info_path, 'w') as info_file:
+            info_file.write(_ACTIVITY_INFO)
+
+    def tearDown(self):
+        shutil.rmtree(os.environ['SUGAR_HOME'])
+        shutil.rmtree(self._activities_dir)
+        for key, value in self._environ.iteritems():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def _save_bundle(self):
+        cache = RegistryCache()
+        cache.update(self._bundle_path, ActivityBundle(self._bundle_path))
+        cache.save()
+        return cache._path
+
+    def test_hit(self):
+        self._save_bundle()
+        bundle = RegistryCache().get_bundle(self._bundle_path)
+        self.assertIsInstance(bundle, ActivityBundle)
+        self.assertEqual(bundle.get_bundle_id(), 'org.sugarlabs.Cached')
+        self.assertEqual(bundle.get_activity_version(), '3')
+        self.assertEqual(bundle.get_name(), 'Cached')
+        self.assertEqual(bundle.get_path(), self._bundle_path)
+
+    def test_stale_mtime(self):
+        self._save_bundle()
+        mtime = os.stat(self._info_path).st_mtime + 10
+        os.utime(self._info_path, (mtime, mtime))
+        self.assertIsNone(RegistryCache().get_bundle(self._bundle_path))
+
+    def test_stale_lang(self):
+        os.environ['LANG'] = 'en_US.UTF-8'
+        self._save_bundle()
+        os.environ['LANG'] = 'es_ES.UTF-8'
+        self.assertIsNone(RegistryCache().get_bundle(self._bundle_path))
+
+    def test_corrupt_file(self):
+        cache_path = self._save_bundle()
+        with open(cache_path, 'w') as cache_file:
+            cache_file.write('{"version": ')
+        self.assertIsNone(RegistryCache().get_bundle(self._bundle_path))
+
+    def test_corrupt_entry(self):
+        cache_path = self._save_bundle()
+        with open(cache_path) as cache_file:
+            data = json.load(cache_file)
+        state = data['entries'][self._bundle_path][2]
+        state['_bundle_id'] = ['?', 'org.sugarlabs.Cached']
+        with open(cache_path, 'w') as cache_file:
+            json.dump(data, cache_file)
+        self.assertIsNone(RegistryCache().get_bundle(self._bundle_path))
+
+    def test_missing_attribute(self):
+        cache_path = self._save_bundle()
+        with open(cache_path) as cache_file:
+            data = json.load(cache_file)
+        # Like an entry written before the toolkit set one more attribute
+        del data['entries'][self._bundle_path][2]['_name']
+        with open(cache_path, 'w') as cache_file:
+            json.dump(data, cache_file)
+        self.assertIsNone(RegistryCache().get_bundle(self._bundle_path))
+
+    def test_version(self):
+        cache_path = self._save_bundle()
+        with open(cache_path) as cache_file:
+            data = json.load(cache_file)
+        data['version'] = registrycache._CACHE_VERSION - 1
+        with open(cache_path, 'w') as cache_file:
+            json.dump(data, cache_file)
+        self.assertIsNone(RegistryCache().get_bundle(self._bundle_path))
@@ -0,0 +1,69 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from jarabe.util.zipstream import ZipStreamExtractor
+from jarabe.util.zipstream import ZipStreamError
+
+tests_dir = os.getcwd()
+data_dir = os.path.join(tests_dir, "data")
+
+
+class TestZipStream(unittest.TestCase):
+    def setUp(self):
+        self._dest_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dest_dir)
+
+    def _extract(self, data, chunk_size):
+        extractor = ZipStreamExtractor(self._dest_dir)
+        for i in range(0, len(data), chunk_size):
+            extractor.feed(data[i:i + chunk_size])
+        return extractor.finish()
+
+    def test_extract(self):
+        xo_path = os.path.join(data_dir, 'activity-1.xo')
+        data = open(xo_path).read()
+        root = self._extract(data, 7)
+
+        self.assertEqual(root,
+                         os.path.join(self._dest_dir, 'MyActivity.activity'))
+        info_path = os.path.join(root, 'activity', 'activity.info')
+        expected = zipfile.ZipFile(xo_path).read(
+            'MyActivity.activity/activity/activity.info')
+        self.assertEqual(open(info_path).read(), expected)
+
+    def test_truncated(self):
+        data = open(os.path.join(data_dir, 'activity-1.xo')).read()
+        self.assertRaises(ZipStreamError, self._extract,
+                          data[:len(data) - 30], 4096)
+
+    def test_outside_root(self):
+        xo_path = os.path.join(self._dest_dir, 'bad.xo')
+        xo = zipfile.ZipFile(xo_path, 'w', zipfile.ZIP_DEFLATED)
+        xo.writestr('Bad.activity/activity/activity.info', 'data')
+        xo.writestr('Bad.activity/../../evil', 'data')
+        xo.close()
+
+        self.assertRaises(ZipStreamError, self._extract,
+                          open(xo_path).read(), 4096)
+        self.assertFalse(os.path.exists(
+            os.path.join(os.path.dirname(self._dest_dir), 'evil')))